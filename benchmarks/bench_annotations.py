@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+"""
+Measure annotation memory use and per-return annotation latency.
+
+Reports the memory held by a loaded spec (traced allocations), and the
+time to run create_annotations and draw all annotations for
+all-values.yaml onto a stand-in canvas.
+
+Usage: python benchmarks/bench_annotations.py [--repeat N]
+"""
+
+import argparse
+import gc
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import yaml
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, base_dir)
+
+from ct600_fill.annotations import create_annotations, get_spec
+from ct600_fill.content import TextCanvas
+
+SPECS = ["spec.json", "spec-ct600-2023-v3.json", "spec-ct600-2025-v3.json"]
+
+
+def spec_memory(path):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    spec = get_spec(path)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del spec
+    return after - before
+
+
+def draw(values, spec):
+    annotations = create_annotations(values, spec)
+    for page in annotations:
+        can = TextCanvas()
+        for elt, val in annotations[page]:
+            if val is not None:
+                elt.do(can, val)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Annotation benchmark")
+    parser.add_argument('--repeat', '-r', type=int, default=200,
+                        help='Returns per measurement (default: 200)')
+    args = parser.parse_args()
+
+    with open(os.path.join(base_dir, "all-values.yaml")) as f:
+        values = yaml.safe_load(f)
+
+    print(f"{'spec':28s} {'memory KiB':>11s} {'best ms':>9s} {'median ms':>10s}")
+
+    for name in SPECS:
+
+        path = os.path.join(base_dir, name)
+        memory = spec_memory(path)
+
+        spec = get_spec(path)
+        times = []
+        for i in range(args.repeat):
+            start = time.perf_counter()
+            draw(values, spec)
+            times.append(time.perf_counter() - start)
+
+        print(f"{name:28s} {memory / 1024:11.1f} {min(times) * 1000:9.3f} "
+              f"{statistics.median(times) * 1000:10.3f}")
+
+
+if __name__ == "__main__":
+    main()
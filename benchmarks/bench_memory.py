@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+"""
+Measure peak RSS for filling all-values.yaml.
+
+Each configuration runs in a fresh subprocess, which fills the form and
+reports its peak resident set size (ru_maxrss).  The baseline is the
+process after imports, spec load and template parse, so the difference
+is the cost of the fill and output itself.
+
+Usage: python benchmarks/bench_memory.py [--ct600 PDF] [--spec SPEC]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, os, resource, sys, yaml
+sys.path.insert(0, {base_dir!r})
+from ct600_fill.annotations import create_annotations, get_spec
+from ct600_fill.render import create_pdf
+from ct600_fill.template import get_template
+
+def rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+with open({values!r}) as f:
+    values = yaml.safe_load(f)
+template = get_template({ct600!r})
+annotations = create_annotations(values, get_spec({spec!r}))
+baseline = rss()
+
+with open(os.devnull, "wb") as f:
+    create_pdf(f, template, annotations, engine={engine!r},
+               streaming={streaming!r})
+
+print(json.dumps({{"baseline": baseline, "peak": rss()}}))
+"""
+
+
+def measure(engine, streaming, args):
+    code = CHILD.format(
+        base_dir=base_dir, values=args.input, ct600=args.ct600,
+        spec=args.spec, engine=engine, streaming=streaming,
+    )
+    result = subprocess.run([sys.executable, "-c", code],
+                            capture_output=True, check=True)
+    return json.loads(result.stdout)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Peak RSS benchmark")
+    parser.add_argument('--input', '-i',
+                        default=os.path.join(base_dir, "all-values.yaml"))
+    parser.add_argument('--ct600', '-c',
+                        default=os.path.join(base_dir, "CT600.pdf"))
+    parser.add_argument('--spec', '-s',
+                        default=os.path.join(base_dir, "spec.json"))
+    args = parser.parse_args()
+
+    print(f"{'engine':10s} {'output':10s} {'baseline MiB':>13s} "
+          f"{'peak MiB':>9s} {'fill MiB':>9s}")
+
+    for engine in ("reportlab", "direct"):
+        for streaming in (False, True):
+            r = measure(engine, streaming, args)
+            output = "streaming" if streaming else "pdfwriter"
+            print(f"{engine:10s} {output:10s} {r['baseline'] / 1024:13.1f} "
+                  f"{r['peak'] / 1024:9.1f} "
+                  f"{(r['peak'] - r['baseline']) / 1024:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
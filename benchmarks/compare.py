@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""
+Compare two benchmark results files written by benchmarks/run.py.
+
+For each case in both files, reports the median time before and after and
+the change, marking cases slower or faster than the threshold.  With
+--fail, exits with status 1 if any case is slower than the threshold.
+
+Usage: python benchmarks/compare.py BEFORE.json AFTER.json [--threshold PCT]
+"""
+
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare benchmark results")
+    parser.add_argument('before', help='Baseline results file')
+    parser.add_argument('after', help='New results file')
+    parser.add_argument('--threshold', '-t', type=float, default=10.0,
+                        help='Change in percent to flag (default: 10)')
+    parser.add_argument('--fail', action='store_true',
+                        help='Exit with status 1 if anything got slower '
+                        'than the threshold')
+    args = parser.parse_args()
+
+    before = load(args.before)
+    after = load(args.after)
+
+    print(f"before: {before.get('commit')}")
+    print(f"after:  {after.get('commit')}")
+    print()
+    print(f"{'case':48s} {'before ms':>10s} {'after ms':>10s} {'change':>8s}")
+
+    slower = []
+
+    for name in sorted(before["results"]):
+
+        if name not in after["results"]:
+            continue
+
+        old = before["results"][name]["median"]
+        new = after["results"][name]["median"]
+        change = (new - old) / old * 100 if old else 0.0
+
+        mark = ""
+        if change > args.threshold:
+            mark = "  slower"
+            slower.append(name)
+        elif change < -args.threshold:
+            mark = "  faster"
+
+        print(f"{name:48s} {old * 1000:10.3f} {new * 1000:10.3f} "
+              f"{change:+7.1f}%{mark}")
+
+    missing = sorted(set(before["results"]) ^ set(after["results"]))
+    if missing:
+        print()
+        print("Only in one file: " + ", ".join(missing))
+
+    if args.fail and slower:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
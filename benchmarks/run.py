@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark suite for the fill pipeline, with JSON results for comparing
+commits.
+
+Times single fills of all-values.yaml against each bundled template with
+each engine, sparse against dense inputs, get_spec on each spec file,
+overlay drawing per annotation type, and a batch of returns.  Each case
+reports the best and median of several runs.  Results are written as JSON
+with the commit and environment; compare two results files with
+benchmarks/compare.py.
+
+Usage: python benchmarks/run.py [--output FILE] [--filter TEXT] [--quick]
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, base_dir)
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from ct600_fill.annotations import (
+    create_annotations, font, font_size, get_spec
+)
+from ct600_fill.batch import fill_bulk
+from ct600_fill.content import TextCanvas
+from ct600_fill.inputs import read_values
+from ct600_fill.render import create_pdf
+from ct600_fill.template import Template
+
+# Bundled templates and the spec for each.
+FORMS = [
+    ("CT600.pdf", "spec.json"),
+    ("CT600-2023-v3.pdf", "spec-ct600-2023-v3.json"),
+    ("CT600-2025-v3.pdf", "spec-ct600-2025-v3.json"),
+]
+
+SPECS = ["spec.json", "spec-ct600-2023-v3.json", "spec-ct600-2025-v3.json"]
+
+ENGINES = ["reportlab", "direct"]
+
+# A sparse return: the boxes a dormant company files.
+SPARSE = {
+    "ct600": {
+        1: "Example Biz Ltd.", 2: "12345678", 3: "8596148860", 4: 6,
+        30: datetime.date(2020, 1, 1), 35: datetime.date(2020, 12, 31),
+        145: 0, 235: 0,
+    }
+}
+
+
+def path(name):
+    return os.path.join(base_dir, name)
+
+
+def measure(fn, repeat, warmup=1):
+    for i in range(warmup):
+        fn()
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def fill(template, annotations, engine):
+    def run():
+        create_pdf(io.BytesIO(), template, annotations, engine=engine)
+    return run
+
+
+def fill_cases(values, repeat):
+
+    for template_name, spec_name in FORMS:
+        with open(path(template_name), "rb") as f:
+            template = Template(f.read())
+        annotations = create_annotations(values, get_spec(path(spec_name)))
+        for engine in ENGINES:
+            yield ("fill/%s/%s" % (template_name, engine),
+                   fill(template, annotations, engine), repeat)
+
+
+def density_cases(values, repeat):
+
+    with open(path("CT600.pdf"), "rb") as f:
+        template = Template(f.read())
+    spec = get_spec(path("spec.json"))
+
+    for density, doc in (("sparse", SPARSE), ("dense", values)):
+        annotations = create_annotations(doc, spec)
+        for engine in ENGINES:
+            yield ("density/%s/%s" % (density, engine),
+                   fill(template, annotations, engine), repeat)
+
+
+def spec_cases(repeat):
+    for name in SPECS:
+        yield ("get_spec/%s" % name,
+               lambda name=name: get_spec(path(name)), repeat * 20)
+
+
+# Draws every annotation of one type in all-values.yaml, on a reportlab
+# canvas and on the direct engine's TextCanvas.
+def overlay_cases(values, repeat):
+
+    spec = get_spec(path("spec.json"))
+
+    by_type = {}
+    for page, anns in create_annotations(values, spec).items():
+        for ann, value in anns:
+            by_type.setdefault(type(ann).__name__, []).append((ann, value))
+
+    for name, anns in sorted(by_type.items()):
+
+        def draw_reportlab(anns=anns):
+            can = canvas.Canvas(io.BytesIO(), pagesize=A4)
+            can.setFont(font, font_size)
+            for ann, value in anns:
+                ann.do(can, value)
+            can.save()
+
+        def draw_direct(anns=anns):
+            can = TextCanvas()
+            for ann, value in anns:
+                ann.do(can, value)
+            can.get_data()
+
+        yield ("overlay/%s/reportlab" % name, draw_reportlab, repeat * 5)
+        yield ("overlay/%s/direct" % name, draw_direct, repeat * 5)
+
+
+# Fills a bulk file of returns, alternating dense and sparse values, in one
+# process with the direct engine.
+def batch_cases(values, size):
+
+    def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            bulk = os.path.join(tmp, "returns.jsonl")
+            with open(bulk, "w") as f:
+                for i in range(size):
+                    doc = values if i % 2 == 0 else SPARSE
+                    row = {str(k): v for k, v in doc["ct600"].items()}
+                    row["id"] = "r%d" % i
+                    f.write(json.dumps(row, default=str) + "\n")
+            out = os.path.join(tmp, "out")
+            os.makedirs(out)
+            with open(path("CT600.pdf"), "rb") as f:
+                template_data = f.read()
+            stderr = sys.stderr
+            sys.stderr = io.StringIO()
+            try:
+                count, errors = fill_bulk(bulk, out, get_spec(path("spec.json")),
+                                          template_data, engine="direct")
+            finally:
+                sys.stderr = stderr
+            if errors:
+                raise RuntimeError("batch failed: %s" % errors[0][1])
+
+    yield ("batch/%d/direct" % size, run, 1)
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=base_dir, capture_output=True,
+            check=True
+        ).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Fill benchmark suite")
+    parser.add_argument('--output', '-o',
+                        help='Write results to this JSON file')
+    parser.add_argument('--filter', '-f', action='append', default=[],
+                        help='Only run cases whose name contains this; may '
+                        'be repeated')
+    parser.add_argument('--repeat', '-r', type=int, default=5,
+                        help='Runs per fill case, more for faster cases '
+                        '(default: 5)')
+    parser.add_argument('--batch-size', '-b', type=int, default=1000,
+                        help='Returns in the batch case (default: 1000)')
+    parser.add_argument('--quick', '-q', action='store_true',
+                        help='One run per case and a 50-return batch, for '
+                        'a smoke test')
+    args = parser.parse_args()
+
+    if args.quick:
+        args.repeat = 1
+        args.batch_size = 50
+
+    values = read_values(path("all-values.yaml"))
+
+    cases = []
+    cases.extend(fill_cases(values, args.repeat))
+    cases.extend(density_cases(values, args.repeat))
+    cases.extend(spec_cases(args.repeat))
+    cases.extend(overlay_cases(values, args.repeat))
+    cases.extend(batch_cases(values, args.batch_size))
+
+    if args.filter:
+        cases = [
+            case for case in cases if any(f in case[0] for f in args.filter)
+        ]
+
+    results = {}
+
+    print(f"{'case':48s} {'runs':>5s} {'best ms':>10s} {'median ms':>10s}")
+
+    for name, fn, repeat in cases:
+        times = measure(fn, repeat, warmup=0 if name.startswith("batch/") else 1)
+        results[name] = {
+            "runs": len(times),
+            "best": min(times),
+            "median": statistics.median(times),
+        }
+        print(f"{name:48s} {len(times):5d} {min(times) * 1000:10.3f} "
+              f"{statistics.median(times) * 1000:10.3f}")
+
+    if args.output:
+        record = {
+            "commit": get_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(record, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Wrote {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+
+# asyncio API, for embedding the filler in async services.  Rendering is
+# CPU-bound and file access blocks, so both run in an executor and the
+# event loop only awaits them.  Concurrent fills are bounded by a
+# semaphore.  Values are validated, as the fill server does, before
+# anything is rendered.  The executor must be a thread pool: fills share
+# parsed templates and their locks, which can't be sent to another
+# process.
+#
+#     filler = AsyncFiller(max_concurrency=4, engine="direct")
+#     pdf = await filler.fill(values, template="CT600.pdf", spec="spec.json")
+
+import asyncio
+import weakref
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from ct600_fill.annotations import get_spec
+from ct600_fill.inputs import read_values
+from ct600_fill.render import fill_values
+from ct600_fill.template import Template, get_template
+from ct600_fill.validate import Validator
+
+class AsyncFiller:
+    def __init__(self, max_concurrency=4, executor=None, engine="reportlab"):
+
+        self.max_concurrency = max_concurrency
+        self.engine = engine
+        if isinstance(executor, ProcessPoolExecutor):
+            raise ValueError("AsyncFiller needs a thread pool executor, "
+                             "not a process pool")
+        self.owns_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self.executor = executor
+
+        # Semaphores are per event loop, created on first use inside the
+        # running loop.
+        self.semaphores = weakref.WeakKeyDictionary()
+
+        # Specs loaded from a path and their validators, keyed by path.
+        self.specs = {}
+
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    # A template can be a Template or a path, parsed templates come from
+    # the process-wide template cache.
+    async def get_template(self, template):
+        if isinstance(template, Template):
+            return template
+        return await self.run(get_template, template)
+
+    # A spec can be a loaded spec dict or a path to a spec JSON file.
+    # Returns the spec and a Validator for it; a loaded spec gets a new
+    # Validator each time.
+    async def get_spec(self, spec):
+        if isinstance(spec, dict):
+            return spec, Validator(spec)
+        if spec not in self.specs:
+            loaded = await self.run(get_spec, spec)
+            self.specs[spec] = loaded, Validator(loaded)
+        return self.specs[spec]
+
+    def get_semaphore(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self.semaphores:
+            self.semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self.semaphores[loop]
+
+    def render(self, values, template, spec, engine):
+        with template.lock:
+            return fill_values(values, template, spec, engine=engine)
+
+    # Fills a values document (a dict with a ct600 object), returns the
+    # PDF bytes.  engine overrides the filler's engine.  Values which don't
+    # validate raise ValidationError.
+    async def fill(self, values, template="CT600.pdf", spec="spec.json",
+                   engine=None):
+
+        if engine is None:
+            engine = self.engine
+
+        async with self.get_semaphore():
+            template = await self.get_template(template)
+            spec, validator = await self.get_spec(spec)
+            validator.check(values)
+            return await self.run(self.render, values, template, spec,
+                                  engine)
+
+    # Fills a values file, writing the PDF to output_path.
+    async def fill_file(self, input_path, output_path, template="CT600.pdf",
+                        spec="spec.json", engine=None):
+
+        values = await self.run(read_values, input_path)
+        pdf = await self.fill(values, template=template, spec=spec,
+                              engine=engine)
+        await self.run(write_file, output_path, pdf)
+
+    def close(self):
+        if self.owns_executor:
+            self.executor.shutdown(wait=True)
+
+def write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+default_filler = None
+
+# Fills a values document with a shared default AsyncFiller, returns the
+# PDF bytes.
+async def fill_async(values, template="CT600.pdf", spec="spec.json",
+                     engine="reportlab"):
+
+    global default_filler
+
+    if default_filler is None:
+        default_filler = AsyncFiller()
+
+    return await default_filler.fill(values, template=template, spec=spec,
+                                     engine=engine)
@@ -1,13 +1,19 @@
 
-from reportlab.lib.units import mm
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
+from array import array
 import datetime
 import io
 import json
 
+from ct600_fill.timings import timed
+
+# Points per millimetre, as reportlab.lib.units.mm.  reportlab itself is
+# only imported by get_page and get_overlay, so loading and checking specs
+# doesn't pay for it.
+mm = 72.0 / 2.54 * 0.1
+
 # An annotation, writes a string on a particular page at position x, y
 class WriteString:
+    __slots__ = ("page", "x", "y")
     def __init__(self, page, x, y):
         self.page = page
         self.x = x
@@ -18,6 +24,7 @@ class WriteString:
 
 # An annotation, writes a string on a particular page at position x, y
 class WriteNumber:
+    __slots__ = ("page", "x", "y")
     def __init__(self, page, x, y):
         self.page = page
         self.x = x
@@ -29,6 +36,7 @@ class WriteNumber:
 # An annotation, writes a boolean value on a particular page at position x, y.
 # The boolean value is represented as a letter X (true) or blank for false.
 class WriteBool:
+    __slots__ = ("page", "x", "y")
     def __init__(self, page, x, y):
         self.page = page
         self.x = x
@@ -39,21 +47,59 @@ class WriteBool:
 
 # An annotation, writes a string on a particular page, at x, y position.
 # This is for where a value is written, one character per box.  The pitch
-# parameter defines space between boxes.
+# parameter defines space between boxes.  The box positions in points are
+# worked out the first time the annotation is drawn, as many as the value
+# needs, so a loaded spec doesn't hold tables for boxes never filled.  A
+# canvas class with a drawChars method (see ct600_fill.content.TextCanvas)
+# draws the whole string in one go, and a reportlab canvas draws it as one
+# text object; otherwise each character is drawn with drawString.
 class SpaceString:
+    __slots__ = ("page", "x", "y", "pitch", "_xs")
     def __init__(self, page, x, y, pitch):
         self.page = page
         self.x = x
         self.y = y
         self.pitch = pitch
+        self._xs = ()
+    # Returns the x positions, in points, of at least the first n boxes.
+    # A longer table replaces the old one rather than extending it, so
+    # threads sharing a spec always see a complete table.
+    def get_positions(self, n):
+        xs = self._xs
+        if len(xs) < n:
+            xs = array("d", [(self.x + self.pitch * i) * mm for i in range(n)])
+            self._xs = xs
+        return xs
     def do(self, can, s):
         s = str(s)
+        xs = self.get_positions(len(s))
+        y = self.y * mm
+        if hasattr(type(can), "drawChars"):
+            can.drawChars(xs, y, s)
+            return
+        if hasattr(type(can), "beginText"):
+            # One BT ... ET block, moving along the boxes with Td, rather
+            # than a text object per character.  Blank boxes are skipped.
+            last = len(s) - len(s.lstrip(" "))
+            if last == len(s):
+                return
+            text = can.beginText(xs[last], y)
+            for i in range(last, len(s)):
+                if s[i] == " ":
+                    continue
+                if i != last:
+                    text.moveCursor(xs[i] - xs[last], 0)
+                text.textOut(s[i])
+                last = i
+            can.drawText(text)
+            return
         for i in range(0, len(s)):
-            can.drawString((self.x + self.pitch * i) * mm, self.y * mm, s[i])
+            can.drawString(xs[i], y, s[i])
 
 # Writes a whole currency value.  Same as WriteString, but commas are removed
 # from the number, and the number is rounded to whole currency.
 class WritePounds:
+    __slots__ = ("page", "d")
     def __init__(self, page, x, y):
         self.page = page
         self.d = WriteString(page, x, y)
@@ -66,6 +112,7 @@ class WritePounds:
 # Writes a currency value.  Same as WriteString, but commas are removed
 # from the number.
 class WriteMoney:
+    __slots__ = ("page", "d")
     def __init__(self, page, x, y):
         self.page = page
         self.d = WriteString(page, x, y)
@@ -79,6 +126,7 @@ class WriteMoney:
 # value one digit per box.  The digits paramter defines the number of
 # digits, the number is written right-justified.
 class SpacePounds:
+    __slots__ = ("page", "x", "y", "pitch", "digits", "d")
     def __init__(self, page, x, y, pitch, digits):
         self.page = page
         self.x = x
@@ -96,6 +144,7 @@ class SpacePounds:
 # value one digit per box.  The digits paramter defines the number of
 # digits, the number is written right-justified.
 class SpaceZeroPadNumber:
+    __slots__ = ("page", "x", "y", "pitch", "digits", "d")
     def __init__(self, page, x, y, pitch, digits):
         self.page = page
         self.x = x
@@ -112,6 +161,7 @@ class SpaceZeroPadNumber:
 # Like SpacePounds but includes a pence value.  x,y defines pounds position,
 # x2,y2 defines pence position.
 class SpaceMoney:
+    __slots__ = ("page", "digits", "d", "d2")
     def __init__(self, page, x, y, x2, y2, pitch, digits):
         self.page = page
         self.digits = digits
@@ -133,6 +183,7 @@ class SpaceMoney:
 # Like SpaceString but for dates in dd mm yyyy format.  x,y defines date
 # position, x2,y2 defines month position, x3,y3 defines year position.
 class WriteSpaceDate:
+    __slots__ = ("page", "d", "m", "y")
     def __init__(self, page, x, y, x2, y2, x3, y3, pitch):
         self.page = page
 
@@ -150,6 +201,7 @@ class WriteSpaceDate:
 # Like SpaceString but for sort codes in 123465 format.  x,y defines first
 # 2 digits position, x2,y2 defines second position, x3,y3 defines third
 class WriteSpaceSortCode:
+    __slots__ = ("page", "d", "m", "y")
     def __init__(self, page, x, y, x2, y2, x3, y3, pitch):
         self.page = page
 
@@ -216,24 +268,103 @@ def create_annotations(values, spec):
 
     return pages
 
+font="Courier-Bold"
+font_size=12
+
+# Describes an annotation by type and constructor state, recursing into
+# nested annotations, e.g. ["SpaceString", 0, 148, 201.7, 5.47].  Slots
+# starting with an underscore hold state derived from the rest, and are
+# left out.
+def describe(ann):
+    desc = [type(ann).__name__]
+    for slot in type(ann).__slots__:
+        if slot.startswith("_"):
+            continue
+        v = getattr(ann, slot)
+        if hasattr(type(v), "__slots__"):
+            v = describe(v)
+        desc.append(v)
+    return desc
+
 # Takes a set of annotations and a page number, returns a file-like
-# structure which is a 1-page PDF of annotations for that page.
-def get_page(annotations, page):
+# structure which is a 1-page PDF of annotations for that page.  If an
+# overlay cache is given (see ct600_fill.cache), it's consulted first and
+# new overlays are added to it.  The time taken is recorded in timings, if
+# given, see ct600_fill.timings.
+def get_page(annotations, page, cache=None, timings=None):
+
+    with timed(timings, "get_page", page):
+
+        if cache is not None:
+            key = cache.get_key("reportlab", annotations[page])
+            data = cache.get(key)
+            if data is not None:
+                return io.BytesIO(data)
+
+        from reportlab.lib.pagesizes import A4
+        from reportlab.pdfgen import canvas
+
+        buffer = io.BytesIO()
+        can = canvas.Canvas(buffer, pagesize=A4)
+        can.setFont(font, font_size)
+
+        for elt, val in annotations[page]:
+
+            if val is not None:
+                elt.do(can, val)
+
+        can.save()
+
+        if cache is not None:
+            cache.put(key, buffer.getvalue())
+
+        buffer.seek(0)
 
-    font="Courier-Bold"
-    font_size=12
+        return buffer
+
+# Takes a set of annotations, draws all annotated pages on one canvas.
+# Returns a file-like structure which is a multi-page PDF with one overlay
+# page per annotated page, and a dict mapping form page number to overlay
+# page index.  If an overlay cache is given, the whole overlay is cached
+# under a digest of every page's annotations.  Each page's drawing is
+# recorded in timings as get_page, if given.
+def get_overlay(annotations, cache=None, timings=None):
+
+    index = {page: i for i, page in enumerate(sorted(annotations))}
+
+    if cache is not None:
+        key = cache.get_pages_key("reportlab-overlay", annotations)
+        data = cache.get(key)
+        if data is not None:
+            return io.BytesIO(data), index
+
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
 
     buffer = io.BytesIO()
     can = canvas.Canvas(buffer, pagesize=A4)
-    can.setFont(font, font_size)
 
-    for elt, val in annotations[page]:
+    for page in sorted(annotations):
 
-        if val is not None:
-            elt.do(can, val)
+        with timed(timings, "get_page", page):
 
-    can.save()
-    buffer.seek(0)
+            # Graphics state is reset by showPage, so the font is set per
+            # page.
+            can.setFont(font, font_size)
+
+            for elt, val in annotations[page]:
 
-    return buffer
+                if val is not None:
+                    elt.do(can, val)
+
+            can.showPage()
+
+    with timed(timings, "save_overlay"):
+        can.save()
+
+    if cache is not None:
+        cache.put(key, buffer.getvalue())
+
+    buffer.seek(0)
 
+    return buffer, index
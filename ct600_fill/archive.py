@@ -0,0 +1,64 @@
+
+# Archive containers.  Many returns are filled into one PDF, written by an
+# OptimisingWriter (see ct600_fill.optimise), so the template's objects,
+# which are identical in every return, are stored once rather than once
+# per file.  Each return's pages follow the previous return's, and the
+# document outline has an entry per return, titled with its label, so the
+# container can be browsed in a PDF viewer and returns extracted again.
+
+from ct600_fill.annotations import create_annotations
+from ct600_fill.optimise import OptimisingWriter
+from ct600_fill.render import engines
+from ct600_fill.timings import timed
+
+# Fills returns into an archive.  returns is an iterable of (label,
+# values), values being a values document.  Values should be validated
+# first (see ct600_fill.validate): a return which fails to render leaves
+# the archive incomplete, so the exception should abandon it.  Returns the
+# OptimisingWriter, ready to write.
+def fill_archive(returns, template, spec, engine="reportlab", cache=None,
+                 timings=None):
+
+    output = OptimisingWriter()
+
+    for label, values in returns:
+
+        with timed(timings, "create_annotations"):
+            annotations = create_annotations(values, spec)
+
+        output.add_outline(label)
+        engines[engine](output, template, annotations, cache=cache,
+                        timings=timings)
+
+    return output
+
+# Returns the returns in an archive as a list of (label, first page, page
+# count).  Takes a PdfReader.
+def read_archive(reader):
+
+    starts = [
+        (str(item.title), reader.get_destination_page_number(item))
+        for item in reader.outline if not isinstance(item, list)
+    ]
+
+    returns = []
+    for i, (label, start) in enumerate(starts):
+        end = starts[i + 1][1] if i + 1 < len(starts) else len(reader.pages)
+        returns.append((label, start, end - start))
+
+    return returns
+
+# Writes one return from an archive to outf as a standalone, optimised
+# PDF.  Raises KeyError if there's no return with that label.
+def extract_return(reader, label, outf):
+
+    for name, start, count in read_archive(reader):
+        if name == label:
+            break
+    else:
+        raise KeyError(label)
+
+    output = OptimisingWriter()
+    for page in range(start, start + count):
+        output.add_page(reader.pages[page])
+    output.write(outf)
@@ -0,0 +1,479 @@
+
+# Batch filling.  The spec and CT600 template are loaded once, and then
+# one output PDF is written per input values file.  With a form registry
+# (see ct600_fill.forms), each return's form is chosen by its period
+# instead, and each form is loaded the first time a return needs it.
+# The rendering modules, and the PDF libraries with them, are imported
+# when the first return is filled, so validate_batch doesn't load them.
+
+import glob
+import itertools
+import os
+import sys
+
+from ct600_fill.annotations import create_annotations
+from ct600_fill.cache import OverlayCache
+from ct600_fill.computations import read_ixbrl
+from ct600_fill.derive import apply_rules
+from ct600_fill.inputs import Row, iter_bulk, read_values
+from ct600_fill.timings import Timings, timed
+from ct600_fill.validate import Validator
+
+input_patterns = ("*.yaml", "*.yml", "*.json", "*.msgpack", "*.mpk")
+ixbrl_patterns = ("*.html", "*.htm", "*.xhtml")
+
+# Expands a batch argument into a sorted list of input files.  The
+# argument is either a directory, in which case all values files (or
+# iXBRL files, with ixbrl) in it are used, or a glob pattern.
+def get_batch_inputs(batch, ixbrl=False):
+
+    if os.path.isdir(batch):
+        inputs = []
+        for pattern in ixbrl_patterns if ixbrl else input_patterns:
+            inputs.extend(glob.glob(os.path.join(batch, pattern)))
+    else:
+        inputs = glob.glob(batch)
+
+    return sorted(inputs)
+
+# Reads a manifest file, one input file per line.  Blank lines and lines
+# starting with # are ignored.  Relative paths are relative to the
+# manifest's directory.
+def get_manifest_inputs(manifest):
+
+    base = os.path.dirname(manifest)
+    inputs = []
+
+    with open(manifest, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            inputs.append(os.path.join(base, line))
+
+    return inputs
+
+# Maps an input file to its output PDF in the output directory, e.g.
+# returns/acme.yaml -> out/acme.pdf.  Inputs differing only in directory or
+# extension map to the same output, which fill_tasks reports.
+def get_output_path(input_path, output_dir):
+    base = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir, base + ".pdf")
+
+# Reads a batch source: a bulk input Row, an iXBRL file if there's a
+# mapping, or a values file.  A Row which couldn't be read raises its
+# error.
+def read_source(source, mapping=None):
+
+    if isinstance(source, Row):
+        if source.error is not None:
+            raise source.error
+        return source.values
+
+    if mapping is not None:
+        return read_ixbrl(source, mapping)
+
+    return read_values(source)
+
+def get_label(source):
+    if isinstance(source, Row):
+        return source.label
+    return source
+
+# The name of a source's output, without extension.
+def get_name(source):
+    if isinstance(source, Row):
+        return source.name
+    return os.path.splitext(os.path.basename(source))[0]
+
+# Fills a single return using a parsed Template.  source is an input file
+# or a bulk input Row.  A partially written output is removed on failure.
+# With refill, only pages whose values changed since the last fill are
+# re-rendered, see ct600_fill.refill.  With a Validator, values are checked
+# before any rendering, see ct600_fill.validate.  With a FormRegistry in
+# forms, spec, template and validator come from the return's form instead.
+# With a RuleGraph in rules, or derive and a form with a rules file, the
+# derived boxes are filled in first, see ct600_fill.derive.  Stage
+# durations are recorded in timings, if given, labelled with the form's
+# name when there's a registry.  Returns a list of warnings for values
+# which conflict with the derived ones.
+def fill_one(source, output_path, spec, template, engine="reportlab",
+             streaming=False, refill=False, cache=None, mapping=None,
+             validator=None, timings=None, optimise=False, forms=None,
+             rules=None, derive=False):
+
+    with timed(timings, "load"):
+        values = read_source(source, mapping)
+
+    if forms is not None:
+        with timed(timings, "form"):
+            form = forms.select(values)
+            template, spec, validator = form.load()
+            if derive and rules is None:
+                rules = form.get_rules()
+        if timings is not None:
+            timings.labels["form"] = form.name
+
+    warnings = []
+    if rules is not None:
+        with timed(timings, "derive"):
+            values, warnings = apply_rules(rules, values)
+
+    if validator is not None:
+        with timed(timings, "validate"):
+            validator.check(values)
+
+    with timed(timings, "create_annotations"):
+        annotations = create_annotations(values, spec)
+
+    from ct600_fill.refill import refill_pdf
+    from ct600_fill.render import create_pdf
+
+    if refill:
+        refill_pdf(output_path, template, annotations, engine=engine,
+                   cache=cache, timings=timings)
+        return warnings
+
+    try:
+        with open(output_path, "wb") as f:
+            create_pdf(f, template, annotations, engine=engine,
+                       streaming=streaming, cache=cache, timings=timings,
+                       optimise=optimise)
+    except Exception:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+    return warnings
+
+# Returns fill_one keyword arguments for batch options, creating the
+# validator and overlay cache.  Each worker process has its own in-memory
+# cache; a cache_dir is shared between them.  With a form registry, spec
+# is None and each form has its own validator.
+def get_fill_options(options, spec):
+    options = dict(options)
+    if spec is not None:
+        options["validator"] = Validator(spec)
+    cache_size = options.pop("cache_size", 0)
+    cache_dir = options.pop("cache_dir", None)
+    if cache_size or cache_dir:
+        options["cache"] = OverlayCache(cache_size, cache_dir)
+    return options
+
+# Per-worker state for parallel batches, set once per worker process by
+# init_worker so that the spec and template aren't shipped or parsed with
+# each task.  Given a template path, each worker maps the file itself, see
+# ct600_fill.template.map_file, and only the path is shipped.  A form
+# registry is sent unloaded, so each worker parses only the forms its own
+# returns use.
+worker_spec = None
+worker_template = None
+worker_options = None
+
+def init_worker(spec, template_data, options):
+    global worker_spec, worker_template, worker_options
+    worker_spec = spec
+    worker_template = get_template_data(template_data)
+    worker_options = get_fill_options(options, spec)
+
+# Fills one (source, output_path) task, returns (error, timings,
+# warnings) where error is None on success or the exception on failure.
+# Exceptions are returned rather than raised so that one bad input doesn't
+# abort the rest of a parallel map.  timings is a Timings, without a
+# histogram, if the timings option is set, otherwise None.  Other options
+# are keyword arguments for fill_one.
+def run_task(task, spec, template, options):
+    source, output_path = task
+    options = dict(options)
+    timings = Timings() if options.pop("timings", False) else None
+    warnings = []
+    try:
+        warnings = fill_one(source, output_path, spec, template,
+                            timings=timings, **options)
+        error = None
+    except Exception as e:
+        error = e
+    return error, timings, warnings
+
+# Returns the Template for a batch's template_data: the template's bytes,
+# or the path of the template file, or None with a form registry.
+def get_template_data(template_data):
+    if template_data is None:
+        return None
+    from ct600_fill.template import template_cache
+    if isinstance(template_data, (str, os.PathLike)):
+        return template_cache.get(template_data)
+    return template_cache.get_data(template_data)
+
+# Worker process entry point.
+def fill_task(task):
+    return run_task(task, worker_spec, worker_template, worker_options)
+
+# Fills every input file, writing outputs to output_dir.  With jobs > 1 the
+# returns are rendered in a process pool; results are reported in input
+# order regardless of which worker finishes first.  A failure on one input
+# is reported and doesn't stop the batch.  template_data is the template
+# file's path, which each worker maps, or its bytes.  cache_size (bytes)
+# and cache_dir configure an overlay cache, see ct600_fill.cache.  With a
+# mapping (see ct600_fill.computations.get_mapping), inputs are iXBRL
+# computations.
+# With a histogram (see ct600_fill.timings.get_stage_histogram), every
+# return's stage durations are added to it.  With a FormRegistry in forms,
+# spec and template_data are None and each return is filled on the form
+# for its period.  rules and derive fill in derived boxes, as for
+# fill_one.  Returns a list of (input, exception) for the failed inputs.
+def fill_batch(inputs, output_dir, spec, template_data, jobs=1,
+               engine="reportlab", streaming=False, refill=False,
+               cache_size=0, cache_dir=None, mapping=None, histogram=None,
+               optimise=False, forms=None, rules=None, derive=False):
+
+    options = {
+        "engine": engine, "streaming": streaming, "refill": refill,
+        "cache_size": cache_size, "cache_dir": cache_dir, "mapping": mapping,
+        "timings": histogram is not None, "optimise": optimise,
+        "forms": forms, "rules": rules, "derive": derive,
+    }
+
+    tasks = [
+        (input_path, get_output_path(input_path, output_dir))
+        for input_path in inputs
+    ]
+
+    chunksize = max(1, len(tasks) // (jobs * 4))
+
+    return fill_tasks(iter(tasks), spec, template_data, jobs, options,
+                      chunksize, histogram)
+
+# Fills every return in a bulk input file (see ct600_fill.inputs.iter_bulk)
+# writing outputs to output_dir.  Rows are read as they're needed, so the
+# file is never held in memory.  Options are as for fill_batch.  Returns
+# the number of rows and a list of (row label, exception) for the failed
+# rows.
+def fill_bulk(path, output_dir, spec, template_data, jobs=1,
+              engine="reportlab", streaming=False, refill=False,
+              cache_size=0, cache_dir=None, histogram=None, optimise=False,
+              forms=None, rules=None, derive=False):
+
+    options = {
+        "engine": engine, "streaming": streaming, "refill": refill,
+        "cache_size": cache_size, "cache_dir": cache_dir,
+        "timings": histogram is not None, "optimise": optimise,
+        "forms": forms, "rules": rules, "derive": derive,
+    }
+
+    rows = enumerate(iter_bulk(path), 1)
+    count = 0
+
+    def get_tasks():
+        nonlocal count
+        for count, row in rows:
+            yield row, os.path.join(output_dir, row.name + ".pdf")
+
+    errors = fill_tasks(get_tasks(), spec, template_data, jobs, options, 16,
+                        histogram)
+
+    return count, errors
+
+# Pairs each (source, output_path) task with an error if an earlier task
+# has the same output, e.g. acme.yaml and acme.json, or two bulk rows with
+# the same id, or None.  Such a task isn't run, so one return never
+# silently overwrites another, nor do two workers race to write one file.
+def check_outputs(tasks):
+
+    seen = {}
+
+    for source, output_path in tasks:
+        key = os.path.normcase(os.path.abspath(output_path))
+        if key in seen:
+            yield (source, output_path), ValueError(
+                "output %s is already written for %s" % (output_path,
+                                                         seen[key])
+            )
+        else:
+            seen[key] = get_label(source)
+            yield (source, output_path), None
+
+# Runs an iterator of (source, output_path) tasks.  In parallel, tasks are
+# taken from the iterator a window at a time, enough to keep the workers
+# busy, so a long task stream isn't read in all at once.  A task whose
+# output path is taken fails, see check_outputs.
+def fill_tasks(tasks, spec, template_data, jobs, options, chunksize,
+               histogram=None):
+
+    checked = check_outputs(tasks)
+
+    if jobs == 1:
+        template = get_template_data(template_data)
+        options = get_fill_options(options, spec)
+        results = (
+            (task, (error, None, []) if error is not None else
+             run_task(task, spec, template, options))
+            for task, error in checked
+        )
+        errors = report_results(results, histogram)
+        if "cache" in options:
+            cache = options["cache"]
+            sys.stderr.write("Overlay cache: %d hits, %d misses.\n" %
+                             (cache.hits, cache.misses))
+        return errors
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    errors = []
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                             initargs=(spec, template_data, options)
+                             ) as executor:
+        while True:
+            window = list(itertools.islice(checked, jobs * chunksize * 4))
+            if not window:
+                break
+            filled = executor.map(
+                fill_task, [task for task, error in window if error is None],
+                chunksize=chunksize
+            )
+            results = (
+                (task, (error, None, []) if error is not None else
+                 next(filled))
+                for task, error in window
+            )
+            errors.extend(report_results(results, histogram))
+
+    return errors
+
+# Consumes (task, (error, timings, warnings)) results in task order,
+# writing progress to stderr and adding timings to the histogram, so with
+# a form registry each form's stages are a separate series.
+def report_results(results, histogram=None):
+
+    errors = []
+
+    for (source, output_path), (error, timings, warnings) in results:
+
+        for warning in warnings:
+            sys.stderr.write("%s: warning: %s\n" % (get_label(source),
+                                                    warning))
+
+        if histogram is not None and timings is not None:
+            timings.feed(histogram)
+
+        if error is None:
+            sys.stderr.write("Wrote %s.\n" % output_path)
+        else:
+            sys.stderr.write("%s: %s\n" % (get_label(source), error))
+            errors.append((get_label(source), error))
+
+    return errors
+
+# Fills every source (input files or bulk Rows) into one archive, written
+# to archive_path, see ct600_fill.archive.  Each return is labelled with
+# the name its output would have in a batch.  Returns which can't be read
+# or don't validate are reported and left out; a failure to render
+# abandons the archive.  This runs in one process, as the returns share
+# one output document.  Options are as for fill_batch.  Returns the number
+# of sources and a list of (input, exception) for those left out.  With a
+# RuleGraph in rules, derived boxes are filled in before validating.
+def archive_batch(sources, archive_path, spec, template_data,
+                  engine="reportlab", cache_size=0, cache_dir=None,
+                  mapping=None, histogram=None, rules=None):
+
+    from ct600_fill.archive import fill_archive
+
+    template = get_template_data(template_data)
+    options = get_fill_options(
+        {"cache_size": cache_size, "cache_dir": cache_dir}, spec
+    )
+    validator = options["validator"]
+    timings = Timings(histogram) if histogram is not None else None
+
+    errors = []
+    count = 0
+
+    def get_returns():
+        nonlocal count
+        for count, source in enumerate(sources, 1):
+            try:
+                with timed(timings, "load"):
+                    values = read_source(source, mapping)
+                if rules is not None:
+                    with timed(timings, "derive"):
+                        values, warnings = apply_rules(rules, values)
+                    for warning in warnings:
+                        sys.stderr.write("%s: warning: %s\n" % (
+                            get_label(source), warning
+                        ))
+                with timed(timings, "validate"):
+                    validator.check(values)
+            except Exception as e:
+                sys.stderr.write("%s: %s\n" % (get_label(source), e))
+                errors.append((get_label(source), e))
+                continue
+            yield get_name(source), values
+
+    output = fill_archive(get_returns(), template, spec, engine=engine,
+                          cache=options.get("cache"), timings=timings)
+
+    try:
+        with open(archive_path, "wb") as f:
+            with timed(timings, "write"):
+                output.write(f)
+    except Exception:
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+        raise
+
+    sys.stderr.write("Wrote %s.\n" % archive_path)
+
+    return count, errors
+
+# Validates every source (input files or bulk Rows) without rendering,
+# writing each problem to stderr.  With a FormRegistry in forms, spec is
+# None and each source is checked against the form for its period.  With
+# rules, or derive and forms with rules files, derived boxes are filled in
+# and checked too, and conflicts with supplied values are reported as
+# warnings.  Returns a list of (input, errors) for the invalid inputs, and
+# the number of inputs checked.
+def validate_batch(sources, spec, mapping=None, forms=None, rules=None,
+                   derive=False):
+
+    if forms is None:
+        validator = Validator(spec)
+    invalid = []
+    count = 0
+
+    for count, source in enumerate(sources, 1):
+
+        label = get_label(source)
+
+        warnings = []
+
+        try:
+            values = read_source(source, mapping)
+            source_rules = rules
+            if forms is not None:
+                form = forms.select(values)
+                validator = form.validator
+                if derive and source_rules is None:
+                    source_rules = form.get_rules()
+            if source_rules is not None:
+                values, warnings = apply_rules(source_rules, values)
+        except Exception as e:
+            errors = [str(e)]
+        else:
+            errors = validator.validate(values)
+            if not errors:
+                for box in validator.get_unknown(values):
+                    sys.stderr.write(
+                        "%s: warning: box %s: not on the form\n" % (label, box)
+                    )
+
+        for warning in warnings:
+            sys.stderr.write("%s: warning: %s\n" % (label, warning))
+
+        for error in errors:
+            sys.stderr.write("%s: %s\n" % (label, error))
+
+        if errors:
+            invalid.append((label, errors))
+
+    return invalid, count
@@ -0,0 +1,136 @@
+
+# Content-addressed overlay cache.  Many returns share identical page
+# content (dormant companies, nil returns, pages where only a few boxes
+# differ), so rendered page overlays are cached under a digest of the
+# page's annotations and values.  The in-memory cache is bounded by bytes
+# with least-recently-used eviction, and can be backed by a directory on
+# disk, shared between processes, which isn't size-bounded.
+
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from ct600_fill.annotations import describe
+
+def get_digest(doc):
+    data = json.dumps(doc, default=str, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+class OverlayCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    # Returns the cache key for a page's annotations, a list of
+    # (annotation, value).  kind distinguishes what's cached, e.g. an
+    # engine's overlay format.
+    @staticmethod
+    def get_key(kind, page_annotations):
+        doc = [kind, [[describe(ann), val] for ann, val in page_annotations]]
+        return get_digest(doc)
+
+    # Returns the cache key for several pages' annotations, a dict mapping
+    # page numbers to lists of (annotation, value), e.g. for an overlay
+    # drawn on one canvas.
+    @staticmethod
+    def get_pages_key(kind, annotations):
+        doc = [kind, [
+            [page, [[describe(ann), val] for ann, val in annotations[page]]]
+            for page in sorted(annotations)
+        ]]
+        return get_digest(doc)
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    # Returns cached bytes, or None on a miss.
+    def get(self, key):
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+        data = None
+        if self.directory is not None:
+            try:
+                with open(self.get_path(key), "rb") as f:
+                    data = f.read()
+            except OSError:
+                pass
+
+        with self.lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.insert(key, data)
+            return data
+
+    def put(self, key, data):
+
+        with self.lock:
+            self.insert(key, data)
+
+        if self.directory is not None:
+            path = self.get_path(key)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Written to a temporary file and renamed, so concurrent
+                # readers never see a partial entry.
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+
+    # Adds to the in-memory cache, evicting least recently used entries to
+    # stay within max_bytes.  Called with the lock held.
+    def insert(self, key, data):
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return
+
+        if len(data) > self.max_bytes:
+            return
+
+        self.entries[key] = data
+        self.size += len(data)
+
+        while self.size > self.max_bytes:
+            old_key, old_data = self.entries.popitem(last=False)
+            self.size -= len(old_data)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Metrics in Prometheus text format, so the cache can be added to a
+    # ct600_fill.metrics Registry.
+    def expose(self):
+        lines = []
+        for name, help, kind, value in (
+            ("hits_total", "Overlay cache hits.", "counter", self.hits),
+            ("misses_total", "Overlay cache misses.", "counter", self.misses),
+            ("evictions_total", "Overlay cache evictions.", "counter",
+             self.evictions),
+            ("bytes", "Overlay cache size in bytes.", "gauge", self.size),
+        ):
+            name = "ct600_fill_overlay_cache_" + name
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, kind))
+            lines.append("%s %d" % (name, value))
+        return lines
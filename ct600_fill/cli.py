@@ -3,69 +3,813 @@
 # Reads a UK corporation tax computations file (iXBRL containing HMRC
 # corporation tax schema), and annotates a CT600 PDF template with
 # the numbers.
+#
+# The tool is run many times from scripts, so start-up is kept short: the
+# rest of the package, and the PDF libraries with it, are imported by the
+# functions which use them, and --help and the commands which don't render
+# never load PyPDF2 or reportlab.
 
+import io
+import itertools
+import json
+import os
 import sys
 import argparse
-import yaml
 
-from PyPDF2 import PdfWriter, PdfReader
+from ct600_fill.timings import (
+    Timings, get_histogram_record, get_stage_histogram, report_histogram,
+    timed
+)
 
-from ct600_fill.annotations import create_annotations, get_page, get_spec
+# The names of the rendering engines in ct600_fill.render.engines, which
+# isn't imported until rendering starts.
+engine_names = ["direct", "reportlab"]
 
 
-def create_pdf(outf, template, annotations):
+# PdfWriter needs a seekable output, so unless streaming the output is
+# assembled in memory first.
+def write_stdout(output):
 
-    output = PdfWriter()
+    from ct600_fill.stream import StreamingWriter
 
-    for page in range(0, len(template.pages)):
-        page_data = template.pages[page]
+    if isinstance(output, StreamingWriter):
+        output.write(sys.stdout.buffer)
+    else:
+        buffer = io.BytesIO()
+        output.write(buffer)
+        sys.stdout.buffer.write(buffer.getvalue())
 
-        if page in annotations:
+    sys.stdout.buffer.flush()
 
-            overlay = get_page(annotations, page)
 
-            overlay_pdf = PdfReader(overlay)
+# Adds overlay cache options to a parser.
+def add_cache_arguments(parser, default_size):
+    parser.add_argument('--cache-size', type=float,
+                        default=default_size,
+                        help='Overlay cache size in MiB, 0 to keep no '
+                        'overlays in memory (default: %g)' % default_size)
+    parser.add_argument('--cache-dir',
+                        help='Directory for an on-disk overlay cache, '
+                        'shared between runs and processes')
 
-            page_data.merge_page(overlay_pdf.pages[0])
 
-        output.add_page(page_data)
+def get_cache_size(args):
+    return int(args.cache_size * 1024 * 1024)
 
-    output.write(outf)
+
+# Returns an OverlayCache for the cache options, or None if there's no
+# cache.
+def get_cache(args):
+
+    if args.cache_size <= 0 and not args.cache_dir:
+        return None
+
+    from ct600_fill.cache import OverlayCache
+
+    return OverlayCache(get_cache_size(args), args.cache_dir)
+
+
+# Returns the template path for a batch, unless each return's form is
+# chosen from a registry.  The file is only checked here: each process
+# maps it for itself, so its bytes are shared through the page cache
+# rather than copied to every worker.
+def open_template(args, forms):
+
+    if forms is not None:
+        return None
+
+    with open(args.ct600, "rb"):
+        pass
+    sys.stderr.write("Opened %s.\n" % args.ct600)
+
+    return args.ct600
+
+
+def run_batch(args, spec, mapping, forms=None, rules=None):
+
+    from ct600_fill.batch import (
+        fill_batch, get_batch_inputs, get_manifest_inputs
+    )
+
+    if args.archive:
+        run_archive(args, spec, mapping, rules)
+        return
+
+    if args.bulk:
+        run_bulk(args, spec, forms, rules)
+        return
+
+    if args.batch:
+        inputs = get_batch_inputs(args.batch, ixbrl=mapping is not None)
+    else:
+        inputs = get_manifest_inputs(args.manifest)
+
+    if len(inputs) == 0:
+        sys.stderr.write("No input files found.\n")
+        sys.exit(1)
+
+    template_data = open_template(args, forms)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    jobs = args.jobs
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+
+    histogram = get_histogram(args)
+
+    errors = fill_batch(inputs, args.output_dir, spec, template_data,
+                        jobs=jobs, engine=args.engine,
+                        streaming=args.streaming, refill=args.refill,
+                        cache_size=get_cache_size(args),
+                        cache_dir=args.cache_dir, mapping=mapping,
+                        histogram=histogram, optimise=args.optimise,
+                        forms=forms, rules=rules,
+                        derive=args.derive is not None)
+
+    report_histogram_timings(args, histogram)
+
+    sys.stderr.write(
+        "Filled %d of %d returns.\n" % (len(inputs) - len(errors), len(inputs))
+    )
+
+    if errors:
+        sys.exit(1)
+
+
+# Writes a single fill's timings as requested by --timings and
+# --timings-json.
+def report_timings(args, timings):
+
+    if timings is None:
+        return
+
+    if args.timings:
+        sys.stderr.write("Timings:\n")
+        timings.report(sys.stderr)
+
+    if args.timings_json:
+        timings.write_json(args.timings_json, input=args.input,
+                           template=args.ct600, engine=args.engine)
+
+
+# Writes batch stage histograms as requested by --timings and
+# --timings-json.
+def report_histogram_timings(args, histogram):
+
+    if histogram is None:
+        return
+
+    if args.timings:
+        sys.stderr.write("Timings:\n")
+        report_histogram(histogram, sys.stderr)
+
+    if args.timings_json:
+        record = get_histogram_record(histogram)
+        record["template"] = args.ct600
+        record["engine"] = args.engine
+        with open(args.timings_json, "w") as f:
+            json.dump(record, f, indent=2)
+            f.write("\n")
+
+
+def get_histogram(args):
+    if args.timings or args.timings_json:
+        return get_stage_histogram()
+    return None
+
+
+# Validates the inputs for any mode without filling.
+def run_validate(args, spec, mapping, forms=None, rules=None):
+
+    from ct600_fill.batch import (
+        get_batch_inputs, get_manifest_inputs, validate_batch
+    )
+    from ct600_fill.inputs import iter_bulk
+
+    if args.bulk:
+        sources = iter_bulk(args.bulk)
+    elif args.batch:
+        sources = get_batch_inputs(args.batch, ixbrl=mapping is not None)
+    elif args.manifest:
+        sources = get_manifest_inputs(args.manifest)
+    else:
+        sources = [args.input]
+
+    invalid, count = validate_batch(sources, spec, mapping, forms, rules,
+                                    derive=args.derive is not None)
+
+    sys.stderr.write(
+        "%d of %d inputs valid.\n" % (count - len(invalid), count)
+    )
+
+    if invalid or count == 0:
+        sys.exit(1)
+
+
+def run_bulk(args, spec, forms=None, rules=None):
+
+    from ct600_fill.batch import fill_bulk
+
+    template_data = open_template(args, forms)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    jobs = args.jobs
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+
+    histogram = get_histogram(args)
+
+    count, errors = fill_bulk(args.bulk, args.output_dir, spec,
+                              template_data, jobs=jobs, engine=args.engine,
+                              streaming=args.streaming, refill=args.refill,
+                              cache_size=get_cache_size(args),
+                              cache_dir=args.cache_dir, histogram=histogram,
+                              optimise=args.optimise, forms=forms,
+                              rules=rules, derive=args.derive is not None)
+
+    report_histogram_timings(args, histogram)
+
+    sys.stderr.write(
+        "Filled %d of %d returns.\n" % (count - len(errors), count)
+    )
+
+    if errors:
+        sys.exit(1)
+
+
+# Fills every input of a batch mode into one archive.
+def run_archive(args, spec, mapping, rules=None):
+
+    from ct600_fill.batch import (
+        archive_batch, get_batch_inputs, get_manifest_inputs
+    )
+    from ct600_fill.inputs import iter_bulk
+
+    if args.bulk:
+        sources = iter_bulk(args.bulk)
+    elif args.batch:
+        sources = get_batch_inputs(args.batch, ixbrl=mapping is not None)
+    else:
+        sources = get_manifest_inputs(args.manifest)
+
+    template_data = open_template(args, None)
+
+    histogram = get_histogram(args)
+
+    count, errors = archive_batch(sources, args.archive, spec, template_data,
+                                  engine=args.engine,
+                                  cache_size=get_cache_size(args),
+                                  cache_dir=args.cache_dir, mapping=mapping,
+                                  histogram=histogram, rules=rules)
+
+    report_histogram_timings(args, histogram)
+
+    sys.stderr.write(
+        "Archived %d of %d returns.\n" % (count - len(errors), count)
+    )
+
+    if errors or count == 0:
+        sys.exit(1)
+
+
+def archive_main(argv):
+
+    parser = argparse.ArgumentParser(
+        prog="ct600-fill archive",
+        description="List the returns in an archive written with "
+        "--archive, or extract one as a PDF"
+    )
+    parser.add_argument('archive',
+                        help='Archive PDF file')
+    parser.add_argument('--extract', '-x', metavar='NAME',
+                        help='Extract the return with this name')
+    parser.add_argument('--output', '-o',
+                        help='Output PDF file for --extract (default: '
+                        'NAME.pdf)')
+
+    args = parser.parse_args(argv)
+
+    from PyPDF2 import PdfReader
+
+    from ct600_fill.archive import extract_return, read_archive
+
+    reader = PdfReader(args.archive)
+
+    if not args.extract:
+        for name, start, count in read_archive(reader):
+            print("%s\tpages %d-%d" % (name, start + 1, start + count))
+        return
+
+    output = args.output
+    if output is None:
+        output = args.extract + ".pdf"
+
+    try:
+        with open(output, "wb") as f:
+            extract_return(reader, args.extract, f)
+    except KeyError:
+        os.remove(output)
+        sys.stderr.write("%s: no return named %s\n" % (
+            args.archive, args.extract
+        ))
+        sys.exit(1)
+
+    sys.stderr.write("Wrote %s.\n" % output)
+
+
+def forms_main(argv):
+
+    parser = argparse.ArgumentParser(
+        prog="ct600-fill forms",
+        description="List the forms in a forms file, or identify which "
+        "form a blank template PDF is by its page content"
+    )
+    parser.add_argument('pdf', nargs='*',
+                        help='Template PDF files to identify')
+    parser.add_argument('--forms', '-f',
+                        default="forms.yaml",
+                        help='Forms file (default: forms.yaml)')
+    parser.add_argument('--fingerprint', action='store_true',
+                        help='Print the fingerprint of each PDF, for a '
+                        'forms file')
+
+    args = parser.parse_args(argv)
+
+    from ct600_fill.forms import get_fingerprint, load_registry
+    from ct600_fill.template import get_template
+
+    if args.fingerprint:
+        for path in args.pdf:
+            print("%s\t%s" % (get_fingerprint(get_template(path)), path))
+        return
+
+    try:
+        forms = load_registry(args.forms)
+    except (OSError, ValueError) as e:
+        sys.stderr.write("%s\n" % e)
+        sys.exit(1)
+
+    if not args.pdf:
+        for form in forms:
+            rules = ", ".join(
+                "%s %s" % (key, date.isoformat())
+                for key, date in form.periods.items()
+            )
+            print("%s\t%s\t%s\t%s" % (
+                form.name, form.template_path, form.spec_path,
+                rules or "any period"
+            ))
+        return
+
+    unknown = False
+    for path in args.pdf:
+        form = forms.identify(get_template(path))
+        if form is None:
+            unknown = True
+            print("%s\tunknown" % path)
+        else:
+            print("%s\t%s" % (path, form.name))
+
+    if unknown:
+        sys.exit(1)
+
+
+def derive_main(argv):
+
+    parser = argparse.ArgumentParser(
+        prog="ct600-fill derive",
+        description="Fill in the derived boxes of a values file, or of "
+        "every return in a bulk file, reporting values which conflict "
+        "with the derived ones"
+    )
+    parser.add_argument('rules',
+                        help='Rules file, YAML')
+    parser.add_argument('input',
+                        help='Values file, or JSON-lines or CSV bulk file')
+    parser.add_argument('--output', '-o',
+                        default="-",
+                        help='Output file: YAML for a values file, '
+                        'JSON-lines for a bulk file (default: standard '
+                        'output)')
+
+    args = parser.parse_args(argv)
+
+    import yaml
+
+    from ct600_fill.derive import load_rules
+    from ct600_fill.inputs import Row, bulk_readers, iter_bulk, read_values
+
+    try:
+        rules = load_rules(args.rules)
+    except (OSError, ValueError) as e:
+        sys.stderr.write("%s\n" % e)
+        sys.exit(1)
+
+    bulk = os.path.splitext(args.input)[1].lower() in bulk_readers
+
+    if bulk:
+        rows = iter_bulk(args.input)
+    else:
+        rows = iter([Row(args.input, None, read_values(args.input))])
+
+    outf = sys.stdout if args.output == "-" else open(args.output, "w")
+    failed = 0
+
+    try:
+        while True:
+
+            # A chunk of returns is derived at once, a column at a time.
+            chunk = list(itertools.islice(rows, 1000))
+            if not chunk:
+                break
+
+            derivations = rules.derive_batch([row.values for row in chunk])
+
+            for row, derivation in zip(chunk, derivations):
+
+                for warning in derivation.get_warnings():
+                    sys.stderr.write("%s: warning: %s\n" % (row.label,
+                                                            warning))
+
+                try:
+                    if row.error is not None:
+                        raise row.error
+                    derivation.check()
+                except ValueError as e:
+                    sys.stderr.write("%s: %s\n" % (row.label, e))
+                    failed += 1
+                    continue
+
+                values = derivation.get_values()
+                if bulk:
+                    row = {"id": row.name}
+                    row.update(values["ct600"])
+                    outf.write(json.dumps(row, default=str) + "\n")
+                else:
+                    yaml.safe_dump(values, outf, sort_keys=False)
+
+    finally:
+        if outf is not sys.stdout:
+            outf.close()
+
+    if failed:
+        sys.exit(1)
+
+
+def serve_main(argv):
+
+    parser = argparse.ArgumentParser(
+        prog="ct600-fill serve",
+        description="Run a fill server.  POST a values document to "
+        "/fill or /fill/FORM to get the filled PDF back, GET /metrics "
+        "for request metrics."
+    )
+    parser.add_argument('--host',
+                        default="127.0.0.1",
+                        help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', '-p', type=int,
+                        default=8080,
+                        help='Port to listen on (default: 8080)')
+    parser.add_argument('--socket',
+                        help='Listen on this Unix socket instead of TCP')
+    parser.add_argument('--form', '-f', action='append', default=[],
+                        help='Form to serve, as NAME=TEMPLATE,SPEC; may be '
+                        'repeated, the first is the default (default: '
+                        'default=CT600.pdf,spec.json)')
+    parser.add_argument('--engine', '-e',
+                        default="reportlab", choices=engine_names,
+                        help='Rendering engine (default: reportlab)')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Stream responses as an update to the template '
+                        'rather than buffering a rewritten PDF; this uses '
+                        'less memory but responses are several times larger')
+    add_cache_arguments(parser, 64)
+
+    args = parser.parse_args(argv)
+
+    from ct600_fill.server import FillServer, Form, make_server, parse_form
+
+    if not args.form:
+        args.form = ["default=CT600.pdf,spec.json"]
+
+    forms = []
+    for arg in args.form:
+        try:
+            name, template_path, spec_path = parse_form(arg)
+        except ValueError as e:
+            parser.error(str(e))
+        forms.append(Form(name, template_path, spec_path))
+        sys.stderr.write("Loaded form %s.\n" % name)
+
+    fill_server = FillServer(forms, engine=args.engine,
+                             cache=get_cache(args),
+                             streaming=args.streaming)
+
+    server = make_server(fill_server,
+                         host=args.host, port=args.port, socket=args.socket)
+
+    if args.socket:
+        sys.stderr.write("Listening on %s.\n" % args.socket)
+    else:
+        sys.stderr.write("Listening on %s:%d.\n" % (args.host, args.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+commands = {
+    "archive": archive_main,
+    "derive": derive_main,
+    "forms": forms_main,
+    "serve": serve_main,
+}
 
 
 def main():
 
+    if len(sys.argv) > 1 and sys.argv[1] in commands:
+        commands[sys.argv[1]](sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(
-        description="iXBRL to CT600"
+        description="iXBRL to CT600",
+        epilog="Other commands: " + ", ".join(sorted(commands)) +
+        ", see ct600-fill COMMAND --help"
     )
     parser.add_argument('--input', '-i',
                         default="form-values.yaml",
-                        help='Input computations file (default: form-values.yaml)')
+                        help='Input values file, YAML, JSON or msgpack '
+                        '(default: form-values.yaml)')
+    parser.add_argument('--ixbrl', '-x', metavar='MAPPING',
+                        help='Inputs are iXBRL tax computations; MAPPING is '
+                        'a YAML file mapping iXBRL tag names to box numbers')
     parser.add_argument('--output', '-o',
                         default="output.pdf",
-                        help='Output PDF file')
+                        help='Output PDF file, - for standard output')
+    parser.add_argument('--batch', '-b',
+                        help='Batch mode: directory or glob of input files, '
+                        'one output PDF is written per input')
+    parser.add_argument('--manifest', '-m',
+                        help='Batch mode: file listing input files, one '
+                        'per line')
+    parser.add_argument('--bulk',
+                        help='Batch mode: JSON-lines or CSV file with one '
+                        'return per row, box numbers as columns and an '
+                        'optional id column naming the output')
+    parser.add_argument('--output-dir', '-d',
+                        default=".",
+                        help='Output directory for batch mode (default: .)')
+    parser.add_argument('--jobs', '-j', type=int,
+                        default=1,
+                        help='Batch mode: number of worker processes, 0 for '
+                        'one per CPU (default: 1)')
     parser.add_argument('--ct600', '-c',
                         default="CT600.pdf",
                         help='Input CT600 form')
     parser.add_argument('--spec', '-s',
                         default="spec.json",
-                        help='Annotation specificiations file (default: spec.json)')
+                        help='Annotation specificiations file '
+                        '(default: spec.json)')
+    parser.add_argument('--forms', metavar='FILE',
+                        help='Forms file listing each version of the form '
+                        'and the periods it is for (see forms.yaml); each '
+                        'return is filled on the form for its period, '
+                        'instead of --ct600 and --spec')
+    parser.add_argument('--derive', nargs='?', const=True, metavar='RULES',
+                        help='Fill in derived boxes, such as totals, from '
+                        'the other boxes using a rules file (see '
+                        'rules-ct600-2025-v3.yaml); with --forms and no '
+                        'RULES, each form\'s own rules file')
+    parser.add_argument('--engine', '-e',
+                        default="reportlab", choices=engine_names,
+                        help='Rendering engine: reportlab draws overlays '
+                        'and merges them, direct writes text operators '
+                        'straight into the form (default: reportlab)')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Write output sequentially as an update to the '
+                        'template, passing untouched template objects '
+                        'through without copying them')
+    parser.add_argument('--refill', action='store_true',
+                        help='Re-render only pages whose values changed '
+                        'since the last fill of the same output, reusing '
+                        'the rest from the previous output')
+    parser.add_argument('--optimise', action='store_true',
+                        help='Compress, deduplicate and prune the output, '
+                        'for archiving; slower to write')
+    parser.add_argument('--archive', metavar='FILE',
+                        help='Batch mode: fill every return into one '
+                        'archive PDF, which stores the form once, instead '
+                        'of one PDF per return')
+    add_cache_arguments(parser, 0)
+    parser.add_argument('--validate-only', action='store_true',
+                        help='Check the input values against the spec and '
+                        'report every problem, without filling the form')
+    parser.add_argument('--timings', action='store_true',
+                        help='Report how long each stage of the fill took; '
+                        'in batch mode, totals per stage and page')
+    parser.add_argument('--timings-json', metavar='FILE',
+                        help='Write the timings to FILE as JSON')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='Profile the run with cProfile, writing the '
+                        'stats to FILE (see python -m pstats)')
     parser.add_argument('--verbose', '-v', action='store_true',
                         help='Turn on verbose output.')
 
     args = parser.parse_args()
 
-    form_values = open(args.input, "r").read()
-    values = yaml.safe_load(form_values)
+    if sum(1 for a in (args.batch, args.manifest, args.bulk) if a) > 1:
+        parser.error("--batch, --manifest and --bulk are mutually exclusive")
+
+    if args.bulk and args.ixbrl:
+        parser.error("--bulk can't be combined with --ixbrl")
+
+    if args.jobs < 0:
+        parser.error("--jobs must not be negative")
+
+    if args.refill and args.streaming:
+        parser.error("--refill and --streaming are mutually exclusive")
+
+    if args.refill and args.output == "-":
+        parser.error("--refill needs an output file")
+
+    if args.cache_size < 0:
+        parser.error("--cache-size must not be negative")
+
+    if args.optimise and (args.streaming or args.refill):
+        parser.error("--optimise can't be combined with --streaming or "
+                     "--refill")
+
+    if args.derive is True and not args.forms:
+        parser.error("--derive needs a rules file, unless used with --forms")
+
+    if args.archive:
+        if not (args.batch or args.manifest or args.bulk):
+            parser.error("--archive needs --batch, --manifest or --bulk")
+        if args.streaming or args.refill:
+            parser.error("--archive can't be combined with --streaming or "
+                         "--refill")
+        if args.jobs != 1:
+            parser.error("--archive fills in one process, it can't be "
+                         "combined with --jobs")
+        if args.forms:
+            parser.error("--archive can't be combined with --forms")
+
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            run(args)
+        finally:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            sys.stderr.write("Wrote profile %s.\n" % args.profile)
+    else:
+        run(args)
+
+
+def run(args):
+
+    from ct600_fill.annotations import create_annotations, get_spec
+    from ct600_fill.computations import get_mapping, read_ixbrl
+    from ct600_fill.derive import apply_rules, load_rules
+    from ct600_fill.forms import load_registry
+    from ct600_fill.inputs import read_values
+    from ct600_fill.validate import Validator
+
+    mapping = None
+    if args.ixbrl:
+        try:
+            mapping = get_mapping(args.ixbrl)
+        except (OSError, ValueError) as e:
+            sys.stderr.write("%s\n" % e)
+            sys.exit(1)
+
+    forms = None
+    if args.forms:
+        try:
+            forms = load_registry(args.forms)
+        except (OSError, ValueError) as e:
+            sys.stderr.write("%s\n" % e)
+            sys.exit(1)
+
+    # --derive FILE applies one rules file to every return, plain --derive
+    # each form's own.
+    rules = None
+    if isinstance(args.derive, str):
+        try:
+            rules = load_rules(args.derive)
+        except (OSError, ValueError) as e:
+            sys.stderr.write("%s\n" % e)
+            sys.exit(1)
+
+    # With a forms file, each form's spec is loaded when a return needs it.
+    def get_batch_spec():
+        return get_spec(args.spec) if forms is None else None
+
+    if args.validate_only:
+        run_validate(args, get_batch_spec(), mapping, forms, rules)
+        return
+
+    if args.batch or args.manifest or args.bulk:
+        run_batch(args, get_batch_spec(), mapping, forms, rules)
+        return
+
+    timings = None
+    if args.timings or args.timings_json:
+        timings = Timings()
+
+    try:
+        with timed(timings, "load"):
+            if mapping is not None:
+                values = read_ixbrl(args.input, mapping)
+            else:
+                values = read_values(args.input)
+    except ValueError as e:
+        sys.stderr.write("%s: %s\n" % (args.input, e))
+        sys.exit(1)
     sys.stderr.write("Read %s.\n" % args.input)
 
-    spec = get_spec(args.spec)
-    annotations = create_annotations(values, spec)
+    if forms is not None:
+        try:
+            form = forms.select(values)
+        except ValueError as e:
+            sys.stderr.write("%s: %s\n" % (args.input, e))
+            sys.exit(1)
+        sys.stderr.write("Using form %s.\n" % form.name)
+        try:
+            with timed(timings, "template"):
+                template, spec, validator = form.load()
+            sys.stderr.write("Opened %s.\n" % form.template_path)
+            if args.derive is not None and rules is None:
+                rules = form.get_rules()
+        except (OSError, ValueError) as e:
+            sys.stderr.write("%s\n" % e)
+            sys.exit(1)
+    else:
+        with timed(timings, "get_spec"):
+            spec = get_spec(args.spec)
+        validator = Validator(spec)
 
-    template = PdfReader(open(args.ct600, "rb"))
-    sys.stderr.write("Opened %s.\n" % args.ct600)
+    if rules is not None:
+        try:
+            with timed(timings, "derive"):
+                values, warnings = apply_rules(rules, values)
+        except ValueError as e:
+            sys.stderr.write("%s: %s\n" % (args.input, e))
+            sys.exit(1)
+        for warning in warnings:
+            sys.stderr.write("%s: warning: %s\n" % (args.input, warning))
+
+    with timed(timings, "validate"):
+        errors = validator.validate(values)
+    if errors:
+        for error in errors:
+            sys.stderr.write("%s: %s\n" % (args.input, error))
+        sys.exit(1)
+
+    with timed(timings, "create_annotations"):
+        annotations = create_annotations(values, spec)
+
+    from ct600_fill.refill import refill_pdf
+    from ct600_fill.render import prepare_pdf
+    from ct600_fill.template import get_template
 
-    with open(args.output, "wb") as f:
-        create_pdf(f, template, annotations)
+    if forms is None:
+        with timed(timings, "template"):
+            template = get_template(args.ct600)
+        sys.stderr.write("Opened %s.\n" % args.ct600)
+
+    if args.refill:
+        pages = refill_pdf(args.output, template, annotations,
+                           engine=args.engine, cache=get_cache(args),
+                           timings=timings)
+        sys.stderr.write("Wrote %s, rendered %d of %d pages.\n" % (
+            args.output, len(pages), len(template)
+        ))
+        report_timings(args, timings)
+        return
+
+    output = prepare_pdf(template, annotations, engine=args.engine,
+                         streaming=args.streaming, cache=get_cache(args),
+                         timings=timings, optimise=args.optimise)
+
+    if args.output == "-":
+        with timed(timings, "write"):
+            write_stdout(output)
+        report_timings(args, timings)
+        return
+
+    with timed(timings, "write"):
+        with open(args.output, "wb") as f:
+            output.write(f)
 
     sys.stderr.write("Wrote %s.\n" % args.output)
+
+    report_timings(args, timings)
@@ -1,4 +1,9 @@
 
+import datetime
+import decimal
+import xml.etree.ElementTree as ET
+import yaml
+
 # Takes an ElementTree document and extracts a dict mapping iXBRL tag names
 # to values.  This is intended for UK corporation tax schema, there's a
 # hard-coded UK-specific to get the company number.
@@ -21,3 +26,164 @@ def get_computations(doc):
     values["uk-core:UKCompaniesHouseRegisteredNumber"] = elt.text
 
     return values
+
+ix_ns = "{http://www.xbrl.org/2013/inlineXBRL}"
+xbrli_ns = "{http://www.xbrl.org/2003/instance}"
+
+# Date formats seen in iXBRL date facts, converted to the YYYY-MM-DD form
+# the CT600 date boxes take.
+date_formats = ["%Y-%m-%d", "%d %B %Y", "%d %b %Y", "%d/%m/%Y", "%d.%m.%Y"]
+
+def get_date(text):
+    for fmt in date_formats:
+        try:
+            return datetime.datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            pass
+    return text
+
+# Converts an ix:nonFraction element's text to a number string, applying
+# its sign and scale attributes.  The format attribute says which
+# separators are used: with ixt:numcommadecimal (or num-comma-decimal)
+# the decimal separator is a comma and thousands are separated by dots or
+# spaces, otherwise the decimal separator is a dot and thousands are
+# separated by commas or spaces.  A dash (ixt:fixed-zero) is zero, and a
+# number in brackets is negative.  Raises ValueError for text which isn't
+# a number.
+def get_number(elt, text):
+
+    original = text
+    fmt = elt.get("format", "").split(":")[-1].replace("-", "")
+
+    text = text.replace(" ", "").replace("\u00a0", "")
+
+    negative = text.startswith("(") and text.endswith(")")
+    if negative:
+        text = text[1:-1]
+
+    if fmt == "numcommadecimal":
+        text = text.replace(".", "").replace(",", ".")
+    else:
+        text = text.replace(",", "")
+
+    if text in ("", "-"):
+        text = "0"
+
+    try:
+        value = decimal.Decimal(text)
+        value = value.scaleb(int(elt.get("scale", "0")))
+    except (decimal.InvalidOperation, ValueError):
+        raise ValueError("%s: not a number: %r" % (elt.get("name"), original))
+
+    if not value.is_finite():
+        raise ValueError("%s: not a number: %r" % (elt.get("name"), original))
+
+    if negative:
+        value = -value
+    if elt.get("sign") == "-":
+        value = -value
+
+    return format(value, "f")
+
+fact_tags = {ix_ns + "nonNumeric", ix_ns + "nonFraction"}
+identifier_tag = xbrli_ns + "identifier"
+
+# Returns the name and value of an ix fact element, the value is None for
+# an empty fact.
+def get_fact(elt):
+
+    text = "".join(elt.itertext()).strip()
+    fmt = elt.get("format", "")
+
+    if text == "" and not fmt.endswith("fixed-zero"):
+        return elt.get("name"), None
+
+    if elt.tag == ix_ns + "nonFraction":
+        text = get_number(elt, text)
+    elif "date" in fmt:
+        text = get_date(text)
+
+    return elt.get("name"), text
+
+# Streaming equivalent of get_computations.  Takes a filename or file
+# object, returns a dict mapping iXBRL tag names to values.  Elements are
+# discarded as soon as they've been read, so memory use doesn't grow with
+# the document: tax computations run to megabytes with embedded images.
+# Unlike get_computations, numbers are normalised (see get_number), date
+# facts are converted to YYYY-MM-DD, and text nested in markup inside a
+# fact is included.  A document which isn't well-formed XML raises
+# ValueError.
+def parse_computations(source):
+
+    values = {}
+    company_number = None
+
+    # Open elements, and how many of them are ix facts.  Content inside a
+    # fact is kept until the fact ends.
+    stack = []
+    in_fact = 0
+
+    try:
+        for event, elt in ET.iterparse(source, events=("start", "end")):
+
+            if event == "start":
+                stack.append(elt)
+                if elt.tag in fact_tags:
+                    in_fact += 1
+                continue
+
+            stack.pop()
+
+            if elt.tag in fact_tags:
+                in_fact -= 1
+                name, text = get_fact(elt)
+                if text is not None:
+                    values[name] = text
+
+            elif elt.tag == identifier_tag and company_number is None:
+                company_number = elt.text
+
+            if in_fact == 0:
+                # The element just ended is its parent's last child so far.
+                elt.clear()
+                if stack:
+                    del stack[-1][-1]
+
+    except ET.ParseError as e:
+        raise ValueError("bad iXBRL: %s" % e)
+
+    # The UK Companies House regstered number.
+    if company_number is not None:
+        values["uk-core:UKCompaniesHouseRegisteredNumber"] = company_number
+
+    return values
+
+# Loads a mapping file, YAML mapping iXBRL tag names to CT600 box numbers.
+def get_mapping(file):
+
+    with open(file, "r") as f:
+        try:
+            mapping = yaml.safe_load(f)
+        except yaml.YAMLError as e:
+            raise ValueError("%s: bad YAML: %s" % (file, e))
+
+    if not isinstance(mapping, dict):
+        raise ValueError("%s: mapping should map tag names to boxes" % file)
+
+    return mapping
+
+# Takes computations (as returned by parse_computations) and a mapping,
+# returns a values document for create_annotations.  Tags without a box
+# are ignored.
+def get_values(computations, mapping):
+
+    return {
+        "ct600": {
+            mapping[name]: value
+            for name, value in computations.items() if name in mapping
+        }
+    }
+
+# Reads an iXBRL computations file, returns a values document.
+def read_ixbrl(file, mapping):
+    return get_values(parse_computations(file), mapping)
@@ -0,0 +1,278 @@
+
+# Direct content-stream overlay engine.  The annotation classes only ever
+# call drawString on their canvas, in Courier-Bold 12pt at fixed positions.
+# TextCanvas collects those calls as raw PDF text operators, which are then
+# appended to the template page's own content stream.  This avoids building
+# a reportlab canvas, an intermediate overlay PDF and PyPDF2's merge_page.
+
+from PyPDF2.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, EncodedStreamObject,
+    NameObject
+)
+
+from ct600_fill.annotations import font, font_size
+
+# Resource name for the overlay font, chosen to be unlikely to clash with
+# the template's own font names.
+font_name = "/CT600Fill"
+
+# Courier is monospaced: every glyph is 600/1000 em wide, so this is how
+# far each glyph moves the text position, in points.
+advance = 0.6 * font_size
+
+# Formats a coordinate the way reportlab does, at most 5 decimal places
+# with trailing zeros dropped.
+def fp_str(v):
+    s = "%.5f" % v
+    s = s.rstrip("0").rstrip(".")
+    if s == "-0":
+        s = "0"
+    return s
+
+# Encodes a string as a PDF literal string in WinAnsiEncoding, escaping
+# delimiters and writing non-ASCII bytes in octal.
+def pdf_string(s):
+
+    out = []
+
+    for b in s.encode("cp1252", errors="replace"):
+        if b in (0x28, 0x29, 0x5c):
+            out.append("\\" + chr(b))
+        elif b < 0x20 or b > 0x7e:
+            out.append("\\%03o" % b)
+        else:
+            out.append(chr(b))
+
+    return "(" + "".join(out) + ")"
+
+# Stands in for a reportlab canvas, collecting text operators.
+class TextCanvas:
+    def __init__(self):
+        self.ops = []
+    def drawString(self, x, y, s):
+        self.ops.append(
+            "1 0 0 1 %s %s Tm %s Tj" % (fp_str(x), fp_str(y), pdf_string(s))
+        )
+    # Draws one character of s at each x position in xs, as a single TJ.
+    # Spaces aren't drawn, and after each run of glyphs an offset (in
+    # thousandths of an em, positive moving left) takes the text position
+    # from where the run's advance leaves it to the next glyph's box.
+    def drawChars(self, xs, y, s):
+
+        parts = []
+        run = ""
+        start = None
+        end = None
+
+        for i, c in enumerate(s):
+            if c == " ":
+                continue
+            if start is None:
+                start = xs[i]
+            else:
+                offset = fp_str((end - xs[i]) * 1000 / font_size)
+                if offset != "0":
+                    parts.append(pdf_string(run))
+                    parts.append(offset)
+                    run = ""
+            run += c
+            end = xs[i] + advance
+
+        if start is None:
+            return
+
+        parts.append(pdf_string(run))
+
+        self.ops.append("1 0 0 1 %s %s Tm [%s] TJ" % (
+            fp_str(start), fp_str(y), " ".join(parts)
+        ))
+    def get_ops(self):
+        return "".join(op + "\n" for op in self.ops).encode("latin-1")
+    def get_data(self, font_name=font_name):
+        return wrap_ops(self.get_ops(), font_name)
+
+# Wraps text operators in a text object using font_name.
+def wrap_ops(ops, font_name=font_name):
+    return ("BT\n%s %d Tf\n" % (font_name, font_size)).encode("latin-1") + \
+        ops + b"ET\n"
+
+# Returns the text operators for a page's annotations.  The operators don't
+# depend on the page's resources, so if an overlay cache is given they're
+# cached there.
+def get_ops(page_annotations, cache=None):
+
+    if cache is not None:
+        key = cache.get_key("direct", page_annotations)
+        ops = cache.get(key)
+        if ops is not None:
+            return ops
+
+    can = TextCanvas()
+    for elt, val in page_annotations:
+        if val is not None:
+            elt.do(can, val)
+
+    ops = can.get_ops()
+
+    if cache is not None:
+        cache.put(key, ops)
+
+    return ops
+
+def get_font_resource():
+    res = DictionaryObject()
+    res[NameObject("/Type")] = NameObject("/Font")
+    res[NameObject("/Subtype")] = NameObject("/Type1")
+    res[NameObject("/BaseFont")] = NameObject("/" + font)
+    res[NameObject("/Encoding")] = NameObject("/WinAnsiEncoding")
+    return res
+
+# Content streams must be indirect objects, so new streams are added to
+# the output document.
+def add_stream(output, data):
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    return output._add_object(stream)
+
+# Copies a content stream from another document (e.g. a reportlab overlay)
+# into the output, still encoded.
+def copy_stream(output, stream):
+    if isinstance(stream, EncodedStreamObject):
+        copy = EncodedStreamObject()
+        copy._data = stream._data
+        for k in ("/Filter", "/DecodeParms"):
+            if k in stream:
+                copy[NameObject(k)] = stream[k]
+    else:
+        copy = DecodedStreamObject()
+        copy.set_data(stream.get_data())
+    return output._add_object(copy)
+
+# Objects shared by every overlaid page of one output document: the
+# overlay fonts, added once and referenced from each page's resources, and
+# the q and Q streams which wrap each page's original content.
+class SharedResources:
+    def __init__(self, output):
+        self.output = output
+        self.fonts = {}
+        self.streams = {}
+
+    # Returns a reference to a shared copy of a simple font dictionary
+    # (one whose values are all names, like the standard 14 fonts).  The
+    # obsolete /Name entry is dropped, so equivalent fonts from different
+    # overlays share one object.
+    def get_font(self, resource):
+        resource = {
+            k: v for k, v in resource.items() if k != "/Name"
+        }
+        key = tuple(sorted(resource.items()))
+        if key not in self.fonts:
+            font = DictionaryObject()
+            for k, v in resource.items():
+                font[NameObject(k)] = NameObject(v)
+            self.fonts[key] = self.output._add_object(font)
+        return self.fonts[key]
+
+    def get_stream(self, data):
+        if data not in self.streams:
+            self.streams[data] = add_stream(self.output, data)
+        return self.streams[data]
+
+def get_font_names(page):
+    if "/Resources" not in page:
+        return set()
+    resources = page["/Resources"].get_object()
+    if "/Font" not in resources:
+        return set()
+    return set(resources["/Font"].get_object().keys())
+
+# Appends overlay content, a list of stream references, to an output page,
+# with fonts, a dict of resource name to font reference, added to the
+# page's resources.  The page is one already added to the output document,
+# so changing it doesn't affect the template.  The original content is
+# wrapped in q/Q so that any graphics state it leaves behind doesn't affect
+# the overlay, and is referenced rather than decoded or parsed.
+def append_content(output, page, overlay, fonts, shared):
+
+    # Resource and font dictionaries may be shared with other pages, so
+    # they are copied rather than added to.
+    resources = DictionaryObject()
+    if "/Resources" in page:
+        resources.update(page["/Resources"].get_object())
+
+    page_fonts = DictionaryObject()
+    if "/Font" in resources:
+        page_fonts.update(resources["/Font"].get_object())
+
+    for name, ref in fonts.items():
+        page_fonts[NameObject(name)] = ref
+    resources[NameObject("/Font")] = page_fonts
+    page[NameObject("/Resources")] = resources
+
+    contents = ArrayObject()
+    contents.append(shared.get_stream(b"q\n"))
+    if "/Contents" in page:
+        original = page.raw_get("/Contents")
+        if isinstance(original.get_object(), ArrayObject):
+            contents.extend(original.get_object())
+        else:
+            contents.append(original)
+    contents.append(shared.get_stream(b"Q\n"))
+    contents.extend(overlay)
+    page[NameObject("/Contents")] = contents
+
+# Appends page annotations to an output page's content.  shared holds the
+# output's SharedResources, so all pages reference one font object.
+def add_overlay(output, page, page_annotations, cache=None, shared=None):
+
+    if shared is None:
+        shared = SharedResources(output)
+
+    ops = get_ops(page_annotations, cache)
+
+    names = get_font_names(page)
+    name = font_name
+    while name in names:
+        name = name + "X"
+
+    font_ref = shared.get_font(get_font_resource())
+    append_content(output, page, [add_stream(output, wrap_ops(ops, name))],
+                   {name: font_ref}, shared)
+
+# Returns whether a reportlab overlay page can be stacked on a template
+# page with add_overlay_page: its font names mustn't clash with the page's
+# and its fonts must be simple ones.  If not, the pages should be merged.
+def can_stack(page, overlay):
+
+    names = get_font_names(page)
+    resources = overlay["/Resources"].get_object()
+    if set(resources.keys()) - {"/Font", "/ProcSet"}:
+        return False
+
+    for name, resource in resources["/Font"].get_object().items():
+        if name in names or not all(
+            isinstance(v, NameObject) for v in resource.get_object().values()
+        ):
+            return False
+
+    return True
+
+# Appends a reportlab overlay page's content to an output page, in place of
+# merge_page.  The overlay's content is copied still encoded and its fonts
+# are replaced by shared ones, so neither page's content is parsed or
+# rewritten.
+def add_overlay_page(output, page, overlay, shared):
+
+    fonts = {
+        name: shared.get_font(resource.get_object())
+        for name, resource
+        in overlay["/Resources"].get_object()["/Font"].get_object().items()
+    }
+
+    contents = overlay["/Contents"].get_object()
+    if not isinstance(contents, ArrayObject):
+        contents = [contents]
+
+    append_content(output, page, [
+        copy_stream(output, stream.get_object()) for stream in contents
+    ], fonts, shared)
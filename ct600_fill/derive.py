@@ -0,0 +1,489 @@
+
+# Derived boxes.  Many boxes on the form are arithmetic on others, e.g.
+# box 165 is box 155 minus box 160.  A rules file gives each derived box
+# as an expression over other boxes, and compile_rules turns the rules
+# into a RuleGraph: each expression is checked and compiled to Python
+# once, and the boxes are put in dependency order so one pass computes
+# them all.
+#
+# Expressions use box references (b155), numbers, + - * /, brackets, and
+# min, max, abs and round(x, places), places being a whole number.
+# Arithmetic is decimal, so pounds and pence add up exactly.  A blank
+# input counts as zero, but a derived box whose inputs are all blank is
+# left blank rather than filled with 0.
+# A value supplied for a derived box overrides the derived value, and if
+# they differ it's reported as a conflict.
+#
+# A Derivation records one return's values, so when an input changes
+# RuleGraph.update recomputes only the boxes downstream of it.
+# derive_batch evaluates a batch of returns a column at a time: each rule
+# is applied to every return in one comprehension, rather than walking
+# the graph once per return.
+
+import ast
+import decimal
+import re
+
+from decimal import Decimal
+
+import yaml
+
+# Raised for a rules file which doesn't compile.
+class RulesError(ValueError):
+    pass
+
+box_name = re.compile(r"b(\d+)$")
+
+binary_ops = {ast.Add: "+", ast.Sub: "-", ast.Mult: "*"}
+unary_ops = {ast.UAdd: "+", ast.USub: "-"}
+functions = {"min": "_min", "max": "_max", "abs": "_abs", "round": "_round"}
+
+# The fewest and most arguments each function takes, None for no limit,
+# and how that reads in an error.
+arities = {
+    "min": (2, None, "at least 2 arguments"),
+    "max": (2, None, "at least 2 arguments"),
+    "abs": (1, 1, "1 argument"),
+    "round": (1, 2, "1 or 2 arguments"),
+}
+
+def zero(value):
+    return value if value is not None else Decimal(0)
+
+def divide(a, b):
+    if b == 0:
+        raise ZeroDivisionError("division by zero")
+    return a / b
+
+# Rounds half away from zero, as money is, rather than to even as Python's
+# round does.
+def round_places(value, places=0):
+    return value.quantize(Decimal(1).scaleb(-int(places)),
+                          rounding=decimal.ROUND_HALF_UP)
+
+environment = {
+    "Decimal": Decimal,
+    "_z": zero,
+    "_div": divide,
+    "_min": min,
+    "_max": max,
+    "_abs": abs,
+    "_round": round_places,
+}
+
+# Converts an expression's syntax tree to Python source, collecting the
+# boxes it refers to.  Anything but the operations above is rejected.
+def to_source(node, deps):
+
+    if isinstance(node, ast.Expression):
+        return to_source(node.body, deps)
+
+    if isinstance(node, ast.BinOp):
+        left = to_source(node.left, deps)
+        right = to_source(node.right, deps)
+        if isinstance(node.op, ast.Div):
+            return "_div(%s, %s)" % (left, right)
+        if type(node.op) in binary_ops:
+            return "(%s %s %s)" % (left, binary_ops[type(node.op)], right)
+
+    elif isinstance(node, ast.UnaryOp) and type(node.op) in unary_ops:
+        return "(%s%s)" % (unary_ops[type(node.op)],
+                           to_source(node.operand, deps))
+
+    elif isinstance(node, ast.Constant) and \
+         isinstance(node.value, (int, float)) and \
+         not isinstance(node.value, bool):
+        return "Decimal(%r)" % str(node.value)
+
+    elif isinstance(node, ast.Name):
+        m = box_name.match(node.id)
+        if m is None:
+            raise RulesError("unknown name %s, boxes are written b155" %
+                             node.id)
+        deps.add(int(m.group(1)))
+        return "_z(%s)" % node.id
+
+    elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+         and node.func.id in functions and not node.keywords:
+        name = node.func.id
+        fewest, most, wanted = arities[name]
+        if len(node.args) < fewest or \
+           (most is not None and len(node.args) > most):
+            raise RulesError("%s takes %s, not %d" %
+                             (name, wanted, len(node.args)))
+        args = [to_source(arg, deps) for arg in node.args[:1]]
+        if name == "round" and len(node.args) == 2:
+            places = node.args[1]
+            if not isinstance(places, ast.Constant) or \
+               type(places.value) is not int:
+                raise RulesError("round's places should be a whole number")
+            args.append(repr(places.value))
+        else:
+            args.extend(to_source(arg, deps) for arg in node.args[1:])
+        return "%s(%s)" % (functions[name], ", ".join(args))
+
+    raise RulesError("unsupported expression: %s" % type(node).__name__)
+
+# One derived box: the expression, the boxes it uses, and two compiled
+# functions.  row takes the value of each dependency for one return, in
+# deps order, and column takes a list of values for each dependency and
+# returns a list of results.
+class Rule:
+    def __init__(self, box, expression):
+
+        self.box = box
+        self.expression = expression
+
+        try:
+            tree = ast.parse(str(expression).strip(), mode="eval")
+        except SyntaxError as e:
+            raise RulesError("box %s: bad expression: %s" % (box, e.msg))
+
+        deps = set()
+        try:
+            source = to_source(tree, deps)
+        except RulesError as e:
+            raise RulesError("box %s: %s" % (box, e))
+
+        if not deps:
+            raise RulesError("box %s: rule doesn't use any boxes" % box)
+
+        self.deps = sorted(deps)
+
+        names = ["b%d" % dep for dep in self.deps]
+        blank = " and ".join("%s is None" % name for name in names)
+        row = "None if %s else %s" % (blank, source)
+
+        self.row = eval("lambda %s: %s" % (", ".join(names), row),
+                        environment)
+        self.column = eval("lambda %s: [%s for %s, in zip(%s)]" % (
+            ", ".join("c" + name for name in names), row, ", ".join(names),
+            ", ".join("c" + name for name in names)
+        ), environment)
+
+# Converts a supplied value to a Decimal.  Raises ValueError for a value
+# which isn't a number.
+def to_decimal(box, value):
+
+    if value is None:
+        return None
+
+    if isinstance(value, bool):
+        raise ValueError("box %s: not a number: %r" % (box, value))
+
+    try:
+        number = Decimal(str(value).strip())
+    except decimal.InvalidOperation:
+        raise ValueError("box %s: not a number: %r" % (box, value))
+
+    if not number.is_finite():
+        raise ValueError("box %s: not a number: %r" % (box, value))
+
+    return number
+
+# Converts a derived Decimal to a plain number for a values document.
+def to_number(value):
+    if value == value.to_integral_value():
+        return int(value)
+    return float(value)
+
+# The derived boxes of one return.  supplied is the return's box values as
+# given; numbers holds the value each box in the graph takes, supplied or
+# derived, as a Decimal or None; derived holds what each derived box
+# works out at.  A supplied value which differs from the derived one is in
+# conflicts, as (supplied, derived); a box which couldn't be worked out
+# (a supplied value which isn't a number, or a division by zero) is in
+# errors.
+class Derivation:
+    def __init__(self, supplied):
+        self.supplied = supplied
+        self.numbers = {}
+        self.derived = {}
+        self.conflicts = {}
+        self.errors = {}
+
+    # Returns a values document with the derived boxes filled in, supplied
+    # values taking precedence.
+    def get_values(self):
+        ct600 = dict(self.supplied)
+        for box, value in self.derived.items():
+            if ct600.get(box) is None and value is not None:
+                ct600[box] = to_number(value)
+        return {"ct600": ct600}
+
+    # Returns warning messages for the conflicts, in box order.
+    def get_warnings(self):
+        return [
+            "box %s: %s supplied, rules give %s" % (
+                box, self.supplied[box], to_number(derived)
+            )
+            for box, (supplied, derived) in sorted(self.conflicts.items())
+        ]
+
+    # Raises ValueError if any box couldn't be worked out.
+    def check(self):
+        if self.errors:
+            raise ValueError("; ".join(
+                self.errors[box] for box in sorted(self.errors)
+            ))
+
+class RuleGraph:
+
+    # rules maps derived box numbers to expressions.
+    def __init__(self, rules):
+
+        self.source = dict(rules)
+        self.rules = {}
+        for box, expression in rules.items():
+            box = int(box)
+            self.rules[box] = Rule(box, expression)
+
+        self.order = get_order(self.rules)
+
+        # Boxes anything depends on, and for each one the derived boxes to
+        # recompute when it changes, in order.
+        users = {}
+        for rule in self.rules.values():
+            for dep in rule.deps:
+                users.setdefault(dep, set()).add(rule.box)
+
+        self.inputs = sorted(users)
+        self.downstream = {}
+        for box in set(users) | set(self.rules):
+            found = set()
+            stack = [box]
+            while stack:
+                for user in users.get(stack.pop(), ()):
+                    if user not in found:
+                        found.add(user)
+                        stack.append(user)
+            self.downstream[box] = [b for b in self.order if b in found]
+
+    # Compiled rules can't be pickled, so they're compiled again from the
+    # expressions, e.g. in a worker process.
+    def __getstate__(self):
+        return {"source": self.source}
+
+    def __setstate__(self, state):
+        self.__init__(state["source"])
+
+    def __len__(self):
+        return len(self.rules)
+
+    # Sets a box's value in a Derivation from its supplied value.
+    def set_supplied(self, derivation, box):
+        try:
+            value = to_decimal(box, derivation.supplied.get(box))
+        except ValueError as e:
+            derivation.errors[box] = str(e)
+            value = None
+        else:
+            derivation.errors.pop(box, None)
+        derivation.numbers[box] = value
+        return value
+
+    # Works out one derived box in a Derivation, its inputs being up to
+    # date.
+    def compute(self, derivation, box):
+
+        rule = self.rules[box]
+        numbers = derivation.numbers
+
+        try:
+            value = rule.row(*[numbers[dep] for dep in rule.deps])
+        except ArithmeticError as e:
+            failure = "box %s: %s" % (box, e)
+            value = None
+        else:
+            failure = None
+
+        self.settle(derivation, box, value)
+
+        # A supplied value stands in for a box which can't be worked out.
+        if failure is not None and derivation.supplied.get(box) is None:
+            derivation.errors[box] = failure
+
+    # Records a derived box's value, and the value it takes, which is the
+    # supplied one if there is one.
+    def settle(self, derivation, box, value):
+
+        derivation.derived[box] = value
+        derivation.conflicts.pop(box, None)
+
+        supplied = self.set_supplied(derivation, box)
+        if supplied is None:
+            derivation.numbers[box] = value
+        elif value is not None and supplied != value:
+            derivation.conflicts[box] = (supplied, value)
+
+    # Works out the derived boxes of a values document, returns a
+    # Derivation.
+    def derive(self, values):
+
+        derivation = Derivation(dict(get_boxes(values)))
+
+        for box in self.inputs:
+            if box not in self.rules:
+                self.set_supplied(derivation, box)
+
+        for box in self.order:
+            self.compute(derivation, box)
+
+        return derivation
+
+    # Changes boxes in a Derivation, changes mapping box numbers to new
+    # values (None to clear a box), and recomputes only the derived boxes
+    # downstream of them.  Returns the recomputed boxes, in order.
+    def update(self, derivation, changes):
+
+        affected = set()
+
+        for box, value in changes.items():
+
+            if value is None:
+                derivation.supplied.pop(box, None)
+            else:
+                derivation.supplied[box] = value
+
+            if box in self.rules:
+                # An override: the box is worked out again to settle it
+                # against the new supplied value.
+                affected.add(box)
+            elif box in self.downstream:
+                self.set_supplied(derivation, box)
+
+            affected.update(self.downstream.get(box, ()))
+
+        recomputed = [box for box in self.order if box in affected]
+        for box in recomputed:
+            self.compute(derivation, box)
+
+        return recomputed
+
+    # Works out the derived boxes of a list of values documents, a column
+    # at a time.  Returns a Derivation for each, as derive would.
+    def derive_batch(self, documents):
+
+        derivations = [Derivation(dict(get_boxes(doc))) for doc in documents]
+        columns = {}
+
+        def supplied_column(box):
+            column = []
+            for derivation in derivations:
+                column.append(self.set_supplied(derivation, box))
+            return column
+
+        for box in self.inputs:
+            if box not in self.rules:
+                columns[box] = supplied_column(box)
+
+        for box in self.order:
+
+            rule = self.rules[box]
+            deps = [columns[dep] for dep in rule.deps]
+
+            failures = {}
+            try:
+                derived = rule.column(*deps)
+            except ArithmeticError:
+                # Some return fails; work them out one at a time to find
+                # which.
+                derived = []
+                for i, row in enumerate(zip(*deps)):
+                    try:
+                        derived.append(rule.row(*row))
+                    except ArithmeticError as e:
+                        failures[i] = "box %s: %s" % (box, e)
+                        derived.append(None)
+
+            supplied = supplied_column(box)
+
+            for i, failure in failures.items():
+                if derivations[i].supplied.get(box) is None:
+                    derivations[i].errors[box] = failure
+
+            column = []
+            for derivation, value, given in zip(derivations, derived,
+                                                supplied):
+                derivation.derived[box] = value
+                if given is None:
+                    derivation.numbers[box] = value
+                    column.append(value)
+                else:
+                    if value is not None and given != value:
+                        derivation.conflicts[box] = (given, value)
+                    column.append(given)
+
+            columns[box] = column
+
+        return derivations
+
+def get_boxes(values):
+    if not isinstance(values, dict) or \
+       not isinstance(values.get("ct600"), dict):
+        raise ValueError("values document needs a ct600 object")
+    return values["ct600"]
+
+# Sorts derived boxes so each comes after the derived boxes it uses: in
+# rounds, each taking the boxes whose inputs are all worked out, lowest
+# first.  Raises RulesError for a cycle.
+def get_order(rules):
+
+    waiting = {
+        box: {dep for dep in rule.deps if dep in rules}
+        for box, rule in rules.items()
+    }
+
+    order = []
+    while waiting:
+        ready = sorted(box for box, deps in waiting.items() if not deps)
+        if not ready:
+            raise RulesError("rules depend on each other in a cycle: "
+                             "boxes %s" % ", ".join(
+                                 str(box) for box in sorted(waiting)
+                             ))
+        for box in ready:
+            del waiting[box]
+        for deps in waiting.values():
+            deps.difference_update(ready)
+        order.extend(ready)
+
+    return order
+
+def compile_rules(rules):
+    return RuleGraph(rules)
+
+# Fills in the derived boxes of a values document.  Returns the completed
+# document and a list of warnings for the conflicts.  Raises ValueError if
+# a box can't be worked out.
+def apply_rules(rules, values):
+    derivation = rules.derive(values)
+    derivation.check()
+    return derivation.get_values(), derivation.get_warnings()
+
+# Reads a rules file, YAML with a rules mapping of box number to
+# expression, e.g.
+#   rules:
+#     165: b155 - b160
+#     220: b210 - b215
+def load_rules(path):
+
+    with open(path, "r") as f:
+        try:
+            doc = yaml.safe_load(f)
+        except yaml.YAMLError as e:
+            raise RulesError("%s: bad YAML: %s" % (path, e))
+
+    if not isinstance(doc, dict) or not isinstance(doc.get("rules"), dict):
+        raise RulesError("%s: rules file needs a rules mapping" % path)
+
+    for box in doc["rules"]:
+        if isinstance(box, bool) or not isinstance(box, int):
+            raise RulesError("%s: rule keys should be box numbers: %r" % (
+                path, box
+            ))
+
+    try:
+        return compile_rules(doc["rules"])
+    except RulesError as e:
+        raise RulesError("%s: %s" % (path, e))
@@ -0,0 +1,281 @@
+
+# Form registry.  Each version of the CT600 has its own template and
+# spec, and which one a return is filed on depends on its accounting
+# period.  A FormRegistry lists the versions, read from a forms file (see
+# forms.yaml), each with the template's fingerprint and a date range on
+# the period start (box 30) and end (box 35).  A return's form is chosen
+# by its period, and a form's template and spec are only parsed the first
+# time a return needs them, so a batch mixing periods runs in one pass
+# and never loads a version none of its returns use.
+
+import datetime
+import hashlib
+import os
+import threading
+
+import yaml
+
+from ct600_fill.annotations import get_spec
+from ct600_fill.validate import Validator
+
+# Identifies a template by its page content, so the same form matches
+# after it's re-saved with different metadata, object numbering or
+# compression.  The fingerprint is the SHA-256 of each page's decoded
+# content stream, in page order, each preceded by its length.
+def get_fingerprint(template):
+
+    digest = hashlib.sha256()
+
+    for page in range(len(template)):
+        data = template.get_content(page) or b""
+        digest.update(b"%d\n" % len(data))
+        digest.update(data)
+
+    return digest.hexdigest()
+
+# Date range keys in a forms file, the box each one applies to, and
+# whether the date must be on or after the bound (True) or before it.
+bounds = {
+    "starts_on_or_after": (30, True),
+    "starts_before": (30, False),
+    "ends_on_or_after": (35, True),
+    "ends_before": (35, False),
+}
+
+def get_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.datetime.strptime(str(value), "%Y-%m-%d").date()
+
+# Returns a return's accounting period, (box 30, box 35) as dates, None
+# for a box that's missing.  A box that isn't a date raises ValueError.
+def get_period(values):
+
+    if not isinstance(values, dict) or \
+       not isinstance(values.get("ct600"), dict):
+        raise ValueError("values document needs a ct600 object")
+
+    period = []
+    for box in (30, 35):
+        value = values["ct600"].get(box)
+        try:
+            period.append(get_date(value) if value is not None else None)
+        except ValueError:
+            raise ValueError("box %d: not a YYYY-MM-DD date: %r" % (
+                box, value
+            ))
+
+    return tuple(period)
+
+# One version of the form.  The template, spec and validator are loaded
+# on first use; a form with a fingerprint checks the template against it
+# then.  derive_path is an optional rules file for derived boxes (see
+# ct600_fill.derive), also loaded on first use.  Pickling drops anything
+# loaded, so registries can be sent to worker processes cheaply and each
+# worker loads only what it uses.
+class RegisteredForm:
+    def __init__(self, name, template_path, spec_path, fingerprint=None,
+                 derive_path=None, **periods):
+
+        for key in periods:
+            if key not in bounds:
+                raise ValueError("form %s: unknown date range %s" % (
+                    name, key
+                ))
+
+        self.name = name
+        self.template_path = template_path
+        self.spec_path = spec_path
+        self.fingerprint = fingerprint
+        self.derive_path = derive_path
+        self.periods = {
+            key: get_date(value) for key, value in periods.items()
+        }
+        self.lock = threading.Lock()
+        self.loaded = None
+        self.rules = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["lock"]
+        state["loaded"] = None
+        state["rules"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    # Whether a period, as returned by get_period, is in the form's date
+    # range.  A bound on a box the return doesn't have doesn't match.
+    def matches(self, period):
+
+        for key, bound in self.periods.items():
+            box, on_or_after = bounds[key]
+            date = period[0] if box == 30 else period[1]
+            if date is None:
+                return False
+            if (date >= bound) != on_or_after:
+                return False
+
+        return True
+
+    # Returns (template, spec, validator), loading them the first time.
+    def load(self):
+
+        with self.lock:
+
+            if self.loaded is None:
+
+                from ct600_fill.template import get_template
+
+                template = get_template(self.template_path)
+
+                if self.fingerprint is not None and \
+                   get_fingerprint(template) != self.fingerprint:
+                    raise ValueError(
+                        "form %s: %s doesn't match the form's fingerprint" % (
+                            self.name, self.template_path
+                        )
+                    )
+
+                spec = get_spec(self.spec_path)
+                self.loaded = (template, spec, Validator(spec))
+
+            return self.loaded
+
+    # Returns the form's derived box rules, a RuleGraph, loading them the
+    # first time, or None if it has none.
+    def get_rules(self):
+
+        if self.derive_path is None:
+            return None
+
+        with self.lock:
+            if self.rules is None:
+                from ct600_fill.derive import load_rules
+                self.rules = load_rules(self.derive_path)
+            return self.rules
+
+    @property
+    def template(self):
+        return self.load()[0]
+
+    @property
+    def spec(self):
+        return self.load()[1]
+
+    @property
+    def validator(self):
+        return self.load()[2]
+
+    def is_loaded(self):
+        return self.loaded is not None
+
+class FormRegistry:
+
+    # forms is a list of RegisteredForm; the first whose date range
+    # matches a return is used.
+    def __init__(self, forms):
+        names = [form.name for form in forms]
+        if len(set(names)) != len(names):
+            raise ValueError("form names should be unique")
+        self.forms = forms
+
+    def __iter__(self):
+        return iter(self.forms)
+
+    def __len__(self):
+        return len(self.forms)
+
+    def get(self, name):
+        for form in self.forms:
+            if form.name == name:
+                return form
+        raise KeyError(name)
+
+    # Returns the form for a values document, chosen by its period.
+    # Raises ValueError if no form's date range covers the period.
+    def select(self, values):
+
+        period = get_period(values)
+
+        for form in self.forms:
+            if form.matches(period):
+                return form
+
+        start, end = (
+            date.isoformat() if date is not None else "?" for date in period
+        )
+        raise ValueError("no form for the period %s to %s (boxes 30 and 35)"
+                         % (start, end))
+
+    # Returns the registered form a parsed template is a copy of, by
+    # fingerprint, or None.  Forms without a fingerprint in the forms file
+    # are loaded to compute one.
+    def identify(self, template):
+
+        fingerprint = get_fingerprint(template)
+
+        for form in self.forms:
+            known = form.fingerprint
+            if known is None:
+                known = get_fingerprint(form.template)
+            if known == fingerprint:
+                return form
+
+        return None
+
+# Reads a forms file, YAML with a list of forms, e.g.
+#   forms:
+#     - name: ct600-2023-v3
+#       template: CT600-2023-v3.pdf
+#       spec: spec-ct600-2023-v3.json
+#       fingerprint: 5d1f...
+#       derive: rules-ct600-2023-v3.yaml
+#       ends_before: 2025-04-01
+# Paths are relative to the forms file's directory.  fingerprint, derive
+# and the date ranges (see bounds) are optional; a form without a date
+# range matches any period.
+def load_registry(path):
+
+    with open(path, "r") as f:
+        try:
+            doc = yaml.safe_load(f)
+        except yaml.YAMLError as e:
+            raise ValueError("%s: bad YAML: %s" % (path, e))
+
+    if not isinstance(doc, dict) or not isinstance(doc.get("forms"), list):
+        raise ValueError("%s: forms file needs a forms list" % path)
+
+    base = os.path.dirname(path)
+    forms = []
+
+    for entry in doc["forms"]:
+
+        if not isinstance(entry, dict):
+            raise ValueError("%s: each form should be a mapping" % path)
+
+        entry = dict(entry)
+        try:
+            name = str(entry.pop("name"))
+            template_path = os.path.join(base, entry.pop("template"))
+            spec_path = os.path.join(base, entry.pop("spec"))
+        except KeyError as e:
+            raise ValueError("%s: form needs a %s" % (path, e.args[0]))
+
+        if "derive" in entry:
+            entry["derive_path"] = os.path.join(base, entry.pop("derive"))
+
+        try:
+            forms.append(RegisteredForm(name, template_path, spec_path,
+                                        **entry))
+        except (TypeError, ValueError) as e:
+            raise ValueError("%s: %s" % (path, e))
+
+    try:
+        return FormRegistry(forms)
+    except ValueError as e:
+        raise ValueError("%s: %s" % (path, e))
@@ -0,0 +1,205 @@
+
+# Values input.  A values document is a dict with a ct600 object mapping
+# box numbers to values, read from YAML, JSON or msgpack.  The format is
+# chosen by file extension, or by sniffing the data when there isn't one.
+# Bulk inputs hold many returns, one per row of a JSON-lines or CSV file,
+# and are read a row at a time.
+
+import collections
+import csv
+import json
+import os
+import yaml
+
+# The libyaml loader is several times faster than the pure Python one.
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+def load_yaml(data):
+    try:
+        return yaml.load(data, Loader=YamlLoader)
+    except yaml.YAMLError as e:
+        raise ValueError("bad YAML: %s" % e)
+
+def load_json(data):
+    return json.loads(data)
+
+# msgpack is an optional dependency, only needed for msgpack input.
+def load_msgpack(data):
+    try:
+        import msgpack
+    except ImportError:
+        raise ValueError("msgpack input needs the msgpack package")
+    try:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+    except Exception as e:
+        raise ValueError("bad msgpack: %s" % e)
+
+loaders = {
+    "yaml": load_yaml,
+    "json": load_json,
+    "msgpack": load_msgpack,
+}
+
+extensions = {
+    ".yaml": "yaml",
+    ".yml": "yaml",
+    ".json": "json",
+    ".msgpack": "msgpack",
+    ".mpk": "msgpack",
+}
+
+# Guesses the format of values data.  A msgpack values document starts
+# with a map header, which isn't valid at the start of UTF-8 text; JSON
+# starts with a brace.  Anything else is YAML.
+def sniff(data):
+
+    if len(data) == 0:
+        return "yaml"
+
+    if 0x80 <= data[0] <= 0x8f or data[0] in (0xde, 0xdf):
+        return "msgpack"
+
+    if data.lstrip()[:1] == b"{":
+        return "json"
+
+    return "yaml"
+
+# Box numbers are integers in the spec, but JSON, msgpack and CSV keys are
+# often strings.
+def get_box(key):
+    if isinstance(key, str) and key.isdigit():
+        return int(key)
+    return key
+
+def normalise(values):
+    if isinstance(values, dict) and isinstance(values.get("ct600"), dict):
+        values["ct600"] = {
+            get_box(k): v for k, v in values["ct600"].items()
+        }
+    return values
+
+# Parses values data (bytes), returns a values document.  fmt is a key of
+# loaders, or None to sniff.  Parse errors raise ValueError.
+def load_values(data, fmt=None):
+
+    if fmt is None:
+        fmt = sniff(data)
+
+    return normalise(loaders[fmt](data))
+
+# Reads a values file, choosing the format by extension.
+def read_values(path):
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    fmt = extensions.get(os.path.splitext(path)[1].lower())
+
+    return load_values(data, fmt)
+
+# One return from a bulk input file.  label identifies the row in error
+# reports, name is the output file name without extension.  A row which
+# can't be read has empty values and a ValueError in error, so it's
+# reported as a failure of that row alone rather than ending the file.
+Row = collections.namedtuple("Row", ["label", "name", "values", "error"],
+                             defaults=(None,))
+
+def get_bad_row(path, number, message):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return Row("%s:%d" % (path, number), "%s-%d" % (stem, number),
+               {"ct600": {}}, ValueError(message))
+
+# Whether a row id is usable as an output file name in the output
+# directory: not empty or absolute, and without path separators or "..".
+def is_plain_name(name):
+    if name == "" or os.path.isabs(name) or ".." in name:
+        return False
+    return not any(sep in name for sep in (os.sep, os.altsep) if sep)
+
+# Converts a bulk row, a dict of column name to value, to a Row.  Columns
+# are box numbers, except for an optional id column which names the
+# output; rows without one are named after the input file and row number.
+# An id which isn't a plain file name would write outside the output
+# directory, so the row fails.  Empty cells are left out.
+def get_row(path, number, columns):
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    label = "%s:%d" % (path, number)
+
+    columns = dict(columns)
+    name = columns.pop("id", None)
+    if name in (None, ""):
+        name = "%s-%d" % (stem, number)
+    elif not is_plain_name(str(name)):
+        return get_bad_row(path, number,
+                           "id should be a plain file name: %r" % name)
+
+    ct600 = {
+        get_box(k): v for k, v in columns.items() if v not in (None, "")
+    }
+
+    return Row(label, str(name), {"ct600": ct600})
+
+# CSV cells are strings; the 'X in the box' boxes need true and false.
+def get_cell(value):
+    if value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    return value
+
+def iter_jsonl(path):
+    with open(path, "r") as f:
+        number = 0
+        for line in f:
+            if line.strip() == "":
+                continue
+            number += 1
+            try:
+                columns = json.loads(line)
+            except ValueError as e:
+                yield get_bad_row(path, number, "bad JSON: %s" % e)
+                continue
+            if not isinstance(columns, dict):
+                yield get_bad_row(path, number, "row should be a JSON object")
+                continue
+            yield get_row(path, number, columns)
+
+def iter_csv(path):
+    with open(path, "r", newline="") as f:
+        reader = csv.DictReader(f)
+        for number, columns in enumerate(reader, 1):
+            # DictReader puts extra cells in a list under None, and gives
+            # None for missing ones.
+            extra = columns.pop(None, None)
+            if extra is not None:
+                yield get_bad_row(path, number, "%d cells, the header has %d"
+                                  % (len(columns) + len(extra),
+                                     len(reader.fieldnames)))
+                continue
+            if None in columns.values():
+                yield get_bad_row(path, number, "%d cells, the header has %d"
+                                  % (sum(v is not None
+                                         for v in columns.values()),
+                                     len(reader.fieldnames)))
+                continue
+            columns = {k: get_cell(v) for k, v in columns.items()}
+            yield get_row(path, number, columns)
+
+bulk_readers = {
+    ".jsonl": iter_jsonl,
+    ".ndjson": iter_jsonl,
+    ".csv": iter_csv,
+}
+
+# Reads a bulk input file a row at a time, yields a Row per return.  The
+# format is chosen by extension, or JSON-lines if the file starts with a
+# brace and CSV otherwise.
+def iter_bulk(path):
+
+    reader = bulk_readers.get(os.path.splitext(path)[1].lower())
+
+    if reader is None:
+        with open(path, "rb") as f:
+            start = f.read(64).lstrip()
+        reader = iter_jsonl if start[:1] == b"{" else iter_csv
+
+    return reader(path)
@@ -0,0 +1,120 @@
+
+# Minimal metrics in the Prometheus text exposition format, for the
+# long-running modes.
+
+import bisect
+import threading
+
+# Latency buckets in seconds.
+default_buckets = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(
+        '%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in labels
+    ) + "}"
+
+def format_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+# A histogram, with one series per distinct set of labels.
+class Histogram:
+    def __init__(self, name, help, buckets=default_buckets):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            if key not in self.series:
+                self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts, total, count = self.series[key]
+            counts[i] += 1
+            self.series[key][1] = total + value
+            self.series[key][2] = count + 1
+
+    # Returns {labels: (cumulative bucket counts, sum, count)}.
+    def snapshot(self):
+        with self.lock:
+            out = {}
+            for key, (counts, total, count) in self.series.items():
+                cumulative = []
+                n = 0
+                for c in counts:
+                    n += c
+                    cumulative.append(n)
+                out[key] = (cumulative, total, count)
+            return out
+
+    def expose(self):
+        lines = [
+            "# HELP %s %s" % (self.name, self.help),
+            "# TYPE %s histogram" % self.name,
+        ]
+        for key, (cumulative, total, count) in sorted(self.snapshot().items()):
+            bounds = self.buckets + (float("inf"),)
+            for bound, n in zip(bounds, cumulative):
+                labels = key + (("le", format_value(bound)),)
+                lines.append("%s_bucket%s %d" % (
+                    self.name, format_labels(labels), n
+                ))
+            lines.append("%s_sum%s %s" % (
+                self.name, format_labels(key), format_value(total)
+            ))
+            lines.append("%s_count%s %d" % (
+                self.name, format_labels(key), count
+            ))
+        return lines
+
+# A counter, with one series per distinct set of labels.
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.series.get(tuple(sorted(labels.items())), 0)
+
+    def expose(self):
+        lines = [
+            "# HELP %s %s" % (self.name, self.help),
+            "# TYPE %s counter" % self.name,
+        ]
+        with self.lock:
+            for key, value in sorted(self.series.items()):
+                lines.append("%s%s %s" % (
+                    self.name, format_labels(key), format_value(value)
+                ))
+        return lines
+
+# A set of metrics exposed together.
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,504 @@
+# Optimised PDF output, for returns which are archived.  OptimisingWriter
+# stands in for PyPDF2's PdfWriter as far as the rendering engines are
+# concerned (add_page and _add_object, like StreamingWriter) and writes a
+# complete, compact document:
+#
+# - content streams which are uncompressed, or ASCII-encoded as reportlab
+#   writes them, are Flate-compressed, and Flate streams are recompressed
+#   at the highest level;
+# - each page's resources are cut down to those its content uses, so
+#   unused template fonts, images etc. aren't written;
+# - identical objects, e.g. the overlay fonts of different returns, are
+#   written once.
+#
+# Several returns can be written to one writer, which gives an archive
+# container with the template's objects stored once, see ct600_fill.archive.
+
+import hashlib
+import io
+import re
+import weakref
+import zlib
+
+from PyPDF2 import PageObject, PdfReader
+from PyPDF2.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, EncodedStreamObject,
+    IndirectObject, NameObject, NumberObject, StreamObject,
+    create_string_object
+)
+
+pdf_header = b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n"
+
+# Filters which are decoded and replaced by Flate.  Other filters (image
+# codecs, or anything with decode parameters) are left as they are.
+recodable_filters = {"/FlateDecode", "/ASCII85Decode", "/ASCIIHexDecode"}
+
+# Resource categories whose entries are named in content streams.
+resource_categories = (
+    "/Font", "/XObject", "/ExtGState", "/ColorSpace", "/Pattern",
+    "/Shading", "/Properties"
+)
+
+name_re = re.compile(rb"/([^\s/\[\]<>(){}%]*)")
+escape_re = re.compile(rb"#([0-9a-fA-F]{2})")
+
+# Compressed copies of streams read from a document, and the names used in
+# content streams, per document (weakly held) and object.  In practice
+# this is the template's, which is the same for every output, so its
+# streams are compressed and scanned once rather than once per output.
+stream_cache = weakref.WeakKeyDictionary()
+
+# Returns fn(ref.get_object()), cached as kind for objects read from a
+# document.
+def get_cached(ref, kind, fn):
+
+    if not isinstance(ref, IndirectObject) or \
+       not isinstance(ref.pdf, PdfReader):
+        return fn(ref.get_object())
+
+    if ref.pdf not in stream_cache:
+        stream_cache[ref.pdf] = {}
+    cache = stream_cache[ref.pdf]
+
+    key = (kind, ref.idnum, ref.generation)
+    if key not in cache:
+        cache[key] = fn(ref.get_object())
+    return cache[key]
+
+def get_filters(stream):
+    filters = stream.get("/Filter")
+    if filters is None:
+        return []
+    filters = filters.get_object()
+    if isinstance(filters, ArrayObject):
+        return [str(f) for f in filters]
+    return [str(filters)]
+
+# Returns a copy of a stream, Flate-compressed at the highest level if
+# that's possible and makes it smaller.  XMP metadata is left readable.
+def compress_stream(stream):
+
+    filters = get_filters(stream)
+
+    if stream.get("/Type") == "/Metadata" or "/DecodeParms" in stream or \
+       not set(filters) <= recodable_filters:
+        return copy_stream(stream)
+
+    data = stream.get_data()
+    compressed = zlib.compress(data, 9)
+
+    if len(compressed) >= len(stream._data):
+        return copy_stream(stream)
+
+    out = EncodedStreamObject()
+    out._data = compressed
+    for k, v in stream.items():
+        if k not in ("/Length", "/Filter"):
+            out[NameObject(k)] = v
+    out[NameObject("/Filter")] = NameObject("/FlateDecode")
+    out[NameObject("/Length")] = NumberObject(len(compressed))
+    return out
+
+def copy_stream(stream):
+    if isinstance(stream, EncodedStreamObject):
+        out = EncodedStreamObject()
+    else:
+        out = DecodedStreamObject()
+    out._data = stream._data
+    for k, v in stream.items():
+        if k != "/Length":
+            out[NameObject(k)] = v
+    out[NameObject("/Length")] = NumberObject(len(out._data))
+    return out
+
+# Returns the set of names (without the slash) used in a page's content.
+# Any name token counts, so this may keep a resource that isn't needed,
+# but never drops one that is.
+def get_content_names(page):
+
+    if "/Contents" not in page:
+        return set()
+
+    contents = page.raw_get("/Contents")
+    if isinstance(contents.get_object(), ArrayObject):
+        contents = contents.get_object()
+    else:
+        contents = [contents]
+
+    names = set()
+    for stream in contents:
+        names.update(get_cached(stream, "names", get_stream_names))
+
+    return names
+
+def get_stream_names(stream):
+
+    names = set()
+
+    for name in name_re.findall(stream.get_data()):
+        if b"#" in name:
+            name = escape_re.sub(
+                lambda m: bytes([int(m.group(1), 16)]), name
+            )
+        names.add(name.decode("latin-1"))
+
+    return names
+
+# Returns a page's resources with only the entries its content uses.
+def get_used_resources(page):
+
+    resources = page["/Resources"].get_object()
+    names = get_content_names(page)
+
+    used = DictionaryObject()
+
+    for category, entries in resources.items():
+        if category in resource_categories:
+            entries = entries.get_object()
+            kept = DictionaryObject()
+            for name in entries:
+                if name[1:] in names:
+                    kept[NameObject(name)] = entries.raw_get(name)
+            if kept:
+                used[NameObject(category)] = kept
+        else:
+            used[NameObject(category)] = resources.raw_get(category)
+
+    return used
+
+class OptimisingWriter:
+    def __init__(self):
+
+        # Output objects, object number i + 1.  References between them
+        # are IndirectObjects with this writer as the pdf.
+        self.objects = []
+
+        # References to objects from other documents (the template, and
+        # overlays) which have been copied in, per document.  Documents
+        # are weakly held so that a return's overlay isn't kept alive by
+        # an archive.
+        self.foreign = weakref.WeakKeyDictionary()
+
+        self.pages_ref = self.allocate(None)
+        self.pages = []
+
+        # The page most recently added, which the engines may still be
+        # changing.  It's copied in when the next page is added or on
+        # write.
+        self.pending = None
+
+        # Outline entries, (title, page index).
+        self.outline = []
+
+    def allocate(self, obj):
+        self.objects.append(obj)
+        return IndirectObject(len(self.objects), 0, self)
+
+    def get_object(self, ref):
+        return self.objects[ref.idnum - 1]
+
+    # Adds a new object, returns a reference to it.
+    def _add_object(self, obj):
+        ref = self.allocate(None)
+        self.objects[ref.idnum - 1] = self.convert(obj, True)
+        return ref
+
+    # Adds a page, returns the output page, which may be modified.
+    def add_page(self, page):
+        self.flush()
+        out = PageObject(page.pdf, page.indirect_reference)
+        out.update(page)
+        self.pending = out
+        return out
+
+    # Adds an outline entry for the next page added, e.g. the start of a
+    # return in an archive.
+    def add_outline(self, title):
+        pages = len(self.pages) + (self.pending is not None)
+        self.outline.append((title, pages))
+
+    def get_foreign(self, pdf):
+        if pdf not in self.foreign:
+            self.foreign[pdf] = {}
+        return self.foreign[pdf]
+
+    def flush(self):
+
+        if self.pending is None:
+            return
+
+        page = self.pending
+        self.pending = None
+
+        ref = self.allocate(None)
+
+        # References to the original page (e.g. from its annotations)
+        # refer to this copy.
+        original = page.indirect_reference
+        if original is not None:
+            self.get_foreign(original.pdf)[
+                (original.idnum, original.generation)
+            ] = ref
+
+        out = DictionaryObject()
+        for k in page:
+            if k == "/Parent":
+                continue
+            elif k == "/Resources":
+                out[NameObject(k)] = self.convert(get_used_resources(page))
+            else:
+                out[NameObject(k)] = self.convert(page.raw_get(k))
+        out[NameObject("/Parent")] = self.pages_ref
+
+        self.objects[ref.idnum - 1] = out
+        self.pages.append(ref)
+
+    def ref(self, obj):
+
+        if obj.pdf is self:
+            return obj
+
+        refs = self.get_foreign(obj.pdf)
+        key = (obj.idnum, obj.generation)
+
+        if key not in refs:
+            refs[key] = self.allocate(None)
+            target = obj.get_object()
+            if isinstance(target, StreamObject):
+                target = self.convert_values(copy_stream(
+                    get_cached(obj, "compressed", compress_stream)
+                ))
+            else:
+                target = self.convert(target, True)
+            self.objects[refs[key].idnum - 1] = target
+
+        return refs[key]
+
+    # Converts a stream's dictionary values in place, returns the stream.
+    def convert_values(self, stream):
+        for k, v in list(stream.items()):
+            stream[NameObject(k)] = self.convert(v)
+        return stream
+
+    # Returns obj with references to other documents copied in, and
+    # streams compressed and made indirect.
+    def convert(self, obj, top=False):
+
+        if isinstance(obj, IndirectObject):
+            return self.ref(obj)
+
+        if isinstance(obj, StreamObject):
+            out = self.convert_values(compress_stream(obj))
+            if top:
+                return out
+            return self.allocate(out)
+
+        if isinstance(obj, DictionaryObject):
+            out = DictionaryObject()
+            for k, v in obj.items():
+                out[NameObject(k)] = self.convert(v)
+            return out
+
+        if isinstance(obj, ArrayObject):
+            return ArrayObject([self.convert(v) for v in obj])
+
+        return obj
+
+    def get_outline(self):
+
+        root = self.allocate(None)
+        items = [self.allocate(None) for title, page in self.outline]
+
+        for i, (title, page) in enumerate(self.outline):
+            item = DictionaryObject()
+            item[NameObject("/Title")] = create_string_object(title)
+            item[NameObject("/Parent")] = root
+            if i > 0:
+                item[NameObject("/Prev")] = items[i - 1]
+            if i + 1 < len(items):
+                item[NameObject("/Next")] = items[i + 1]
+            item[NameObject("/Dest")] = ArrayObject([
+                self.pages[page], NameObject("/Fit")
+            ])
+            self.objects[items[i].idnum - 1] = item
+
+        outline = DictionaryObject()
+        outline[NameObject("/Type")] = NameObject("/Outlines")
+        outline[NameObject("/First")] = items[0]
+        outline[NameObject("/Last")] = items[-1]
+        outline[NameObject("/Count")] = NumberObject(len(items))
+        self.objects[root.idnum - 1] = outline
+
+        return root
+
+    # Finishes the page tree and catalog, returns a reference to the
+    # catalog.
+    def finish(self):
+
+        self.flush()
+
+        tree = DictionaryObject()
+        tree[NameObject("/Type")] = NameObject("/Pages")
+        tree[NameObject("/Kids")] = ArrayObject(self.pages)
+        tree[NameObject("/Count")] = NumberObject(len(self.pages))
+        self.objects[self.pages_ref.idnum - 1] = tree
+
+        catalog = DictionaryObject()
+        catalog[NameObject("/Type")] = NameObject("/Catalog")
+        catalog[NameObject("/Pages")] = self.pages_ref
+        if self.outline:
+            catalog[NameObject("/Outlines")] = self.get_outline()
+            catalog[NameObject("/PageMode")] = NameObject("/UseOutlines")
+
+        return self.allocate(catalog)
+
+    # Writes the output document.
+    def write(self, outf):
+
+        root = self.finish()
+
+        # Pages aren't merged, each must appear in the page tree once.
+        numbers = dedupe(self.objects, {ref.idnum for ref in self.pages})
+
+        # Output numbers of the objects written, in order.
+        written = {}
+        for i, n in enumerate(numbers):
+            if n == i + 1 and n not in written:
+                written[n] = len(written) + 1
+
+        def number(idnum):
+            return written[numbers[idnum - 1]]
+
+        out = io.BytesIO()
+        out.write(pdf_header)
+
+        offsets = []
+        for i, obj in enumerate(self.objects):
+            if numbers[i] != i + 1:
+                continue
+            offsets.append(out.tell())
+            out.write(b"%d 0 obj\n" % written[i + 1])
+            out.write(serialise(obj, number))
+            out.write(b"\nendobj\n")
+
+        startxref = out.tell()
+        out.write(b"xref\n0 %d\n" % (len(offsets) + 1))
+        out.write(b"0000000000 65535 f \n")
+        for offset in offsets:
+            out.write(b"%010d 00000 n \n" % offset)
+
+        out.write(b"trailer\n<< /Size %d /Root %d 0 R >>\n" % (
+            len(offsets) + 1, number(root.idnum)
+        ))
+        out.write(b"startxref\n%d\n%%%%EOF\n" % startxref)
+
+        outf.write(out.getvalue())
+
+# Serialises an object, with references renumbered by number(idnum).
+def serialise(obj, number):
+    out = []
+    serialise_to(obj, number, out)
+    return b"".join(out)
+
+# The kind of each object type serialise_to has seen.  isinstance checks
+# on PyPDF2's object types are slow, and serialising an archive makes many.
+kinds = {}
+
+def get_kind(obj):
+    cls = type(obj)
+    if cls not in kinds:
+        for kind in (IndirectObject, StreamObject, DictionaryObject,
+                     ArrayObject):
+            if isinstance(obj, kind):
+                break
+        else:
+            kind = None
+        kinds[cls] = kind
+    return kinds[cls]
+
+def serialise_to(obj, number, out):
+
+    kind = get_kind(obj)
+
+    if kind is IndirectObject:
+        out.append(b"%d 0 R" % number(obj.idnum))
+
+    elif kind is StreamObject:
+        serialise_dict(obj, number, out)
+        out.append(b"\nstream\n")
+        out.append(obj._data)
+        out.append(b"\nendstream")
+
+    elif kind is DictionaryObject:
+        serialise_dict(obj, number, out)
+
+    elif kind is ArrayObject:
+        out.append(b"[")
+        for i, v in enumerate(obj):
+            if i:
+                out.append(b" ")
+            serialise_to(v, number, out)
+        out.append(b"]")
+
+    else:
+        buffer = io.BytesIO()
+        obj.write_to_stream(buffer, None)
+        out.append(buffer.getvalue())
+
+def serialise_dict(obj, number, out):
+    out.append(b"<<")
+    for k, v in obj.items():
+        out.append(b"\n")
+        serialise_to(NameObject(k), number, out)
+        out.append(b" ")
+        serialise_to(v, number, out)
+    out.append(b"\n>>")
+
+# Finds identical objects.  Returns a list giving, for each object number
+# (less one), the number of the object to write in its place.  Objects
+# are compared by their serialisation with references to objects already
+# found identical counted as the same, repeated until nothing changes, so
+# that e.g. two identical fonts with identical descriptors are merged.
+# Objects numbered in keep are never merged.
+def dedupe(objects, keep=()):
+
+    numbers = list(range(1, len(objects) + 1))
+
+    def number(idnum):
+        while numbers[idnum - 1] != idnum:
+            idnum = numbers[idnum - 1]
+        return idnum
+
+    # Stream data doesn't change between rounds, so it's hashed once.
+    digests = {}
+    for i, obj in enumerate(objects):
+        if isinstance(obj, StreamObject):
+            digests[i] = hashlib.sha256(obj._data).digest()
+
+    while True:
+
+        seen = {}
+        changed = False
+
+        for i, obj in enumerate(objects):
+
+            if numbers[i] != i + 1 or i + 1 in keep:
+                continue
+
+            if i in digests:
+                out = []
+                serialise_dict(obj, number, out)
+                key = b"".join(out) + digests[i]
+            else:
+                key = b"o" + serialise(obj, number)
+
+            if key in seen:
+                numbers[i] = seen[key]
+                changed = True
+            else:
+                seen[key] = i + 1
+
+        if not changed:
+            break
+
+    return [number(i + 1) for i in range(len(objects))]
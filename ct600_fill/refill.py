@@ -0,0 +1,118 @@
+
+# Incremental re-fill.  When a return is filled again after a few box
+# values change, only pages whose inputs changed are rendered; the rest
+# are taken from the previous output.  A sidecar state file next to the
+# output records a key per page, a hash of the template, engine, page
+# number and that page's annotations and values, plus a hash of the
+# output it describes so a modified or replaced output is never reused.
+
+import hashlib
+import io
+import json
+import os
+
+from PyPDF2 import PdfReader
+
+from ct600_fill.annotations import describe
+from ct600_fill.render import prepare_pdf
+from ct600_fill.timings import timed
+
+state_version = 1
+
+def get_state_path(output_path):
+    return output_path + ".refill.json"
+
+# Returns {page: key} for every template page.  Pages without annotations
+# get a key too, so that a page which loses all its values is re-rendered.
+def get_page_keys(template, annotations, engine):
+
+    keys = {}
+
+    for page in range(0, len(template)):
+        entries = [
+            [describe(ann), val] for ann, val in annotations.get(page, [])
+        ]
+        doc = [template.digest, engine, page, entries]
+        data = json.dumps(doc, default=str, sort_keys=True).encode("utf-8")
+        keys[page] = hashlib.sha256(data).hexdigest()
+
+    return keys
+
+def load_state(path):
+    try:
+        with open(path, "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(state, dict) or state.get("version") != state_version:
+        return None
+    return state
+
+# Returns the previous output as a PdfReader, and its page keys, if the
+# state matches the output on disk.  Otherwise returns None, {}.
+def get_previous(output_path, template):
+
+    state = load_state(get_state_path(output_path))
+    if state is None:
+        return None, {}
+
+    try:
+        with open(output_path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None, {}
+
+    if hashlib.sha256(data).hexdigest() != state["output"]:
+        return None, {}
+
+    previous = PdfReader(io.BytesIO(data))
+    if len(previous.pages) != len(template):
+        return None, {}
+
+    keys = {int(page): key for page, key in state["pages"].items()}
+
+    return previous, keys
+
+# Fills a return to output_path, re-rendering only pages whose key has
+# changed since the previous fill.  Returns the list of re-rendered page
+# numbers.
+def refill_pdf(output_path, template, annotations, engine="reportlab",
+               cache=None, timings=None):
+
+    keys = get_page_keys(template, annotations, engine)
+    previous, previous_keys = get_previous(output_path, template)
+
+    reuse = {}
+    if previous is not None:
+        for page, key in keys.items():
+            if previous_keys.get(page) == key:
+                reuse[page] = previous.pages[page]
+
+    output = prepare_pdf(template, annotations, engine=engine, reuse=reuse,
+                         cache=cache, timings=timings)
+
+    with timed(timings, "write"):
+
+        buffer = io.BytesIO()
+        output.write(buffer)
+        data = buffer.getvalue()
+
+        # Written to a temporary file and renamed, so an interrupted re-fill
+        # leaves the previous output and state consistent.
+        tmp = output_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, output_path)
+
+    state = {
+        "version": state_version,
+        "output": hashlib.sha256(data).hexdigest(),
+        "pages": {str(page): key for page, key in keys.items()},
+    }
+
+    state_path = get_state_path(output_path)
+    with open(state_path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(state_path + ".tmp", state_path)
+
+    return [page for page in range(0, len(template)) if page not in reuse]
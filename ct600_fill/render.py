@@ -0,0 +1,136 @@
+
+import io
+
+from PyPDF2 import PdfWriter, PdfReader
+
+from ct600_fill.annotations import create_annotations, get_overlay
+from ct600_fill.content import (
+    SharedResources, add_overlay, add_overlay_page, can_stack
+)
+from ct600_fill.optimise import OptimisingWriter
+from ct600_fill.stream import StreamingWriter
+from ct600_fill.timings import timed
+
+# reportlab engine: all overlay pages are drawn in a single canvas pass and
+# parsed once.  Each overlay's content is stacked on its template page,
+# with the overlay fonts shared by all pages, or, if that isn't possible,
+# merged into a clone of the template page.  Pages in reuse are added as
+# they are, without rendering.  With an overlay cache, the whole overlay is
+# cached.
+def render_reportlab(output, template, annotations, reuse=None, cache=None,
+                     timings=None):
+
+    reuse = reuse or {}
+
+    annotations = {
+        page: anns for page, anns in annotations.items() if page not in reuse
+    }
+
+    overlays = {}
+    if annotations:
+        overlay, index = get_overlay(annotations, cache, timings)
+        overlay_pdf = PdfReader(overlay)
+        for page in annotations:
+            overlays[page] = overlay_pdf.pages[index[page]]
+
+    shared = SharedResources(output)
+
+    for page in range(0, len(template)):
+
+        if page in reuse:
+            output.add_page(reuse[page])
+        elif page not in annotations:
+            output.add_page(template.pages[page])
+        elif can_stack(template.pages[page], overlays[page]):
+            with timed(timings, "merge_page", page):
+                page_data = output.add_page(template.pages[page])
+                add_overlay_page(output, page_data, overlays[page], shared)
+        else:
+            with timed(timings, "merge_page", page):
+                page_data = template.clone_page(page)
+                page_data.merge_page(overlays[page])
+            output.add_page(page_data)
+
+# direct engine: text operators are appended straight to the pages' content
+# streams, see ct600_fill.content.  Pages in reuse are added as they are.
+def render_direct(output, template, annotations, reuse=None, cache=None,
+                  timings=None):
+
+    reuse = reuse or {}
+
+    shared = SharedResources(output)
+
+    for page in range(0, len(template)):
+
+        if page in reuse:
+            output.add_page(reuse[page])
+            continue
+
+        page_data = output.add_page(template.pages[page])
+
+        if page in annotations:
+            with timed(timings, "add_overlay", page):
+                add_overlay(output, page_data, annotations[page], cache,
+                            shared)
+
+engines = {
+    "reportlab": render_reportlab,
+    "direct": render_direct,
+}
+
+# Takes a CT600 Template and a set of annotations (as returned by
+# create_annotations), renders the annotated form and returns the output
+# document, ready to write.  The template isn't modified.  With streaming,
+# the output is a StreamingWriter, which writes sequentially as an update
+# to the template, see ct600_fill.stream.  Bad values raise here, before
+# any output is written.  reuse maps page numbers to already rendered
+# pages (e.g. from a previous output) to use instead of rendering, it
+# can't be combined with streaming.  cache is an optional OverlayCache, see
+# ct600_fill.cache.  timings is an optional Timings recording each stage,
+# see ct600_fill.timings.  With optimise, the output is an OptimisingWriter,
+# which compresses, prunes and dedupes the document, see
+# ct600_fill.optimise; it can't be combined with streaming.
+def prepare_pdf(template, annotations, engine="reportlab", streaming=False,
+                reuse=None, cache=None, timings=None, optimise=False):
+
+    if streaming:
+        if reuse:
+            raise ValueError("streaming output can't reuse pages")
+        if optimise:
+            raise ValueError("streaming output can't be optimised")
+        output = StreamingWriter(template)
+    elif optimise:
+        output = OptimisingWriter()
+    else:
+        output = PdfWriter()
+
+    engines[engine](output, template, annotations, reuse=reuse, cache=cache,
+                    timings=timings)
+
+    return output
+
+# Takes an output file, a CT600 Template and a set of annotations, writes
+# the annotated form to the output file.  With streaming, outf needn't be
+# seekable.
+def create_pdf(outf, template, annotations, engine="reportlab",
+               streaming=False, cache=None, timings=None, optimise=False):
+
+    output = prepare_pdf(template, annotations, engine=engine,
+                         streaming=streaming, cache=cache, timings=timings,
+                         optimise=optimise)
+
+    with timed(timings, "write"):
+        output.write(outf)
+
+# Fills a values document (a dict with a ct600 object) against a Template
+# and spec, returns the PDF bytes.
+def fill_values(values, template, spec, engine="reportlab",
+                streaming=False, cache=None):
+
+    annotations = create_annotations(values, spec)
+
+    buffer = io.BytesIO()
+    create_pdf(buffer, template, annotations, engine=engine,
+               streaming=streaming, cache=cache)
+
+    return buffer.getvalue()
@@ -0,0 +1,222 @@
+
+# Long-running fill server.  Templates and specs are loaded once at
+# start-up and kept warm; each POST /fill request carries a values
+# document (the same ct600: YAML, JSON or msgpack as the CLI input) and
+# gets the filled PDF back.
+
+import io
+import os
+import socketserver
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from ct600_fill.metrics import Counter, Histogram, Registry
+from ct600_fill.annotations import create_annotations, get_spec
+from ct600_fill.inputs import load_values
+from ct600_fill.render import prepare_pdf
+from ct600_fill.template import get_template
+from ct600_fill.timings import Timings, get_stage_histogram, timed
+from ct600_fill.validate import Validator
+
+# A template and spec pair.  Rendering against one template is serialised
+# by the template's lock; requests for different forms render
+# concurrently.
+class Form:
+    def __init__(self, name, template_path, spec_path):
+        self.name = name
+        self.template = get_template(template_path)
+        self.spec = get_spec(spec_path)
+        self.validator = Validator(self.spec)
+
+# Parses a --form argument, NAME=TEMPLATE,SPEC.
+def parse_form(arg):
+    try:
+        name, paths = arg.split("=", 1)
+        template_path, spec_path = paths.split(",", 1)
+    except ValueError:
+        raise ValueError("form should be NAME=TEMPLATE,SPEC: %s" % arg)
+    return name, template_path, spec_path
+
+# Raised for requests the server can't fill, status is the HTTP status.
+class RequestError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+# With streaming, responses are written as an update appended to the
+# template, as with --streaming, and sent without a Content-Length.
+# Otherwise each response is a rewritten PDF, buffered so it has a
+# Content-Length; it's several times smaller than the streamed one.
+class FillServer:
+    def __init__(self, forms, engine="reportlab", cache=None,
+                 streaming=False):
+
+        self.forms = {form.name: form for form in forms}
+        self.default_form = forms[0].name
+        self.engine = engine
+        self.cache = cache
+        self.streaming = streaming
+
+        self.registry = Registry()
+        self.latency = self.registry.add(Histogram(
+            "ct600_fill_request_duration_seconds",
+            "Fill request latency in seconds."
+        ))
+        self.requests = self.registry.add(Counter(
+            "ct600_fill_requests_total",
+            "Fill requests by form and HTTP status."
+        ))
+        self.stages = self.registry.add(get_stage_histogram())
+        if cache is not None:
+            self.registry.add(cache)
+
+    def get_form(self, path):
+        parts = path.strip("/").split("/")
+        if parts[0] != "fill" or len(parts) > 2:
+            raise RequestError(404, "not found")
+        name = parts[1] if len(parts) == 2 else self.default_form
+        if name not in self.forms:
+            raise RequestError(404, "unknown form: %s" % name)
+        return self.forms[name]
+
+    # Returns a Timings for a request, feeding the stage histogram.
+    def get_timings(self, form):
+        return Timings(self.stages, form=form.name)
+
+    # Renders a values document, returns the output document ready to be
+    # written to the response.
+    def fill(self, form, body, timings=None):
+
+        try:
+            with timed(timings, "load"):
+                values = load_values(body)
+        except ValueError as e:
+            raise RequestError(400, "bad values document: %s" % e)
+
+        if not isinstance(values, dict) or \
+           not isinstance(values.get("ct600"), dict):
+            raise RequestError(400, "values document needs a ct600 object")
+
+        with timed(timings, "validate"):
+            errors = form.validator.validate(values)
+        if errors:
+            raise RequestError(400, "bad values: %s" % "; ".join(errors))
+
+        with timed(timings, "create_annotations"):
+            annotations = create_annotations(values, form.spec)
+
+        with form.template.lock:
+            try:
+                return prepare_pdf(form.template, annotations,
+                                   engine=self.engine,
+                                   streaming=self.streaming,
+                                   cache=self.cache, timings=timings)
+            except (ValueError, TypeError) as e:
+                raise RequestError(400, "bad value: %s" % e)
+
+# Returns a request's body length from its Content-Length header.
+def get_content_length(headers):
+    value = headers.get("Content-Length")
+    if value is None:
+        raise RequestError(411, "Content-Length required")
+    try:
+        length = int(value)
+    except ValueError:
+        length = -1
+    if length < 0:
+        raise RequestError(400, "bad Content-Length: %s" % value)
+    return length
+
+class FillHandler(BaseHTTPRequestHandler):
+
+    # Set on the handler subclass by make_server.
+    fill_server = None
+
+    def send_body(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = self.fill_server.registry.expose().encode("utf-8")
+            self.send_body(200, "text/plain; version=0.0.4", body)
+        elif self.path == "/health":
+            self.send_body(200, "text/plain", b"ok\n")
+        else:
+            self.send_body(404, "text/plain", b"not found\n")
+
+    def do_POST(self):
+
+        start = time.perf_counter()
+        form_name = ""
+
+        output = None
+        timings = None
+
+        try:
+            form = self.fill_server.get_form(self.path)
+            form_name = form.name
+            timings = self.fill_server.get_timings(form)
+            body = self.rfile.read(get_content_length(self.headers))
+            output = self.fill_server.fill(form, body, timings)
+            status = 200
+        except RequestError as e:
+            status = e.status
+            self.send_body(status, "text/plain", (str(e) + "\n").encode())
+        except Exception as e:
+            status = 500
+            self.send_body(status, "text/plain", (str(e) + "\n").encode())
+
+        if output is not None and not self.fill_server.streaming:
+            # PdfWriter needs a seekable output, so the PDF is buffered.
+            buffer = io.BytesIO()
+            with timed(timings, "write"):
+                output.write(buffer)
+            self.send_body(200, "application/pdf", buffer.getvalue())
+
+        elif output is not None:
+            # The PDF is streamed straight to the response, so there's no
+            # Content-Length and the connection closes at the end.
+            self.send_response(200)
+            self.send_header("Content-Type", "application/pdf")
+            self.end_headers()
+            try:
+                with timed(timings, "write"):
+                    output.write(self.wfile)
+            except OSError as e:
+                self.log_error("write failed: %s", e)
+
+        self.fill_server.requests.inc(form=form_name, status=status)
+        self.fill_server.latency.observe(
+            time.perf_counter() - start, form=form_name
+        )
+
+    # Unix socket peers have no address.
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn,
+                              socketserver.UnixStreamServer):
+    daemon_threads = True
+
+# Returns an HTTP server for a FillServer, on a TCP address or, if socket
+# is given, a Unix socket.
+def make_server(fill_server, host="127.0.0.1", port=8080, socket=None):
+
+    handler = type("Handler", (FillHandler,), {"fill_server": fill_server})
+
+    if socket is not None:
+        if os.path.exists(socket):
+            os.remove(socket)
+        return ThreadingUnixHTTPServer(socket, handler)
+
+    return ThreadingHTTPServer((host, port), handler)
@@ -0,0 +1,208 @@
+
+# Streaming PDF output.  The filled form is written as an incremental
+# update to the template: the template file is copied through byte for
+# byte, followed by only the objects that are new or changed (annotated
+# page dictionaries, overlay content and resources) and a cross-reference
+# section pointing back at the template's.  Untouched template pages and
+# objects are never parsed, copied or held in writer state, and output is
+# written strictly sequentially, so any writable stream will do: a file,
+# stdout, a socket or an HTTP response.
+#
+# StreamingWriter stands in for PyPDF2's PdfWriter as far as the rendering
+# engines are concerned: add_page and _add_object.
+
+import re
+
+from PyPDF2 import PageObject
+from PyPDF2.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, EncodedStreamObject,
+    IndirectObject, NameObject, NumberObject, StreamObject
+)
+
+# Copy size when passing the template through.
+chunk_size = 1024 * 1024
+
+# Returns the offset of the template's last cross-reference section.
+def get_startxref(data):
+    tail = bytes(data[-1024:])
+    m = re.search(rb"startxref\s+(\d+)\s+%%EOF\s*$", tail)
+    if m is None:
+        raise ValueError("template has no startxref")
+    return int(m.group(1))
+
+# Returns one more than the highest object number in a reader.
+def get_size(reader):
+    size = 0
+    for objs in reader.xref.values():
+        if objs:
+            size = max(size, max(objs))
+    if reader.xref_objStm:
+        size = max(size, max(reader.xref_objStm))
+    return size + 1
+
+# A byte-counting wrapper, offsets are tracked here rather than with tell()
+# so that non-seekable streams work.
+class CountingWriter:
+    def __init__(self, outf):
+        self.outf = outf
+        self.pos = 0
+    def write(self, data):
+        self.outf.write(data)
+        self.pos += len(data)
+
+class StreamingWriter:
+    def __init__(self, template):
+
+        if template.reader.is_encrypted:
+            raise ValueError("streaming output doesn't support encrypted "
+                             "templates")
+
+        self.template = template
+        self.reader = template.reader
+
+        # Output pages, paired with the template page they replace.
+        self.pages = []
+
+        # New objects, (idnum, object), in order of allocation.
+        self.objects = []
+        self.next_idnum = get_size(self.reader)
+
+        # Objects from other documents (e.g. reportlab overlays) which
+        # have been renumbered into the output.
+        self.foreign = {}
+
+    def allocate(self, obj):
+        idnum = self.next_idnum
+        self.next_idnum += 1
+        self.objects.append((idnum, obj))
+        return IndirectObject(idnum, 0, self)
+
+    # Adds a new object, returns a reference to it.
+    def _add_object(self, obj):
+        return self.allocate(obj)
+
+    # Adds a page, which must be a template page or a copy of one.  Returns
+    # the output page, which may be modified.
+    def add_page(self, page):
+        original = self.template.pages[len(self.pages)]
+        if page.indirect_reference is None or \
+           page.indirect_reference.idnum != original.indirect_reference.idnum:
+            raise ValueError("pages must be added in template order")
+        out = PageObject(self.reader, original.indirect_reference)
+        out.update(page)
+        self.pages.append((out, original))
+        return out
+
+    def changed(self, page, original):
+        if page.keys() != original.keys():
+            return True
+        for k in page:
+            if page.raw_get(k) is not original.raw_get(k):
+                return True
+        return False
+
+    def ref(self, obj):
+        if obj.pdf is self.reader or obj.pdf is self:
+            return IndirectObject(obj.idnum, obj.generation, self)
+        key = (id(obj.pdf), obj.idnum, obj.generation)
+        if key not in self.foreign:
+            self.foreign[key] = self.allocate(obj.get_object())
+        return self.foreign[key]
+
+    # Returns obj with references to other documents renumbered, and any
+    # direct streams (which PDF requires to be indirect) allocated.
+    def convert(self, obj, top=False):
+
+        if isinstance(obj, IndirectObject):
+            return self.ref(obj)
+
+        if isinstance(obj, StreamObject):
+            if isinstance(obj, EncodedStreamObject):
+                out = EncodedStreamObject()
+                out._data = obj._data
+            else:
+                out = DecodedStreamObject()
+                out.set_data(obj.get_data())
+            for k, v in obj.items():
+                if k != "/Length":
+                    out[NameObject(k)] = self.convert(v)
+            if top:
+                return out
+            return self.allocate(out)
+
+        if isinstance(obj, DictionaryObject):
+            out = DictionaryObject()
+            for k, v in obj.items():
+                out[NameObject(k)] = self.convert(v)
+            return out
+
+        if isinstance(obj, ArrayObject):
+            return ArrayObject([self.convert(v) for v in obj])
+
+        return obj
+
+    def write_object(self, out, offsets, idnum, obj):
+        offsets[idnum] = out.pos
+        out.write(b"%d 0 obj\n" % idnum)
+        obj.write_to_stream(out, None)
+        out.write(b"\nendobj\n")
+
+    # Writes the output document.
+    def write(self, outf):
+
+        out = CountingWriter(outf)
+        data = memoryview(self.template.data)
+
+        for i in range(0, len(data), chunk_size):
+            out.write(data[i:i + chunk_size])
+        if not data[-1:] == b"\n":
+            out.write(b"\n")
+
+        offsets = {}
+
+        for page, original in self.pages:
+            if self.changed(page, original):
+                idnum = original.indirect_reference.idnum
+                self.write_object(out, offsets, idnum, self.convert(page))
+
+        # Converting may allocate further objects, so this walks a growing
+        # list.
+        n = 0
+        while n < len(self.objects):
+            idnum, obj = self.objects[n]
+            self.write_object(out, offsets, idnum, self.convert(obj, True))
+            n += 1
+
+        self.write_xref(out, offsets)
+
+    def write_xref(self, out, offsets):
+
+        startxref = out.pos
+
+        out.write(b"xref\n")
+
+        ids = sorted(offsets)
+        start = 0
+        while start < len(ids):
+            end = start
+            while end + 1 < len(ids) and ids[end + 1] == ids[end] + 1:
+                end += 1
+            out.write(b"%d %d\n" % (ids[start], end - start + 1))
+            for idnum in ids[start:end + 1]:
+                out.write(b"%010d 00000 n \n" % offsets[idnum])
+            start = end + 1
+
+        trailer = DictionaryObject()
+        trailer[NameObject("/Size")] = NumberObject(self.next_idnum)
+        trailer[NameObject("/Prev")] = NumberObject(
+            get_startxref(self.template.data)
+        )
+        for k in ("/Root", "/Info", "/ID"):
+            if k in self.reader.trailer:
+                trailer[NameObject(k)] = self.convert(
+                    self.reader.trailer.raw_get(k)
+                )
+
+        out.write(b"trailer\n")
+        trailer.write_to_stream(out, None)
+        out.write(b"\nstartxref\n%d\n%%%%EOF\n" % startxref)
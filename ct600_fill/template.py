@@ -0,0 +1,138 @@
+
+# CT600 template handling.  A Template parses a blank form once and keeps
+# a master copy of each page, overlays are merged into cheap per-output
+# clones of those pages so the master is never modified and can be reused
+# for any number of outputs.
+#
+# Template files are memory-mapped rather than read, see map_file, and
+# PdfReader parses objects as they're asked for, so pages which are only
+# passed through are never decoded.  Every process filling from the same
+# file shares one copy of it in the OS page cache, rather than holding
+# its own on the heap.
+
+import hashlib
+import io
+import mmap
+import threading
+
+from PyPDF2 import PageObject, PdfReader
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, NameObject
+
+# Maps a template file read-only.  The file must not be changed while
+# it's mapped: templates are installed, not edited in place.  An empty
+# file can't be mapped, so it's returned as bytes, for PdfReader to
+# reject.
+def map_file(path):
+    with open(path, "rb") as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return f.read()
+
+class Template:
+
+    # data is the template file's bytes, or a mapping of it from map_file.
+    def __init__(self, data):
+
+        self.data = data
+        self.digest = hashlib.sha256(data).hexdigest()
+
+        # A mapping is read in place: PdfReader only needs read, seek and
+        # tell, and copying it into a BytesIO would defeat the sharing.
+        if isinstance(data, mmap.mmap):
+            self.reader = PdfReader(data)
+        else:
+            self.reader = PdfReader(io.BytesIO(data))
+
+        # Original pages, passed through untouched when a page has no
+        # annotations.
+        self.pages = list(self.reader.pages)
+
+        # Master copies of pages, by page number, with the content stream
+        # decoded and the resource dictionary resolved, ready for merging.
+        # They're made as pages are first cloned.
+        self.masters = {}
+
+        # PyPDF2 readers aren't safe to share between threads, threaded
+        # callers hold this while rendering against the template.
+        self.lock = threading.Lock()
+
+    # Returns a page's content, decoded, None if it has no content.
+    def get_content(self, page):
+
+        contents = self.pages[page].get_contents()
+        if contents is None:
+            return None
+
+        if isinstance(contents, ArrayObject):
+            return b"\n".join(s.get_object().get_data() for s in contents)
+
+        return contents.get_data()
+
+    def get_master(self, page):
+
+        if page in self.masters:
+            return self.masters[page]
+
+        original = self.pages[page]
+        master = PageObject(self.reader, original.indirect_reference)
+        master.update(original)
+
+        data = self.get_content(page)
+        if data is not None:
+            stream = DecodedStreamObject()
+            stream.set_data(data)
+            master[NameObject("/Contents")] = stream
+
+        if "/Resources" in original:
+            master[NameObject("/Resources")] = \
+                original["/Resources"].get_object()
+
+        self.masters[page] = master
+
+        return master
+
+    def __len__(self):
+        return len(self.pages)
+
+    # Returns a fresh copy of a page to merge an overlay into.  Merging
+    # replaces the page's /Contents and /Resources entries rather than
+    # modifying the objects they refer to, so a shallow copy is enough to
+    # keep the master intact.
+    def clone_page(self, page):
+        master = self.get_master(page)
+        clone = PageObject(self.reader, master.indirect_reference)
+        clone.update(master)
+        return clone
+
+# Parsed templates keyed by the SHA-256 of the template file, so that
+# different form versions can be cached side by side and a changed file
+# on disk is never served stale.
+class TemplateCache:
+    def __init__(self):
+        self.templates = {}
+
+    # Returns the template for a file, mapping it with map_file.  A
+    # mapping of a file that's already cached is closed again.
+    def get(self, path):
+        data = map_file(path)
+        template = self.get_data(data)
+        if template.data is not data and isinstance(data, mmap.mmap):
+            data.close()
+        return template
+
+    def get_data(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        if digest not in self.templates:
+            self.templates[digest] = Template(data)
+        return self.templates[digest]
+
+    def __len__(self):
+        return len(self.templates)
+
+template_cache = TemplateCache()
+
+# Returns the parsed template for a CT600 PDF file, from the process-wide
+# cache.
+def get_template(path):
+    return template_cache.get(path)
@@ -0,0 +1,134 @@
+
+# Timing instrumentation for the fill pipeline.  A Timings collects the
+# duration of each stage of a fill (input load, get_spec, template open,
+# create_annotations, per-page get_page and merge_page, write) and can
+# feed them to a Histogram, labelled by stage and page, and by form where
+# there's one, so long-running modes aggregate them.  Pipeline functions
+# take timings=None and time nothing without one.
+
+import contextlib
+import json
+import time
+
+from ct600_fill.metrics import Histogram
+
+# Stage duration buckets in seconds, finer than request latency as most
+# stages take milliseconds.
+stage_buckets = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5
+)
+
+def get_stage_histogram():
+    return Histogram(
+        "ct600_fill_stage_duration_seconds",
+        "Fill pipeline stage durations in seconds.",
+        stage_buckets
+    )
+
+class Timings:
+
+    # histogram, if given, is fed every duration with labels plus stage,
+    # and page for per-page stages.
+    def __init__(self, histogram=None, **labels):
+        self.records = []
+        self.histogram = histogram
+        self.labels = labels
+
+    def add(self, stage, seconds, page=None):
+
+        self.records.append((stage, page, seconds))
+
+        if self.histogram is not None:
+            self.observe(self.histogram, stage, page, seconds)
+
+    def observe(self, histogram, stage, page, seconds):
+        labels = dict(self.labels, stage=stage)
+        if page is not None:
+            labels["page"] = page
+        histogram.observe(seconds, **labels)
+
+    # Feeds every duration recorded so far to a histogram, with the labels
+    # as they are now, e.g. for timings recorded in a worker process.
+    def feed(self, histogram):
+        for stage, page, seconds in self.records:
+            self.observe(histogram, stage, page, seconds)
+
+    @contextlib.contextmanager
+    def stage(self, stage, page=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, page)
+
+    def total(self):
+        return sum(seconds for stage, page, seconds in self.records)
+
+    # Returns a JSON-serialisable record of the timings.
+    def get_record(self, **info):
+        record = dict(info)
+        record["stages"] = [
+            {"stage": stage, "page": page, "seconds": seconds}
+            for stage, page, seconds in self.records
+        ]
+        record["total"] = self.total()
+        return record
+
+    def write_json(self, path, **info):
+        with open(path, "w") as f:
+            json.dump(self.get_record(**info), f, indent=2)
+            f.write("\n")
+
+    # Writes a table of stage durations, in order, to a text file.
+    def report(self, outf):
+        for stage, page, seconds in self.records:
+            if page is not None:
+                stage = "%s page %d" % (stage, page)
+            outf.write("  %-24s %9.2f ms\n" % (stage, seconds * 1000))
+        outf.write("  %-24s %9.2f ms\n" % ("total", self.total() * 1000))
+
+# Times a stage if there's a Timings, e.g.
+#   with timed(timings, "merge_page", page): ...
+@contextlib.contextmanager
+def timed(timings, stage, page=None):
+    if timings is None:
+        yield
+        return
+    with timings.stage(stage, page):
+        yield
+
+# Writes a summary of a stage histogram: count, mean and total for each
+# series, slowest total first, so the slow stage or page stands out.
+def report_histogram(histogram, outf):
+
+    rows = []
+    for key, (cumulative, total, count) in histogram.snapshot().items():
+        labels = dict(key)
+        name = labels.pop("stage")
+        if "page" in labels:
+            name = "%s page %s" % (name, labels.pop("page"))
+        for k, v in sorted(labels.items()):
+            name = "%s %s=%s" % (name, k, v)
+        rows.append((total, count, name))
+
+    for total, count, name in sorted(rows, reverse=True):
+        outf.write("  %-32s %6d x %9.2f ms = %10.2f ms\n" % (
+            name, count, total / count * 1000, total * 1000
+        ))
+
+# Returns a JSON-serialisable form of a stage histogram.
+def get_histogram_record(histogram):
+    return {
+        "buckets": list(histogram.buckets),
+        "series": [
+            {
+                "labels": dict(key),
+                "counts": cumulative,
+                "sum": total,
+                "count": count,
+            }
+            for key, (cumulative, total, count)
+            in sorted(histogram.snapshot().items())
+        ]
+    }
@@ -0,0 +1,144 @@
+
+# Values validation.  Each annotation type accepts a particular kind of
+# value, and a bad value otherwise only shows up when the annotation's do()
+# raises partway through rendering, or draws garbage.  A Validator is
+# compiled from a spec once, a check per box, and checks a values document
+# before any PDF work, reporting every problem with its box number.
+
+import datetime
+import math
+
+from ct600_fill.annotations import (
+    SpaceMoney,
+    SpacePounds,
+    SpaceZeroPadNumber,
+    WriteBool,
+    WriteMoney,
+    WritePounds,
+    WriteSpaceDate,
+    WriteSpaceSortCode,
+)
+
+# Raised for a values document that fails validation.  errors is the list
+# of problems, e.g. ["box 30: not a YYYY-MM-DD date: '1/1/2020'"].
+# The list is the exception's only argument, so it survives pickling, e.g.
+# back from a batch worker process.
+class ValidationError(ValueError):
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+    def __str__(self):
+        return "; ".join(self.errors)
+
+# Value checks.  Each takes an annotation and a value, and returns an error
+# message or None.  They accept exactly what the annotation's do() method
+# accepts.
+
+def check_number(ann, value):
+    try:
+        if isinstance(value, bool) or not math.isfinite(float(value)):
+            return "not a number: %r" % value
+    except (TypeError, ValueError):
+        return "not a number: %r" % value
+
+def check_digits(ann, value):
+    error = check_number(ann, value)
+    if error:
+        return error
+    if len("%d" % int(float(value))) > ann.digits:
+        return "%r is longer than %d digits" % (value, ann.digits)
+
+def check_zero_pad(ann, value):
+    try:
+        if isinstance(value, bool):
+            raise ValueError()
+        n = int(value)
+    except (TypeError, ValueError):
+        return "not a whole number: %r" % value
+    if len("%d" % n) > ann.digits:
+        return "%r is longer than %d digits" % (value, ann.digits)
+
+def check_date(ann, value):
+    try:
+        datetime.datetime.strptime(str(value), "%Y-%m-%d")
+    except ValueError:
+        return "not a YYYY-MM-DD date: %r" % value
+
+def check_sort_code(ann, value):
+    value = str(value)
+    if len(value) != 6 or not value.isdigit():
+        return "sort code should be 6 digits: %r" % value
+
+def check_bool(ann, value):
+    if not isinstance(value, bool):
+        return "should be true or false: %r" % value
+
+checks = {
+    WritePounds: check_number,
+    WriteMoney: check_number,
+    SpacePounds: check_digits,
+    SpaceMoney: check_digits,
+    SpaceZeroPadNumber: check_zero_pad,
+    WriteSpaceDate: check_date,
+    WriteSpaceSortCode: check_sort_code,
+    WriteBool: check_bool,
+}
+
+class Validator:
+
+    # Takes a spec, as returned by get_spec.
+    def __init__(self, spec):
+
+        # Box number to a list of (check, annotation).  Boxes drawn more
+        # than once with the same type of annotation are checked once.
+        self.checks = {}
+
+        for box, anns in spec.items():
+            box_checks = []
+            seen = set()
+            for ann in anns:
+                check = checks.get(type(ann))
+                if check is None:
+                    continue
+                key = (check, getattr(ann, "digits", None))
+                if key in seen:
+                    continue
+                seen.add(key)
+                box_checks.append((check, ann))
+            self.checks[box] = box_checks
+
+    # Checks a values document, returns a list of errors, empty if it's
+    # valid.  Boxes which aren't on the form are ignored, as they are when
+    # filling, see get_unknown.
+    def validate(self, values):
+
+        if not isinstance(values, dict) or \
+           not isinstance(values.get("ct600"), dict):
+            return ["values document needs a ct600 object"]
+
+        errors = []
+
+        for box, value in values["ct600"].items():
+
+            # Boxes left empty aren't drawn.
+            if box not in self.checks or value is None:
+                continue
+
+            for check, ann in self.checks[box]:
+                error = check(ann, value)
+                if error:
+                    errors.append("box %s: %s" % (box, error))
+
+        return errors
+
+    # Returns the boxes in a valid values document which aren't on the
+    # form, e.g. values for a different version of the form.
+    def get_unknown(self, values):
+        return [box for box in values["ct600"] if box not in self.checks]
+
+    # Raises ValidationError if a values document isn't valid.
+    def check(self, values):
+        errors = self.validate(values)
+        if errors:
+            raise ValidationError(errors)
@@ -0,0 +1,37 @@
+import os
+
+import pytest
+import yaml
+
+from ct600_fill.annotations import WriteString, create_annotations, get_spec
+from ct600_fill.template import get_template
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ALL_VALUES = os.path.join(PROJECT_DIR, "all-values.yaml")
+CT600_PDF = os.path.join(PROJECT_DIR, "CT600.pdf")
+SPEC_JSON = os.path.join(PROJECT_DIR, "spec.json")
+
+
+# The bundled CT600.pdf, shared from the template cache.
+@pytest.fixture(scope="session")
+def template():
+    return get_template(CT600_PDF)
+
+
+# all-values.yaml's annotations on the bundled spec.
+@pytest.fixture(scope="session")
+def annotations():
+    with open(ALL_VALUES) as f:
+        values = yaml.safe_load(f)
+    return create_annotations(values, get_spec(SPEC_JSON))
+
+
+# A small spec with one box on each of the first three pages: 1 (company
+# name), 90 (reason) and 145 (an amount).
+@pytest.fixture
+def spec():
+    return {
+        1: [WriteString(0, 76, 210.2)],
+        90: [WriteString(1, 25, 244.5)],
+        145: [WriteString(2, 79, 93.0)],
+    }
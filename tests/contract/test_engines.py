@@ -0,0 +1,132 @@
+import io
+import os
+
+import pytest
+import yaml
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ContentStream
+
+from ct600_fill.annotations import create_annotations, get_spec
+from ct600_fill.render import create_pdf
+from ct600_fill.template import get_template
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ALL_VALUES = os.path.join(PROJECT_DIR, "all-values.yaml")
+CT600_PDF = os.path.join(PROJECT_DIR, "CT600.pdf")
+SPEC_JSON = os.path.join(PROJECT_DIR, "spec.json")
+
+
+def multiply(m, n):
+    a, b, c, d, e, f = m
+    A, B, C, D, E, F = n
+    return [a * A + b * C, a * B + b * D, c * A + d * C, c * B + d * D,
+            e * A + f * C + E, e * B + f * D + F]
+
+
+# Walks a page's content, returning (text, x, y) in page space for every
+# string shown in Courier-Bold, i.e. the filled-in values, or for every
+# glyph of a TJ.  Blanks aren't included.
+def placed_text(page):
+    fonts = page["/Resources"].get_object()["/Font"].get_object()
+    stream = ContentStream(page.get_contents(), page.pdf)
+    ctm = [1, 0, 0, 1, 0, 0]
+    stack = []
+    tm = [1, 0, 0, 1, 0, 0]
+    tlm = tm
+    font = None
+    out = []
+    for operands, op in stream.operations:
+        if op == b"q":
+            stack.append(ctm)
+        elif op == b"Q":
+            ctm = stack.pop()
+        elif op == b"cm":
+            ctm = multiply([float(v) for v in operands], ctm)
+        elif op == b"BT":
+            tm = tlm = [1, 0, 0, 1, 0, 0]
+        elif op == b"Tf":
+            font = fonts[operands[0]].get_object()["/BaseFont"]
+        elif op == b"Tm":
+            tm = tlm = [float(v) for v in operands]
+        elif op == b"Td":
+            tm = tlm = multiply([1, 0, 0, 1] + [float(v) for v in operands], tlm)
+        elif op == b"Tj" and font == "/Courier-Bold":
+            m = multiply(tm, ctm)
+            if str(operands[0]).strip():
+                out.append((str(operands[0]), m[4], m[5]))
+        elif op == b"TJ" and font == "/Courier-Bold":
+            # One entry per glyph, Courier glyphs being 600/1000 em wide.
+            x = 0
+            for item in operands[0]:
+                if isinstance(item, (str, bytes)):
+                    for c in str(item):
+                        m = multiply([1, 0, 0, 1, x, 0], multiply(tm, ctm))
+                        if c.strip():
+                            out.append((c, m[4], m[5]))
+                        x += 0.6 * 12
+                else:
+                    x -= float(item) / 1000 * 12
+    # Sorted on rounded positions, so that positions which differ only by
+    # rounding don't change the order.
+    return sorted(out, key=lambda t: (t[0], round(t[1], 2), round(t[2], 2)))
+
+
+def fill(engine):
+    with open(ALL_VALUES) as f:
+        values = yaml.safe_load(f)
+    annotations = create_annotations(values, get_spec(SPEC_JSON))
+    buffer = io.BytesIO()
+    create_pdf(buffer, get_template(CT600_PDF), annotations, engine=engine)
+    buffer.seek(0)
+    return PdfReader(buffer)
+
+
+@pytest.fixture(scope="module")
+def reportlab_pdf():
+    return fill("reportlab")
+
+
+@pytest.fixture(scope="module")
+def direct_pdf():
+    return fill("direct")
+
+
+class TestDirectEngineMatchesReportlab:
+    def test_same_page_count(self, reportlab_pdf, direct_pdf):
+        assert len(direct_pdf.pages) == len(reportlab_pdf.pages)
+
+    def test_same_text_at_same_positions(self, reportlab_pdf, direct_pdf):
+        for expected_page, actual_page in zip(reportlab_pdf.pages, direct_pdf.pages):
+            expected = placed_text(expected_page)
+            actual = placed_text(actual_page)
+            assert len(actual) == len(expected)
+            for (e_text, e_x, e_y), (a_text, a_x, a_y) in zip(expected, actual):
+                assert a_text == e_text
+                assert a_x == pytest.approx(e_x, abs=0.01)
+                assert a_y == pytest.approx(e_y, abs=0.01)
+
+    def test_template_content_preserved(self, direct_pdf):
+        original = PdfReader(CT600_PDF)
+        text = direct_pdf.pages[0].extract_text()
+        for line in original.pages[0].extract_text().splitlines()[:5]:
+            assert line in text
+
+
+# The idnums of the Courier-Bold font objects used by every page.
+def overlay_font_ids(pdf):
+    ids = set()
+    for page in pdf.pages:
+        fonts = page["/Resources"].get_object()["/Font"].get_object()
+        for name in fonts:
+            ref = fonts.raw_get(name)
+            if ref.get_object()["/BaseFont"] == "/Courier-Bold":
+                ids.add(ref.idnum)
+    return ids
+
+
+class TestSharedFont:
+    def test_reportlab_pages_share_one_font(self, reportlab_pdf):
+        assert len(overlay_font_ids(reportlab_pdf)) == 1
+
+    def test_direct_pages_share_one_font(self, direct_pdf):
+        assert len(overlay_font_ids(direct_pdf)) == 1
@@ -2,11 +2,13 @@ import io
 import json
 
 import pytest
+from PyPDF2 import PdfReader
 
 from ct600_fill.annotations import (
     get_spec,
     create_annotations,
     get_page,
+    get_overlay,
     WriteString,
     WriteBool,
     SpaceString,
@@ -108,3 +110,29 @@ class TestAnnotationsToPagePipeline:
         assert len(buffers) == 2
         for page_num, buf in buffers.items():
             assert buf.read()[:5] == b"%PDF-"
+
+
+class TestAnnotationsToOverlayPipeline:
+    def test_overlay_has_one_page_per_annotated_page(self, mini_spec, sample_values):
+        spec = get_spec(mini_spec)
+        annotations = create_annotations(sample_values, spec)
+
+        buffer, index = get_overlay(annotations)
+
+        assert buffer.read()[:5] == b"%PDF-"
+        buffer.seek(0)
+        assert len(PdfReader(buffer).pages) == len(annotations)
+        assert sorted(index) == sorted(annotations)
+        assert sorted(index.values()) == list(range(len(annotations)))
+
+    def test_overlay_pages_match_single_page_overlays(self, mini_spec, sample_values):
+        spec = get_spec(mini_spec)
+        annotations = create_annotations(sample_values, spec)
+
+        buffer, index = get_overlay(annotations)
+        overlay = PdfReader(buffer)
+
+        for page_num in annotations:
+            single = PdfReader(get_page(annotations, page_num)).pages[0]
+            combined = overlay.pages[index[page_num]]
+            assert combined.extract_text() == single.extract_text()
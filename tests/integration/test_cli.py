@@ -1,9 +1,12 @@
+import json
 import os
+import pstats
 import subprocess
 import sys
 import tempfile
 
 import pytest
+from PyPDF2 import PdfReader
 
 PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 ALL_VALUES = os.path.join(PROJECT_DIR, "all-values.yaml")
@@ -48,6 +51,47 @@ class TestCLIEndToEnd:
         assert result.returncode == 0
         assert os.path.getsize(output_pdf) > 0
 
+    def test_direct_engine(self, output_pdf):
+        result = run_cli(
+            "--input", ALL_VALUES,
+            "--output", output_pdf,
+            "--ct600", CT600_PDF,
+            "--spec", SPEC_JSON,
+            "--engine", "direct",
+        )
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        with open(output_pdf, "rb") as f:
+            assert f.read(5) == b"%PDF-"
+
+    def test_streaming_to_stdout(self):
+        result = run_cli(
+            "--input", ALL_VALUES,
+            "--output", "-",
+            "--ct600", CT600_PDF,
+            "--spec", SPEC_JSON,
+            "--engine", "direct",
+            "--streaming",
+        )
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        with open(CT600_PDF, "rb") as f:
+            assert result.stdout.startswith(f.read())
+        assert result.stdout.endswith(b"%%EOF\n")
+
+    def test_refill_reuses_unchanged_pages(self, output_pdf):
+        args = (
+            "--input", ALL_VALUES,
+            "--output", output_pdf,
+            "--ct600", CT600_PDF,
+            "--spec", SPEC_JSON,
+            "--engine", "direct",
+            "--refill",
+        )
+        result = run_cli(*args)
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        result = run_cli(*args)
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        assert b"rendered 0 of" in result.stderr
+
     def test_help_flag(self):
         result = run_cli("--help")
         assert result.returncode == 0
@@ -61,3 +105,454 @@ class TestCLIEndToEnd:
             "--spec", SPEC_JSON,
         )
         assert result.returncode != 0
+
+
+# Cumulative import time budget for ct600_fill.cli, in microseconds.  It
+# takes around 20 ms without the PDF libraries, against 270 ms with them.
+IMPORT_BUDGET_US = 100000
+
+
+def import_times(*args):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "ct600_fill"] + list(args),
+        capture_output=True,
+        cwd=PROJECT_DIR,
+    )
+    assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+    times = {}
+    for line in result.stderr.decode().splitlines():
+        if line.startswith("import time:") and "|" in line:
+            self_us, cumulative, name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+class TestCLIStartup:
+    def test_engine_names_match_render(self):
+        from ct600_fill.cli import engine_names
+        from ct600_fill.render import engines
+        assert engine_names == sorted(engines)
+
+    @pytest.mark.parametrize("args", [
+        ["--help"],
+        ["derive", "--help"],
+        ["--validate-only", "--input", ALL_VALUES],
+    ])
+    def test_no_pdf_libraries_without_rendering(self, args):
+        loaded = [
+            name for name in import_times(*args)
+            if name.split(".")[0] in ("PyPDF2", "reportlab")
+        ]
+        assert loaded == []
+
+    def test_help_import_budget(self):
+        # Best of three, so a busy machine doesn't fail the test.
+        runs = [import_times("--help") for i in range(3)]
+        assert "yaml" not in runs[0]
+        assert min(times["ct600_fill.cli"] for times in runs) < IMPORT_BUDGET_US
+
+
+class TestCLIBatch:
+    def test_batch_directory(self, tmp_path):
+        inputs = tmp_path / "inputs"
+        inputs.mkdir()
+        for name in ("alpha", "beta"):
+            (inputs / (name + ".yaml")).write_text(
+                "ct600:\n  1: %s Ltd\n  2: 12345678\n" % name
+            )
+        out = tmp_path / "out"
+
+        result = run_cli(
+            "--batch", str(inputs),
+            "--output-dir", str(out),
+            "--ct600", CT600_PDF,
+            "--spec", SPEC_JSON,
+        )
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        for name in ("alpha", "beta"):
+            with open(out / (name + ".pdf"), "rb") as f:
+                assert f.read(5) == b"%PDF-"
+
+    def test_batch_manifest(self, tmp_path):
+        (tmp_path / "one.yaml").write_text("ct600:\n  1: One Ltd\n")
+        manifest = tmp_path / "manifest.txt"
+        manifest.write_text("one.yaml\n")
+
+        result = run_cli(
+            "--manifest", str(manifest),
+            "--output-dir", str(tmp_path),
+            "--ct600", CT600_PDF,
+            "--spec", SPEC_JSON,
+        )
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        assert os.path.exists(tmp_path / "one.pdf")
+
+    def test_batch_failure_sets_exit_status(self, tmp_path):
+        (tmp_path / "bad.yaml").write_text("ct600:\n  30: not-a-date\n")
+
+        result = run_cli(
+            "--batch", str(tmp_path),
+            "--output-dir", str(tmp_path),
+            "--ct600", CT600_PDF,
+            "--spec", SPEC_JSON,
+        )
+        assert result.returncode != 0
+        assert b"bad.yaml" in result.stderr
+
+    def test_batch_parallel_jobs(self, tmp_path):
+        for i in range(4):
+            (tmp_path / ("r%d.yaml" % i)).write_text("ct600:\n  1: Company %d\n" % i)
+        out = tmp_path / "out"
+
+        result = run_cli(
+            "--batch", str(tmp_path / "*.yaml"),
+            "--output-dir", str(out),
+            "--jobs", "2",
+            "--ct600", CT600_PDF,
+            "--spec", SPEC_JSON,
+        )
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        assert sorted(os.listdir(out)) == ["r%d.pdf" % i for i in range(4)]
+
+
+class TestCLIIXBRL:
+    IXBRL = (
+        '<html xmlns:ix="http://www.xbrl.org/2013/inlineXBRL"><body>'
+        '<ix:nonNumeric name="ct:CompanyName">%s Ltd</ix:nonNumeric>'
+        '<ix:nonFraction name="ct:Profit">1,234</ix:nonFraction>'
+        '</body></html>'
+    )
+
+    @pytest.fixture
+    def mapping(self, tmp_path):
+        path = tmp_path / "mapping.yaml"
+        path.write_text("ct:CompanyName: 1\nct:Profit: 145\n")
+        return str(path)
+
+    def test_ixbrl_input(self, tmp_path, mapping, output_pdf):
+        comps = tmp_path / "comps.html"
+        comps.write_text(self.IXBRL % "Example")
+
+        result = run_cli(
+            "--input", str(comps),
+            "--ixbrl", mapping,
+            "--output", output_pdf,
+            "--ct600", CT600_PDF,
+            "--spec", SPEC_JSON,
+            "--engine", "direct",
+        )
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        text = PdfReader(output_pdf).pages[0].extract_text()
+        assert "Example Ltd" in text
+
+    def test_malformed_ixbrl_is_reported(self, tmp_path, mapping, output_pdf):
+        comps = tmp_path / "comps.html"
+        comps.write_text("<html><body></html>")
+
+        result = run_cli(
+            "--input", str(comps),
+            "--ixbrl", mapping,
+            "--output", output_pdf,
+        )
+        assert result.returncode == 1
+        stderr = result.stderr.decode()
+        assert "%s: bad iXBRL: mismatched tag" % comps in stderr
+        assert "Traceback" not in stderr
+
+    def test_missing_mapping_is_reported(self, tmp_path, output_pdf):
+        result = run_cli(
+            "--input", ALL_VALUES,
+            "--ixbrl", str(tmp_path / "missing.yaml"),
+            "--output", output_pdf,
+        )
+        assert result.returncode == 1
+        stderr = result.stderr.decode()
+        assert "missing.yaml" in stderr
+        assert "Traceback" not in stderr
+
+    def test_ixbrl_batch(self, tmp_path, mapping):
+        inputs = tmp_path / "inputs"
+        inputs.mkdir()
+        for name in ("alpha", "beta"):
+            (inputs / (name + ".html")).write_text(self.IXBRL % name)
+        (inputs / "ignored.yaml").write_text("ct600:\n  1: Ignored\n")
+        out = tmp_path / "out"
+
+        result = run_cli(
+            "--batch", str(inputs),
+            "--ixbrl", mapping,
+            "--output-dir", str(out),
+            "--ct600", CT600_PDF,
+            "--spec", SPEC_JSON,
+        )
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        assert sorted(os.listdir(out)) == ["alpha.pdf", "beta.pdf"]
+
+
+class TestCLIInputFormats:
+    def test_json_input(self, tmp_path, output_pdf):
+        values = tmp_path / "values.json"
+        values.write_text('{"ct600": {"1": "Example Ltd"}}')
+
+        result = run_cli(
+            "--input", str(values),
+            "--output", output_pdf,
+            "--ct600", CT600_PDF,
+            "--spec", SPEC_JSON,
+            "--engine", "direct",
+        )
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        assert "Example Ltd" in PdfReader(output_pdf).pages[0].extract_text()
+
+    def test_bulk_jsonl(self, tmp_path):
+        bulk = tmp_path / "returns.jsonl"
+        bulk.write_text('{"id": "acme", "1": "Acme Ltd"}\n{"1": "Beta Ltd"}\n')
+        out = tmp_path / "out"
+
+        result = run_cli(
+            "--bulk", str(bulk),
+            "--output-dir", str(out),
+            "--ct600", CT600_PDF,
+            "--spec", SPEC_JSON,
+        )
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        assert sorted(os.listdir(out)) == ["acme.pdf", "returns-2.pdf"]
+        assert b"Filled 2 of 2 returns." in result.stderr
+
+
+class TestCLIValidate:
+    def test_validate_only_reports_every_error(self, tmp_path):
+        (tmp_path / "good.yaml").write_text("ct600:\n  1: Good Ltd\n")
+        (tmp_path / "bad.yaml").write_text(
+            "ct600:\n  30: 1/1/2020\n  145: lots\n"
+        )
+        out = tmp_path / "out"
+
+        result = run_cli(
+            "--batch", str(tmp_path),
+            "--output-dir", str(out),
+            "--spec", SPEC_JSON,
+            "--validate-only",
+        )
+        assert result.returncode == 1
+        assert b"bad.yaml: box 30: not a YYYY-MM-DD date" in result.stderr
+        assert b"bad.yaml: box 145: not a number" in result.stderr
+        assert b"1 of 2 inputs valid." in result.stderr
+        assert not out.exists()
+
+    def test_validate_only_valid_input(self):
+        result = run_cli(
+            "--input", ALL_VALUES,
+            "--spec", SPEC_JSON,
+            "--validate-only",
+        )
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        assert b"1 of 1 inputs valid." in result.stderr
+
+    def test_fill_rejects_bad_values_before_rendering(self, tmp_path, output_pdf):
+        values = tmp_path / "bad.yaml"
+        values.write_text("ct600:\n  30: 1/1/2020\n")
+
+        result = run_cli(
+            "--input", str(values),
+            "--output", output_pdf,
+            "--ct600", CT600_PDF,
+            "--spec", SPEC_JSON,
+        )
+        assert result.returncode == 1
+        assert b"box 30: not a YYYY-MM-DD date" in result.stderr
+        assert b"Opened" not in result.stderr
+        assert not os.path.exists(output_pdf)
+
+
+class TestCLITimings:
+    def test_timings_report_and_json(self, tmp_path, output_pdf):
+        timings_json = tmp_path / "timings.json"
+        result = run_cli(
+            "--input", ALL_VALUES,
+            "--output", output_pdf,
+            "--ct600", CT600_PDF,
+            "--spec", SPEC_JSON,
+            "--timings",
+            "--timings-json", str(timings_json),
+        )
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        assert b"merge_page page 0" in result.stderr
+        record = json.loads(timings_json.read_text())
+        stages = {(s["stage"], s["page"]) for s in record["stages"]}
+        for stage in ("load", "get_spec", "template", "create_annotations", "write"):
+            assert (stage, None) in stages
+        assert ("get_page", 0) in stages
+        assert ("merge_page", 0) in stages
+        assert record["total"] > 0
+
+    def test_profile(self, tmp_path, output_pdf):
+        profile = tmp_path / "fill.prof"
+        result = run_cli(
+            "--input", ALL_VALUES,
+            "--output", output_pdf,
+            "--ct600", CT600_PDF,
+            "--spec", SPEC_JSON,
+            "--engine", "direct",
+            "--profile", str(profile),
+        )
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        assert pstats.Stats(str(profile)).total_calls > 0
+
+    def test_batch_timings_json(self, tmp_path):
+        for i in range(3):
+            (tmp_path / ("r%d.yaml" % i)).write_text("ct600:\n  1: Company %d\n" % i)
+        timings_json = tmp_path / "timings.json"
+
+        result = run_cli(
+            "--batch", str(tmp_path),
+            "--output-dir", str(tmp_path / "out"),
+            "--ct600", CT600_PDF,
+            "--spec", SPEC_JSON,
+            "--engine", "direct",
+            "--jobs", "2",
+            "--timings-json", str(timings_json),
+        )
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        record = json.loads(timings_json.read_text())
+        series = {
+            tuple(sorted(s["labels"].items())): s["count"] for s in record["series"]
+        }
+        assert series[(("page", 0), ("stage", "add_overlay"))] == 3
+        assert series[(("stage", "write"),)] == 3
+
+
+class TestCLIArchive:
+    def test_optimise(self, output_pdf):
+        result = run_cli(
+            "--input", ALL_VALUES,
+            "--output", output_pdf,
+            "--ct600", CT600_PDF,
+            "--spec", SPEC_JSON,
+            "--engine", "direct",
+            "--optimise",
+        )
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        assert len(PdfReader(output_pdf).pages) > 0
+
+    def test_archive_list_and_extract(self, tmp_path):
+        for name in ("alpha", "beta"):
+            (tmp_path / (name + ".yaml")).write_text(
+                "ct600:\n  1: %s Ltd\n" % name.title()
+            )
+        archive = str(tmp_path / "archive.pdf")
+
+        result = run_cli(
+            "--batch", str(tmp_path),
+            "--archive", archive,
+            "--ct600", CT600_PDF,
+            "--spec", SPEC_JSON,
+        )
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+
+        result = run_cli("archive", archive)
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        assert result.stdout.decode().split("\n")[1].startswith("beta\t")
+
+        extracted = str(tmp_path / "beta.pdf")
+        result = run_cli("archive", archive, "--extract", "beta",
+                         "--output", extracted)
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        assert "Beta Ltd" in PdfReader(extracted).pages[0].extract_text()
+
+    def test_archive_needs_batch_mode(self, tmp_path):
+        result = run_cli("--archive", str(tmp_path / "archive.pdf"))
+        assert result.returncode != 0
+        assert b"--archive" in result.stderr
+
+
+class TestCLIForms:
+    def test_fill_chooses_form_by_period(self, output_pdf):
+        result = run_cli(
+            "--input", ALL_VALUES,
+            "--output", output_pdf,
+            "--forms", "forms.yaml",
+        )
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        assert b"Using form ct600-2023-v3." in result.stderr
+        assert "(2023)" in PdfReader(output_pdf).pages[0].extract_text()
+
+    def test_fingerprint_mismatch_is_reported(self, tmp_path, output_pdf):
+        forms = tmp_path / "forms.yaml"
+        forms.write_text(
+            "forms:\n"
+            "  - name: wrong\n"
+            "    template: %s\n"
+            "    spec: %s\n"
+            "    fingerprint: %s\n" % (CT600_PDF, SPEC_JSON, "0" * 64)
+        )
+
+        result = run_cli(
+            "--input", ALL_VALUES,
+            "--output", output_pdf,
+            "--forms", str(forms),
+        )
+        assert result.returncode == 1
+        stderr = result.stderr.decode()
+        assert "form wrong: %s doesn't match the form's fingerprint" % \
+            CT600_PDF in stderr
+        assert "Traceback" not in stderr
+        assert not os.path.exists(output_pdf)
+
+    def test_list_and_identify(self):
+        result = run_cli("forms")
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        assert result.stdout.decode().startswith("ct600-2023-v3\t")
+
+        result = run_cli("forms", CT600_PDF)
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        assert result.stdout.decode() == CT600_PDF + "\tct600-2025-v3\n"
+
+    def test_archive_rejects_forms(self, tmp_path):
+        result = run_cli("--batch", str(tmp_path),
+                         "--archive", str(tmp_path / "archive.pdf"),
+                         "--forms", "forms.yaml")
+        assert result.returncode != 0
+        assert b"--forms" in result.stderr
+
+
+class TestCLIDerive:
+    def test_fill_with_rules_file(self, output_pdf):
+        result = run_cli(
+            "--input", ALL_VALUES,
+            "--output", output_pdf,
+            "--derive", "rules-ct600-2025-v3.yaml",
+        )
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        assert b"warning: box 165:" in result.stderr
+
+    def test_bare_derive_needs_forms(self, output_pdf):
+        result = run_cli("--input", ALL_VALUES, "--output", output_pdf,
+                         "--derive")
+        assert result.returncode != 0
+        assert b"--forms" in result.stderr
+
+    def test_derive_bulk(self, tmp_path):
+        bulk = tmp_path / "returns.jsonl"
+        bulk.write_text(
+            '{"id": "a", "155": 1000, "160": 200}\n'
+            '{"id": "b", "155": "lots"}\n'
+        )
+        result = run_cli("derive", "rules-ct600-2025-v3.yaml", str(bulk))
+        assert result.returncode == 1
+        assert b":2: box 155: not a number" in result.stderr
+        rows = [json.loads(line) for line in result.stdout.decode().splitlines()]
+        assert len(rows) == 1
+        assert rows[0]["id"] == "a"
+        assert rows[0]["165"] == 800
+        assert rows[0]["315"] == 800
+
+    def test_derive_values_file(self, tmp_path):
+        path = tmp_path / "r.yaml"
+        path.write_text("ct600:\n  155: 1000\n  160: 200\n")
+        out = tmp_path / "out.yaml"
+        result = run_cli("derive", "rules-ct600-2025-v3.yaml", str(path),
+                         "--output", str(out))
+        assert result.returncode == 0, f"stderr: {result.stderr.decode()}"
+        assert "165: 800\n" in out.read_text()
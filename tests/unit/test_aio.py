@@ -0,0 +1,104 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from ct600_fill.aio import AsyncFiller, fill_async
+from ct600_fill.annotations import get_spec
+from ct600_fill.template import get_template
+from ct600_fill.validate import ValidationError
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CT600_PDF = os.path.join(PROJECT_DIR, "CT600.pdf")
+SPEC_JSON = os.path.join(PROJECT_DIR, "spec.json")
+
+VALUES = {"ct600": {1: "Example Biz Ltd.", 30: "2020-01-01"}}
+
+
+@pytest.fixture
+def filler():
+    filler = AsyncFiller(max_concurrency=2, engine="direct")
+    yield filler
+    filler.close()
+
+
+class TestAsyncFiller:
+    def test_fill_returns_pdf(self, filler):
+        pdf = asyncio.run(filler.fill(VALUES, template=CT600_PDF, spec=SPEC_JSON))
+        assert pdf[:5] == b"%PDF-"
+
+    def test_accepts_loaded_template_and_spec(self, filler):
+        template = get_template(CT600_PDF)
+        spec = get_spec(SPEC_JSON)
+        pdf = asyncio.run(filler.fill(VALUES, template=template, spec=spec))
+        assert pdf[:5] == b"%PDF-"
+
+    def test_spec_loaded_once(self, filler):
+        async def run():
+            await filler.fill(VALUES, template=CT600_PDF, spec=SPEC_JSON)
+            first = filler.specs[SPEC_JSON]
+            await filler.fill(VALUES, template=CT600_PDF, spec=SPEC_JSON)
+            return first is filler.specs[SPEC_JSON]
+        assert asyncio.run(run())
+
+    def test_concurrency_is_bounded(self, filler):
+        active = 0
+        peak = 0
+        render = filler.render
+
+        def counting_render(*args):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            try:
+                return render(*args)
+            finally:
+                active -= 1
+
+        filler.render = counting_render
+
+        async def run():
+            return await asyncio.gather(*[
+                filler.fill(VALUES, template=CT600_PDF, spec=SPEC_JSON)
+                for i in range(6)
+            ])
+
+        results = asyncio.run(run())
+        assert len(results) == 6
+        assert all(pdf[:5] == b"%PDF-" for pdf in results)
+        assert peak <= 2
+
+    def test_bad_value_raises(self, filler):
+        values = {"ct600": {30: "not-a-date"}}
+        with pytest.raises(ValueError):
+            asyncio.run(filler.fill(values, template=CT600_PDF, spec=SPEC_JSON))
+
+    def test_invalid_values_not_rendered(self, filler):
+        rendered = []
+        filler.render = lambda *args: rendered.append(args)
+        values = {"ct600": {145: "lots"}}
+        with pytest.raises(ValidationError, match="box 145: not a number"):
+            asyncio.run(filler.fill(values, template=CT600_PDF, spec=SPEC_JSON))
+        assert rendered == []
+
+    def test_rejects_process_pool(self):
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            with pytest.raises(ValueError, match="thread pool"):
+                AsyncFiller(executor=executor)
+
+    def test_fill_file(self, filler, tmp_path):
+        input_path = tmp_path / "in.yaml"
+        input_path.write_text("ct600:\n  1: File Ltd\n")
+        output_path = tmp_path / "out.pdf"
+        asyncio.run(filler.fill_file(str(input_path), str(output_path),
+                                     template=CT600_PDF, spec=SPEC_JSON))
+        assert output_path.read_bytes()[:5] == b"%PDF-"
+
+
+class TestFillAsync:
+    def test_default_filler_across_event_loops(self):
+        for engine in ("direct", "reportlab"):
+            pdf = asyncio.run(fill_async(VALUES, template=CT600_PDF,
+                                         spec=SPEC_JSON, engine=engine))
+            assert pdf[:5] == b"%PDF-"
@@ -1,3 +1,4 @@
+import io
 import json
 import os
 import tempfile
@@ -20,6 +21,7 @@ from ct600_fill.annotations import (
     WriteSpaceSortCode,
     get_spec,
     create_annotations,
+    describe,
 )
 
 
@@ -101,6 +103,35 @@ class TestSpaceString:
         canvas.drawString.assert_any_call(10 * mm, 20 * mm, "1")
         canvas.drawString.assert_any_call((10 + 5) * mm, 20 * mm, "2")
 
+    def test_positions_in_points(self):
+        ann = SpaceString(page=0, x=10, y=20, pitch=5)
+        assert list(ann.get_positions(40)[:3]) == [10 * mm, 15 * mm, 20 * mm]
+        assert len(ann.get_positions(40)) == 40
+
+    def test_positions_made_on_first_draw(self):
+        ann = SpaceString(page=0, x=10, y=20, pitch=5)
+        assert len(ann._xs) == 0
+        ann.do(MagicMock(), "123")
+        assert len(ann._xs) == 3
+
+    def test_reportlab_draws_one_text_object(self):
+        from reportlab.pdfgen.canvas import Canvas
+        can = Canvas(io.BytesIO())
+        can.setFont("Courier-Bold", 12)
+        SpaceString(page=0, x=10, y=20, pitch=5).do(can, "1 2")
+        assert can._code[-1] == \
+            "BT 1 0 0 1 28.34646 56.69291 Tm (1) Tj 28.34646 0 Td (2) Tj ET"
+
+    def test_draws_chars_in_one_call(self):
+        class CharCanvas:
+            def __init__(self):
+                self.calls = []
+            def drawChars(self, xs, y, s):
+                self.calls.append((list(xs[:len(s)]), y, s))
+        can = CharCanvas()
+        SpaceString(page=0, x=10, y=20, pitch=5).do(can, "AB")
+        assert can.calls == [([10 * mm, 15 * mm], 20 * mm, "AB")]
+
 
 # --- WritePounds ---
 
@@ -371,3 +402,30 @@ class TestCreateAnnotations:
         result = create_annotations(values, spec)
 
         assert result == {}
+
+
+# --- memory layout ---
+
+class TestSlots:
+    def test_spec_annotations_have_no_instance_dict(self):
+        anns = [
+            WriteString(0, 1, 2), WriteNumber(0, 1, 2), WriteBool(0, 1, 2),
+            SpaceString(0, 1, 2, 3), WritePounds(0, 1, 2), WriteMoney(0, 1, 2),
+            SpacePounds(0, 1, 2, 3, 4), SpaceZeroPadNumber(0, 1, 2, 3, 4),
+            SpaceMoney(0, 1, 2, 3, 4, 5, 6),
+            WriteSpaceDate(0, 1, 2, 3, 4, 5, 6, 7),
+            WriteSpaceSortCode(0, 1, 2, 3, 4, 5, 6, 7),
+        ]
+        for ann in anns:
+            assert not hasattr(ann, "__dict__"), type(ann).__name__
+
+
+class TestDescribe:
+    def test_simple_annotation(self):
+        assert describe(WriteString(0, 1, 2)) == ["WriteString", 0, 1, 2]
+
+    def test_nested_annotation(self):
+        desc = describe(SpaceMoney(0, 1, 2, 3, 4, 5, 6))
+        assert desc[0] == "SpaceMoney"
+        assert ["SpaceString", 0, 1, 2, 5] in desc
+        assert ["SpaceString", 0, 3, 4, 5] in desc
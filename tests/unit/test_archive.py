@@ -0,0 +1,67 @@
+import copy
+import io
+import os
+
+import pytest
+import yaml
+from PyPDF2 import PdfReader
+
+from ct600_fill.annotations import get_spec
+from ct600_fill.archive import extract_return, fill_archive, read_archive
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ALL_VALUES = os.path.join(PROJECT_DIR, "all-values.yaml")
+CT600_PDF = os.path.join(PROJECT_DIR, "CT600.pdf")
+SPEC_JSON = os.path.join(PROJECT_DIR, "spec.json")
+
+
+@pytest.fixture(scope="module")
+def returns():
+    with open(ALL_VALUES) as f:
+        values = yaml.safe_load(f)
+    out = []
+    for name in ("alpha", "beta", "gamma"):
+        doc = copy.deepcopy(values)
+        doc["ct600"][1] = "%s Ltd" % name.title()
+        out.append((name, doc))
+    return out
+
+
+@pytest.fixture(scope="module", params=["reportlab", "direct"])
+def archive(request, template, returns):
+    output = fill_archive(returns, template, get_spec(SPEC_JSON),
+                          engine=request.param)
+    buffer = io.BytesIO()
+    output.write(buffer)
+    return buffer.getvalue()
+
+
+class TestArchive:
+    def test_lists_returns(self, archive, template):
+        reader = PdfReader(io.BytesIO(archive))
+        n = len(template)
+        assert read_archive(reader) == [
+            ("alpha", 0, n), ("beta", n, n), ("gamma", 2 * n, n)
+        ]
+
+    def test_template_stored_once(self, archive, template):
+        # Three returns take far less than three times one return.
+        with open(CT600_PDF, "rb") as f:
+            assert len(archive) < len(f.read())
+        reader = PdfReader(io.BytesIO(archive))
+        contents = set()
+        for i in (0, len(template), 2 * len(template)):
+            contents.add(reader.pages[i].raw_get("/Contents")[1].idnum)
+        assert len(contents) == 1
+
+    def test_extract_return(self, archive, template):
+        buffer = io.BytesIO()
+        extract_return(PdfReader(io.BytesIO(archive)), "beta", buffer)
+        pdf = PdfReader(buffer)
+        assert len(pdf.pages) == len(template)
+        assert "Beta Ltd" in pdf.pages[0].extract_text()
+
+    def test_extract_unknown_return(self, archive):
+        with pytest.raises(KeyError):
+            extract_return(PdfReader(io.BytesIO(archive)), "delta",
+                           io.BytesIO())
@@ -0,0 +1,314 @@
+import json
+import os
+
+import pytest
+from PyPDF2 import PdfReader
+
+from ct600_fill.annotations import get_spec
+from ct600_fill.batch import (
+    get_batch_inputs,
+    get_manifest_inputs,
+    get_output_path,
+    fill_batch,
+    fill_bulk,
+    validate_batch,
+)
+from ct600_fill.forms import load_registry
+from ct600_fill.inputs import iter_bulk
+from ct600_fill.timings import get_stage_histogram
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CT600_PDF = os.path.join(PROJECT_DIR, "CT600.pdf")
+FORMS_YAML = os.path.join(PROJECT_DIR, "forms.yaml")
+
+
+@pytest.fixture
+def mini_spec(tmp_path):
+    spec_data = [
+        [1, "WriteString", 0, 76, 210.2],
+        [30, "WriteSpaceDate", 0, 23.5, 110.2, 37, 110.2, 50.5, 110.2, 5.47],
+    ]
+    spec_file = tmp_path / "spec.json"
+    spec_file.write_text(json.dumps(spec_data))
+    return get_spec(str(spec_file))
+
+
+@pytest.fixture
+def template_data():
+    with open(CT600_PDF, "rb") as f:
+        return f.read()
+
+
+class TestGetBatchInputs:
+    def test_directory_lists_yaml_files(self, tmp_path):
+        (tmp_path / "b.yaml").write_text("ct600: {}\n")
+        (tmp_path / "a.yml").write_text("ct600: {}\n")
+        (tmp_path / "notes.txt").write_text("ignored\n")
+        result = get_batch_inputs(str(tmp_path))
+        assert result == [str(tmp_path / "a.yml"), str(tmp_path / "b.yaml")]
+
+    def test_glob_pattern(self, tmp_path):
+        (tmp_path / "x1.yaml").write_text("ct600: {}\n")
+        (tmp_path / "x2.yaml").write_text("ct600: {}\n")
+        (tmp_path / "y.yaml").write_text("ct600: {}\n")
+        result = get_batch_inputs(str(tmp_path / "x*.yaml"))
+        assert result == [str(tmp_path / "x1.yaml"), str(tmp_path / "x2.yaml")]
+
+
+class TestGetManifestInputs:
+    def test_skips_blank_and_comment_lines(self, tmp_path):
+        manifest = tmp_path / "manifest.txt"
+        manifest.write_text("# returns\na.yaml\n\nsub/b.yaml\n")
+        result = get_manifest_inputs(str(manifest))
+        assert result == [
+            os.path.join(str(tmp_path), "a.yaml"),
+            os.path.join(str(tmp_path), "sub/b.yaml"),
+        ]
+
+
+class TestGetOutputPath:
+    def test_replaces_extension(self):
+        assert get_output_path("in/acme.yaml", "out") == os.path.join("out", "acme.pdf")
+
+
+class TestFillBatch:
+    def test_writes_one_pdf_per_input(self, tmp_path, mini_spec, template_data):
+        inputs = []
+        for name in ("one", "two"):
+            path = tmp_path / (name + ".yaml")
+            path.write_text("ct600:\n  1: %s Ltd\n  30: 2020-01-01\n" % name)
+            inputs.append(str(path))
+
+        out = tmp_path / "out"
+        out.mkdir()
+        errors = fill_batch(inputs, str(out), mini_spec, template_data)
+
+        assert errors == []
+        for name in ("one", "two"):
+            with open(out / (name + ".pdf"), "rb") as f:
+                assert f.read(5) == b"%PDF-"
+
+    def test_bad_input_does_not_stop_batch(self, tmp_path, mini_spec, template_data):
+        bad = tmp_path / "bad.yaml"
+        bad.write_text("ct600:\n  30: not-a-date\n")
+        good = tmp_path / "good.yaml"
+        good.write_text("ct600:\n  1: Good Ltd\n")
+
+        errors = fill_batch([str(bad), str(good)], str(tmp_path), mini_spec, template_data)
+
+        assert len(errors) == 1
+        assert errors[0][0] == str(bad)
+        assert os.path.exists(tmp_path / "good.pdf")
+        assert not os.path.exists(tmp_path / "bad.pdf")
+
+
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_template_path(self, tmp_path, mini_spec, jobs):
+        path = tmp_path / "one.yaml"
+        path.write_text("ct600:\n  1: One Ltd\n")
+
+        errors = fill_batch([str(path)], str(tmp_path), mini_spec, CT600_PDF,
+                            jobs=jobs)
+
+        assert errors == []
+        assert "One Ltd" in PdfReader(str(tmp_path / "one.pdf")).pages[0].extract_text()
+
+
+class TestParallelFillBatch:
+    def test_parallel_errors_reported_in_input_order(self, tmp_path, mini_spec, template_data):
+        inputs = []
+        for i in range(6):
+            path = tmp_path / ("r%d.yaml" % i)
+            if i % 2:
+                path.write_text("ct600:\n  30: bad-date-%d\n" % i)
+            else:
+                path.write_text("ct600:\n  1: Company %d\n" % i)
+            inputs.append(str(path))
+
+        errors = fill_batch(inputs, str(tmp_path), mini_spec, template_data, jobs=3)
+
+        assert [path for path, _ in errors] == [inputs[1], inputs[3], inputs[5]]
+        for i in (0, 2, 4):
+            assert os.path.exists(tmp_path / ("r%d.pdf" % i))
+
+    def test_validation_message_survives_worker(self, tmp_path, mini_spec, template_data):
+        bad = tmp_path / "bad.yaml"
+        bad.write_text("ct600:\n  30: 1/1/2020\n")
+
+        errors = fill_batch([str(bad)], str(tmp_path), mini_spec, template_data, jobs=2)
+
+        assert str(errors[0][1]) == "box 30: not a YYYY-MM-DD date: '1/1/2020'"
+        assert errors[0][1].errors == ["box 30: not a YYYY-MM-DD date: '1/1/2020'"]
+
+
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_same_output_name_fails(self, tmp_path, mini_spec, template_data, jobs):
+        (tmp_path / "sub").mkdir()
+        inputs = [tmp_path / "acme.yaml", tmp_path / "acme.json",
+                  tmp_path / "sub" / "acme.yaml", tmp_path / "other.yaml"]
+        inputs[0].write_text("ct600:\n  1: Acme YAML\n")
+        inputs[1].write_text('{"ct600": {"1": "Acme JSON"}}')
+        inputs[2].write_text("ct600:\n  1: Acme Sub\n")
+        inputs[3].write_text("ct600:\n  1: Other\n")
+        out = tmp_path / "out"
+        out.mkdir()
+
+        errors = fill_batch([str(path) for path in inputs], str(out), mini_spec,
+                            template_data, jobs=jobs)
+
+        assert [label for label, _ in errors] == [str(inputs[1]), str(inputs[2])]
+        assert "already written for %s" % inputs[0] in str(errors[0][1])
+        assert sorted(os.listdir(out)) == ["acme.pdf", "other.pdf"]
+        assert "Acme YAML" in PdfReader(str(out / "acme.pdf")).pages[0].extract_text()
+
+
+class TestFillBulk:
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_bad_rows_fail_alone(self, tmp_path, mini_spec, template_data, jobs):
+        bulk = tmp_path / "returns.jsonl"
+        bulk.write_text('{"id": "a", "1": "A Ltd"}\n{"id": "b", \n{"id": "c", "1": "C Ltd"}\n')
+        out = tmp_path / "out"
+        out.mkdir()
+
+        count, errors = fill_bulk(str(bulk), str(out), mini_spec, template_data, jobs=jobs)
+
+        assert count == 3
+        assert [label for label, _ in errors] == [str(bulk) + ":2"]
+        assert "bad JSON" in str(errors[0][1])
+        assert sorted(os.listdir(out)) == ["a.pdf", "c.pdf"]
+
+    def test_ids_stay_in_output_dir(self, tmp_path, mini_spec, template_data):
+        bulk = tmp_path / "returns.jsonl"
+        bulk.write_text('{"id": "../escaped", "1": "A Ltd"}\n'
+                        '{"id": "%s", "1": "B Ltd"}\n' % (tmp_path / "abs"))
+        out = tmp_path / "out"
+        out.mkdir()
+
+        count, errors = fill_bulk(str(bulk), str(out), mini_spec, template_data)
+
+        assert [label for label, _ in errors] == [str(bulk) + ":1", str(bulk) + ":2"]
+        assert not (tmp_path / "escaped.pdf").exists()
+        assert not (tmp_path / "abs.pdf").exists()
+        assert os.listdir(out) == []
+
+    def test_validate_bad_rows(self, tmp_path, mini_spec):
+        bulk = tmp_path / "returns.csv"
+        bulk.write_text("id,1,30\na,A Ltd,2020-01-01\nb,B Ltd\n")
+
+        invalid, count = validate_batch(iter_bulk(str(bulk)), mini_spec)
+
+        assert count == 2
+        assert invalid == [(str(bulk) + ":2", ["2 cells, the header has 3"])]
+
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_duplicate_ids_fail(self, tmp_path, mini_spec, template_data, jobs):
+        bulk = tmp_path / "returns.csv"
+        bulk.write_text("id,1\nc0,First\nc1,Second\nc0,Third\n")
+        out = tmp_path / "out"
+        out.mkdir()
+
+        count, errors = fill_bulk(str(bulk), str(out), mini_spec, template_data, jobs=jobs)
+
+        assert count == 3
+        assert [label for label, _ in errors] == [str(bulk) + ":3"]
+        assert "First" in PdfReader(str(out / "c0.pdf")).pages[0].extract_text()
+
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_one_output_per_row(self, tmp_path, mini_spec, template_data, jobs):
+        bulk = tmp_path / "returns.csv"
+        lines = ["id,1,30"]
+        for i in range(5):
+            lines.append("c%d,Company %d,%s" % (i, i, "bad-date" if i == 3 else "2020-01-01"))
+        bulk.write_text("\n".join(lines) + "\n")
+        out = tmp_path / "out"
+        out.mkdir()
+
+        count, errors = fill_bulk(str(bulk), str(out), mini_spec, template_data, jobs=jobs)
+
+        assert count == 5
+        assert [label for label, _ in errors] == [str(bulk) + ":4"]
+        assert sorted(os.listdir(out)) == ["c0.pdf", "c1.pdf", "c2.pdf", "c4.pdf"]
+
+
+class TestFillWithForms:
+    @pytest.fixture
+    def bulk(self, tmp_path):
+        bulk = tmp_path / "returns.jsonl"
+        bulk.write_text(
+            '{"id": "old", "1": "Old Ltd", "30": "2023-04-01", "35": "2024-03-31"}\n'
+            '{"id": "new", "1": "New Ltd", "30": "2025-04-01", "35": "2026-03-31"}\n'
+            '{"id": "undated", "1": "Undated Ltd"}\n'
+        )
+        return str(bulk)
+
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_mixed_periods_in_one_pass(self, tmp_path, bulk, jobs):
+        out = tmp_path / "out"
+        out.mkdir()
+
+        count, errors = fill_bulk(bulk, str(out), None, None, jobs=jobs,
+                                  forms=load_registry(FORMS_YAML))
+
+        assert count == 3
+        assert [label for label, _ in errors] == [bulk + ":3"]
+        assert "no form" in str(errors[0][1])
+        for name, version in (("old", "(2023)"), ("new", "(2025)")):
+            text = PdfReader(str(out / (name + ".pdf"))).pages[0].extract_text()
+            assert version in text
+
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_histogram_labelled_by_form(self, tmp_path, bulk, jobs):
+        out = tmp_path / "out"
+        out.mkdir()
+        histogram = get_stage_histogram()
+
+        fill_bulk(bulk, str(out), None, None, jobs=jobs, histogram=histogram,
+                  forms=load_registry(FORMS_YAML))
+
+        series = {dict(key).get("form") for key in histogram.snapshot()}
+        assert series == {"ct600-2023-v3", "ct600-2025-v3", None}
+        assert (("form", "ct600-2023-v3"), ("stage", "load")) in \
+            histogram.snapshot()
+
+    def test_loads_only_forms_used(self, tmp_path):
+        path = tmp_path / "r.yaml"
+        path.write_text("ct600:\n  1: Old Ltd\n  35: 2024-03-31\n")
+        forms = load_registry(FORMS_YAML)
+
+        errors = fill_batch([str(path)], str(tmp_path), None, None, forms=forms)
+
+        assert errors == []
+        assert forms.get("ct600-2023-v3").is_loaded()
+        assert not forms.get("ct600-2025-v3").is_loaded()
+
+    def test_validate_with_forms(self, tmp_path):
+        path = tmp_path / "r.yaml"
+        path.write_text("ct600:\n  35: 2024-03-31\n  145: lots\n")
+
+        invalid, count = validate_batch([str(path)], None,
+                                        forms=load_registry(FORMS_YAML))
+
+        assert count == 1
+        assert invalid[0][1] == ["box 145: not a number: 'lots'"]
+
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_derive_with_form_rules(self, tmp_path, jobs, capsys):
+        bulk = tmp_path / "derive.jsonl"
+        bulk.write_text(
+            '{"id": "a", "35": "2024-03-31", "155": 1000, "160": 200}\n'
+            '{"id": "b", "35": "2024-03-31", "155": 500, "165": 400}\n'
+            '{"id": "c", "35": "2024-03-31", "155": "lots"}\n'
+        )
+        out = tmp_path / "out"
+        out.mkdir()
+
+        count, errors = fill_bulk(str(bulk), str(out), None, None, jobs=jobs,
+                                  forms=load_registry(FORMS_YAML), derive=True)
+
+        assert count == 3
+        assert [label for label, _ in errors] == [str(bulk) + ":3"]
+        assert "box 155: not a number" in str(errors[0][1])
+        assert "derive.jsonl:2: warning: box 165: 400 supplied, rules give 500" \
+            in capsys.readouterr().err
+        fields = PdfReader(str(out / "a.pdf")).pages[2].extract_text()
+        assert "800" in fields
@@ -0,0 +1,129 @@
+import io
+import os
+
+import pytest
+from PyPDF2 import PdfReader
+
+from ct600_fill.annotations import (
+    WriteString,
+    create_annotations,
+    get_overlay,
+    get_page,
+)
+from ct600_fill.cache import OverlayCache
+from ct600_fill.content import get_ops
+from ct600_fill.metrics import Registry
+from ct600_fill.render import fill_values
+
+
+def values(name="Example Ltd", reason="Dog ate it"):
+    return {"ct600": {1: name, 90: reason}}
+
+
+class TestGetKey:
+    def test_same_content_same_key(self, spec):
+        a = create_annotations(values(), spec)
+        b = create_annotations(values(), spec)
+        assert OverlayCache.get_key("direct", a[0]) == OverlayCache.get_key("direct", b[0])
+
+    def test_value_changes_key(self, spec):
+        a = create_annotations(values(), spec)
+        b = create_annotations(values(name="Other Ltd"), spec)
+        assert OverlayCache.get_key("direct", a[0]) != OverlayCache.get_key("direct", b[0])
+
+    def test_position_changes_key(self):
+        a = [(WriteString(0, 76, 210.2), "X")]
+        b = [(WriteString(0, 76, 210.3), "X")]
+        assert OverlayCache.get_key("direct", a) != OverlayCache.get_key("direct", b)
+
+    def test_kind_changes_key(self, spec):
+        a = create_annotations(values(), spec)
+        assert OverlayCache.get_key("direct", a[0]) != OverlayCache.get_key("reportlab", a[0])
+
+
+class TestOverlayCache:
+    def test_miss_then_hit(self):
+        cache = OverlayCache(1024)
+        assert cache.get("k") is None
+        cache.put("k", b"data")
+        assert cache.get("k") == b"data"
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = OverlayCache(10)
+        cache.put("a", b"aaaa")
+        cache.put("b", b"bbbb")
+        cache.get("a")
+        cache.put("c", b"cccc")
+        assert cache.get("b") is None
+        assert cache.get("a") == b"aaaa"
+        assert cache.get("c") == b"cccc"
+        assert cache.size == 8
+        assert cache.evictions == 1
+
+    def test_oversized_entry_not_kept(self):
+        cache = OverlayCache(4)
+        cache.put("a", b"too big")
+        assert len(cache) == 0
+        assert cache.size == 0
+
+    def test_disk_cache_shared(self, tmp_path):
+        OverlayCache(1024, str(tmp_path)).put("abcdef", b"data")
+        cache = OverlayCache(0, str(tmp_path))
+        assert cache.get("abcdef") == b"data"
+        assert cache.hits == 1
+        assert os.path.exists(os.path.join(str(tmp_path), "ab", "abcdef"))
+
+    def test_expose(self):
+        cache = OverlayCache(1024)
+        cache.get("k")
+        registry = Registry()
+        registry.add(cache)
+        text = registry.expose()
+        assert "ct600_fill_overlay_cache_misses_total 1" in text
+        assert "# TYPE ct600_fill_overlay_cache_bytes gauge" in text
+
+
+class TestCachedRendering:
+    def test_get_page_cached(self, spec):
+        cache = OverlayCache(1024 * 1024)
+        annotations = create_annotations(values(), spec)
+        first = get_page(annotations, 0, cache).read()
+        second = get_page(annotations, 0, cache).read()
+        assert first == second
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert "Example Ltd" in PdfReader(get_page(annotations, 0, cache)).pages[0].extract_text()
+
+    def test_get_ops_cached(self, spec):
+        cache = OverlayCache(1024 * 1024)
+        annotations = create_annotations(values(), spec)
+        assert get_ops(annotations[1], cache) == get_ops(annotations[1])
+        assert get_ops(annotations[1], cache) == get_ops(annotations[1])
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_get_overlay_cached(self, spec):
+        cache = OverlayCache(1024 * 1024)
+        annotations = create_annotations(values(), spec)
+        first, index = get_overlay(annotations, cache)
+        second, cached_index = get_overlay(annotations, cache)
+        assert first.read() == second.read()
+        assert index == cached_index
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_get_overlay_key_covers_every_page(self, spec):
+        a = create_annotations(values(), spec)
+        b = create_annotations(values(reason="Cat ate it"), spec)
+        assert a[0] == b[0]
+        assert OverlayCache.get_pages_key("reportlab", a) != \
+            OverlayCache.get_pages_key("reportlab", b)
+
+    @pytest.mark.parametrize("engine, hits", [("reportlab", 1), ("direct", 2)])
+    def test_fill_matches_uncached(self, template, spec, engine, hits):
+        cache = OverlayCache(1024 * 1024)
+        expected = fill_values(values(), template, spec, engine=engine)
+        for _ in range(2):
+            data = fill_values(values(), template, spec, engine=engine, cache=cache)
+            reader = PdfReader(io.BytesIO(data))
+            assert "Dog ate it" in reader.pages[1].extract_text()
+        assert cache.hits == hits
+        assert len(PdfReader(io.BytesIO(expected)).pages) == len(reader.pages)
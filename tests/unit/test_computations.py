@@ -1,8 +1,14 @@
+import io
 import xml.etree.ElementTree as ET
 
 import pytest
 
-from ct600_fill.computations import get_computations
+from ct600_fill.computations import (
+    get_computations,
+    get_mapping,
+    get_values,
+    parse_computations,
+)
 
 
 IXBRL_TEMPLATE = """\
@@ -75,3 +81,109 @@ class TestGetComputations:
         doc = ET.fromstring(IXBRL_TEMPLATE.format(elements=elements))
         result = get_computations(doc)
         assert result["ct:Value"] == "42"
+
+
+def parse(elements):
+    doc = IXBRL_TEMPLATE.format(elements=elements).encode("utf-8")
+    return parse_computations(io.BytesIO(doc))
+
+
+class TestParseComputations:
+    def test_matches_get_computations(self):
+        elements = """
+        <ix:nonNumeric name="ct:CompanyName">Test Co</ix:nonNumeric>
+        <ix:nonFraction name="ct:Revenue">1000</ix:nonFraction>
+        <ix:nonNumeric name="ct:Empty"></ix:nonNumeric>
+        """
+        doc = ET.fromstring(IXBRL_TEMPLATE.format(elements=elements))
+        assert parse(elements) == get_computations(doc)
+
+    def test_nested_markup_text(self):
+        elements = '<ix:nonNumeric name="ct:Name"><span>Example</span> Ltd</ix:nonNumeric>'
+        assert parse(elements)["ct:Name"] == "Example Ltd"
+
+    def test_number_separators_sign_and_scale(self):
+        elements = """
+        <ix:nonFraction name="ct:A">1,234</ix:nonFraction>
+        <ix:nonFraction name="ct:B" sign="-">50</ix:nonFraction>
+        <ix:nonFraction name="ct:C" scale="3">12</ix:nonFraction>
+        <ix:nonFraction name="ct:D" format="ixt:fixed-zero">-</ix:nonFraction>
+        """
+        result = parse(elements)
+        assert result["ct:A"] == "1234"
+        assert result["ct:B"] == "-50"
+        assert result["ct:C"] == "12000"
+        assert result["ct:D"] == "0"
+
+    def test_comma_decimal_format(self):
+        elements = """
+        <ix:nonFraction name="ct:A" format="ixt:numcommadecimal">1.234,50</ix:nonFraction>
+        <ix:nonFraction name="ct:B" format="ixt4:num-comma-decimal">1 234,5</ix:nonFraction>
+        <ix:nonFraction name="ct:C" format="ixt:numdotdecimal">1,234.50</ix:nonFraction>
+        """
+        result = parse(elements)
+        assert result["ct:A"] == "1234.50"
+        assert result["ct:B"] == "1234.5"
+        assert result["ct:C"] == "1234.50"
+
+    def test_bracketed_negative(self):
+        elements = """
+        <ix:nonFraction name="ct:A">(1,234)</ix:nonFraction>
+        <ix:nonFraction name="ct:B" format="ixt:numcommadecimal">(1.234,50)</ix:nonFraction>
+        """
+        result = parse(elements)
+        assert result["ct:A"] == "-1234"
+        assert result["ct:B"] == "-1234.50"
+
+    @pytest.mark.parametrize("text", ["lots", "1,2,3.4.5", "NaN", "(12"])
+    def test_bad_number_raises_value_error(self, text):
+        elements = '<ix:nonFraction name="ct:A">%s</ix:nonFraction>' % text
+        with pytest.raises(ValueError, match="ct:A: not a number"):
+            parse(elements)
+
+    def test_malformed_document_raises_value_error(self):
+        with pytest.raises(ValueError, match="bad iXBRL: mismatched tag"):
+            parse_computations(io.StringIO("<html><body></html>"))
+
+    def test_date_facts(self):
+        elements = '<ix:nonNumeric name="ct:End" format="ixt:datelonguk">31 December 2020</ix:nonNumeric>'
+        assert parse(elements)["ct:End"] == "2020-12-31"
+
+    def test_elements_discarded(self, monkeypatch):
+        # Facts and markup after them are parsed from a tree that's
+        # cleared as it goes, so the root ends up empty.
+        roots = []
+        iterparse = ET.iterparse
+
+        def recording_iterparse(*args, **kwargs):
+            for event, elt in iterparse(*args, **kwargs):
+                if not roots:
+                    roots.append(elt)
+                yield event, elt
+
+        monkeypatch.setattr(ET, "iterparse", recording_iterparse)
+        elements = "".join(
+            '<p><ix:nonFraction name="ct:N%d">%d</ix:nonFraction></p>' % (i, i)
+            for i in range(100)
+        )
+        result = parse(elements)
+        assert result["ct:N99"] == "99"
+        assert len(roots[0]) == 0
+
+
+class TestGetValues:
+    def test_maps_tags_to_boxes(self):
+        computations = {"ct:CompanyName": "Test Co", "ct:Other": "x"}
+        mapping = {"ct:CompanyName": 1}
+        assert get_values(computations, mapping) == {"ct600": {1: "Test Co"}}
+
+    def test_get_mapping(self, tmp_path):
+        path = tmp_path / "mapping.yaml"
+        path.write_text("ct:CompanyName: 1\nct:Revenue: 145\n")
+        assert get_mapping(str(path)) == {"ct:CompanyName": 1, "ct:Revenue": 145}
+
+    def test_get_mapping_rejects_non_mapping(self, tmp_path):
+        path = tmp_path / "mapping.yaml"
+        path.write_text("- 1\n")
+        with pytest.raises(ValueError):
+            get_mapping(str(path))
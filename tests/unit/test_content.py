@@ -0,0 +1,61 @@
+from reportlab.lib.units import mm
+
+from ct600_fill.annotations import SpaceString, WriteBool
+from ct600_fill.content import TextCanvas, fp_str, pdf_string
+
+
+class TestFpStr:
+    def test_integer(self):
+        assert fp_str(20) == "20"
+
+    def test_drops_trailing_zeros(self):
+        assert fp_str(10.5) == "10.5"
+
+    def test_five_decimal_places(self):
+        assert fp_str(10.123456) == "10.12346"
+
+
+class TestPdfString:
+    def test_plain_text(self):
+        assert pdf_string("Hello") == "(Hello)"
+
+    def test_escapes_delimiters(self):
+        assert pdf_string("a(b)\\") == "(a\\(b\\)\\\\)"
+
+    def test_non_ascii_as_octal(self):
+        assert pdf_string("£") == "(\\243)"
+
+
+class TestTextCanvas:
+    def test_collects_text_operators(self):
+        can = TextCanvas()
+        can.drawString(10, 20, "X")
+        assert can.get_data() == b"BT\n/CT600Fill 12 Tf\n1 0 0 1 10 20 Tm (X) Tj\nET\n"
+
+    def test_annotations_draw_on_text_canvas(self):
+        can = TextCanvas()
+        SpaceString(page=0, x=10, y=20, pitch=5).do(can, "AB")
+        WriteBool(page=0, x=1, y=2).do(can, False)
+        offset = (10 * mm + 7.2 - 15 * mm) * 1000 / 12
+        assert can.ops == [
+            "1 0 0 1 %s %s Tm [(A) %s (B)] TJ" % (
+                fp_str(10 * mm), fp_str(20 * mm), fp_str(offset)
+            ),
+        ]
+
+    def test_draw_chars_skips_spaces(self):
+        can = TextCanvas()
+        can.drawChars([0, 10, 20, 30], 5, " 1 2")
+        assert can.ops == ["1 0 0 1 10 5 Tm [(1) %s (2)] TJ" % fp_str(
+            (10 + 7.2 - 30) * 1000 / 12
+        )]
+
+    def test_draw_chars_merges_adjacent_glyphs(self):
+        can = TextCanvas()
+        can.drawChars([0, 7.2, 14.4], 5, "abc")
+        assert can.ops == ["1 0 0 1 0 5 Tm [(abc)] TJ"]
+
+    def test_draw_chars_blank(self):
+        can = TextCanvas()
+        can.drawChars([0, 10], 5, "  ")
+        assert can.ops == []
@@ -0,0 +1,187 @@
+import os
+import pickle
+from decimal import Decimal
+
+import pytest
+import yaml
+
+from ct600_fill.derive import (
+    RulesError,
+    apply_rules,
+    compile_rules,
+    load_rules,
+)
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ALL_VALUES = os.path.join(PROJECT_DIR, "all-values.yaml")
+RULES_2023 = os.path.join(PROJECT_DIR, "rules-ct600-2023-v3.yaml")
+RULES_2025 = os.path.join(PROJECT_DIR, "rules-ct600-2025-v3.yaml")
+
+
+def values(**boxes):
+    return {"ct600": {int(box[1:]): value for box, value in boxes.items()}}
+
+
+@pytest.fixture
+def rules():
+    return compile_rules({
+        165: "b155 - b160",
+        235: "b165 + b170",
+        345: "round(b235 * b340 / 100, 2)",
+        500: "b345 / b499",
+    })
+
+
+class TestCompileRules:
+    def test_order_follows_dependencies(self, rules):
+        assert rules.order == [165, 235, 345, 500]
+        assert rules.inputs == [155, 160, 165, 170, 235, 340, 345, 499]
+        assert rules.downstream[155] == [165, 235, 345, 500]
+        assert rules.downstream[340] == [345, 500]
+
+    @pytest.mark.parametrize("expression, message", [
+        ("b1 +", "bad expression"),
+        ("x1 + b2", "unknown name x1"),
+        ("b1 ** 2", "unsupported"),
+        ("open(b1)", "unsupported"),
+        ("b1.real", "unsupported"),
+        ("'a' + b1", "unsupported"),
+        ("1 + 2", "doesn't use any boxes"),
+        ("min(b1)", "min takes at least 2 arguments, not 1"),
+        ("abs(b1, b2)", "abs takes 1 argument, not 2"),
+        ("round()", "round takes 1 or 2 arguments, not 0"),
+        ("round(b1, 2, 3)", "round takes 1 or 2 arguments, not 3"),
+        ("round(b1, b2)", "round's places should be a whole number"),
+        ("round(b1, 1.5)", "round's places should be a whole number"),
+        ("round(b1, -b2)", "round's places should be a whole number"),
+    ])
+    def test_bad_expressions(self, expression, message):
+        with pytest.raises(RulesError, match=message):
+            compile_rules({10: expression})
+
+    def test_cycle(self):
+        with pytest.raises(RulesError, match="cycle: boxes 10, 11"):
+            compile_rules({10: "b11 + b1", 11: "b10", 12: "b1"})
+
+    def test_pickles(self, rules):
+        copy = pickle.loads(pickle.dumps(rules))
+        assert copy.order == rules.order
+        assert copy.derive(values(b155=3)).derived[165] == 3
+
+
+class TestDerive:
+    def test_derives_in_decimal(self, rules):
+        derivation = rules.derive(values(b155="1000.10", b160=0.2, b340=19,
+                                         b499=2))
+        assert derivation.derived[165] == Decimal("999.90")
+        assert derivation.derived[345] == Decimal("189.98")
+        assert derivation.get_values()["ct600"][500] == 94.99
+
+    def test_rounds_half_up(self):
+        rules = compile_rules({10: "round(b1, 0)"})
+        assert rules.derive(values(b1="2.5")).derived[10] == 3
+
+    def test_blank_inputs(self, rules):
+        derivation = rules.derive(values(b170=5))
+        assert derivation.derived[165] is None
+        assert derivation.derived[235] == 5
+        assert 165 not in derivation.get_values()["ct600"]
+
+    def test_supplied_value_overrides(self, rules):
+        derivation = rules.derive(values(b155=10, b160=4, b165=7))
+        assert derivation.conflicts == {165: (Decimal(7), Decimal(6))}
+        assert derivation.derived[235] == 7
+        assert derivation.get_warnings() == [
+            "box 165: 7 supplied, rules give 6"
+        ]
+
+    def test_errors(self, rules):
+        derivation = rules.derive(values(b155="lots", b345=1, b499=0))
+        assert derivation.errors == {
+            155: "box 155: not a number: 'lots'",
+            500: "box 500: division by zero",
+        }
+        with pytest.raises(ValueError, match="box 155.*box 500"):
+            derivation.check()
+
+    def test_supplied_value_stands_in_for_error(self, rules):
+        derivation = rules.derive(values(b345=1, b499=0, b500=3))
+        assert derivation.errors == {}
+
+
+class TestUpdate:
+    def test_recomputes_downstream_only(self, rules):
+        derivation = rules.derive(values(b155=10, b340=10, b499=1))
+
+        assert rules.update(derivation, {340: 20}) == [345, 500]
+        assert derivation.derived[345] == 2
+        assert derivation.derived[500] == 2
+
+        assert rules.update(derivation, {170: 5}) == [235, 345, 500]
+        assert derivation.derived[500] == 3
+
+    def test_matches_derive(self, rules):
+        derivation = rules.derive(values(b155=10, b340=10, b499=1))
+        rules.update(derivation, {160: 4, 165: 1, 499: 0})
+        rules.update(derivation, {165: None, 499: 2})
+
+        fresh = rules.derive(values(b155=10, b160=4, b340=10, b499=2))
+        assert derivation.derived == fresh.derived
+        assert derivation.conflicts == fresh.conflicts == {}
+        assert derivation.errors == fresh.errors == {}
+
+
+class TestDeriveBatch:
+    def test_matches_derive(self, rules):
+        documents = [
+            values(b155=10, b160=4, b340=19, b499=2),
+            values(b170=5),
+            values(b155=10, b165=7, b499=1),
+            values(b155="lots", b345=1, b499=0),
+            values(b345=1, b499=0, b500=3),
+            values(),
+        ]
+        batch = rules.derive_batch(documents)
+        for document, derivation in zip(documents, batch):
+            single = rules.derive(document)
+            assert derivation.derived == single.derived
+            assert derivation.conflicts == single.conflicts
+            assert derivation.errors == single.errors
+            assert derivation.get_values() == single.get_values()
+
+
+class TestApplyRules:
+    def test_returns_values_and_warnings(self, rules):
+        doc, warnings = apply_rules(rules, values(b155=10, b165=7, b499=1))
+        assert doc["ct600"][165] == 7
+        assert doc["ct600"][235] == 7
+        assert warnings == ["box 165: 7 supplied, rules give 10"]
+
+    def test_raises_on_errors(self, rules):
+        with pytest.raises(ValueError, match="division by zero"):
+            apply_rules(rules, values(b345=1, b499=0))
+
+
+class TestLoadRules:
+    @pytest.mark.parametrize("path", [RULES_2023, RULES_2025])
+    def test_bundled_rules(self, path):
+        with open(ALL_VALUES) as f:
+            doc = yaml.safe_load(f)
+        derivation = load_rules(path).derive(doc)
+        assert derivation.errors == {}
+
+    def test_bundled_versions_differ(self):
+        assert 425 in load_rules(RULES_2025).rules
+        assert 425 not in load_rules(RULES_2023).rules
+
+    @pytest.mark.parametrize("text, message", [
+        ("rules: [\n", "bad YAML"),
+        ("rules: []\n", "rules mapping"),
+        ("rules:\n  b10: b1\n", "box numbers"),
+        ("rules:\n  10: b1 +\n", "box 10"),
+    ])
+    def test_bad_rules_file(self, tmp_path, text, message):
+        path = tmp_path / "rules.yaml"
+        path.write_text(text)
+        with pytest.raises(RulesError, match=message):
+            load_rules(str(path))
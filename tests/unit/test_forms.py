@@ -0,0 +1,184 @@
+import datetime
+import os
+import pickle
+
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+
+from ct600_fill.forms import (
+    FormRegistry,
+    RegisteredForm,
+    get_fingerprint,
+    get_period,
+    load_registry,
+)
+from ct600_fill.template import Template, get_template
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+FORMS_YAML = os.path.join(PROJECT_DIR, "forms.yaml")
+CT600_PDF = os.path.join(PROJECT_DIR, "CT600.pdf")
+CT600_2023_PDF = os.path.join(PROJECT_DIR, "CT600-2023-v3.pdf")
+SPEC_2023_JSON = os.path.join(PROJECT_DIR, "spec-ct600-2023-v3.json")
+
+
+def values(start=None, end=None):
+    ct600 = {1: "Example Biz Ltd."}
+    if start is not None:
+        ct600[30] = start
+    if end is not None:
+        ct600[35] = end
+    return {"ct600": ct600}
+
+
+class TestGetFingerprint:
+    def test_same_form_versions_match(self):
+        assert get_fingerprint(get_template(CT600_PDF)) == \
+            get_fingerprint(get_template(os.path.join(PROJECT_DIR, "CT600-2025-v3.pdf")))
+
+    def test_different_versions_differ(self):
+        assert get_fingerprint(get_template(CT600_PDF)) != \
+            get_fingerprint(get_template(CT600_2023_PDF))
+
+    def test_ignores_metadata_and_file_layout(self, tmp_path):
+        writer = PdfWriter()
+        for page in PdfReader(CT600_2023_PDF).pages:
+            writer.add_page(page)
+        writer.add_metadata({"/Title": "Re-saved"})
+        path = tmp_path / "resaved.pdf"
+        with open(path, "wb") as f:
+            writer.write(f)
+
+        with open(path, "rb") as f:
+            resaved = Template(f.read())
+
+        assert resaved.digest != get_template(CT600_2023_PDF).digest
+        assert get_fingerprint(resaved) == get_fingerprint(get_template(CT600_2023_PDF))
+
+
+class TestGetPeriod:
+    def test_dates_and_strings(self):
+        assert get_period(values(datetime.date(2024, 1, 1), "2024-12-31")) == (
+            datetime.date(2024, 1, 1), datetime.date(2024, 12, 31)
+        )
+
+    def test_missing_boxes(self):
+        assert get_period(values()) == (None, None)
+
+    def test_bad_date(self):
+        with pytest.raises(ValueError, match="box 35"):
+            get_period(values("2024-01-01", "31/12/2024"))
+
+
+class TestRegisteredForm:
+    def test_date_ranges(self):
+        form = RegisteredForm("f", "t.pdf", "s.json",
+                              starts_on_or_after="2024-01-01",
+                              ends_before=datetime.date(2025, 4, 1))
+        assert form.matches(get_period(values("2024-01-01", "2024-12-31")))
+        assert not form.matches(get_period(values("2023-12-31", "2024-12-30")))
+        assert not form.matches(get_period(values("2024-06-01", "2025-05-31")))
+        assert not form.matches(get_period(values("2024-06-01")))
+
+    def test_no_range_matches_any_period(self):
+        assert RegisteredForm("f", "t.pdf", "s.json").matches((None, None))
+
+    def test_unknown_range_rejected(self):
+        with pytest.raises(ValueError, match="ends_after"):
+            RegisteredForm("f", "t.pdf", "s.json", ends_after="2024-01-01")
+
+    def test_loads_on_first_use(self):
+        form = RegisteredForm("2023", CT600_2023_PDF, SPEC_2023_JSON)
+        assert not form.is_loaded()
+        template, spec, validator = form.load()
+        assert form.is_loaded()
+        assert form.template is template
+        assert 1 in spec
+        assert validator.validate(values("2024-01-01")) == []
+
+    def test_fingerprint_mismatch(self):
+        form = RegisteredForm("2023", CT600_PDF, SPEC_2023_JSON,
+                              fingerprint=get_fingerprint(get_template(CT600_2023_PDF)))
+        with pytest.raises(ValueError, match="fingerprint"):
+            form.load()
+        assert not form.is_loaded()
+
+    def test_pickles_unloaded(self):
+        form = RegisteredForm("2023", CT600_2023_PDF, SPEC_2023_JSON)
+        form.load()
+        copy = pickle.loads(pickle.dumps(form))
+        assert not copy.is_loaded()
+        assert copy.name == "2023"
+        assert copy.spec is not None
+
+
+class TestFormRegistry:
+    def test_first_match_wins(self):
+        registry = FormRegistry([
+            RegisteredForm("old", "a.pdf", "a.json", ends_before="2025-04-01"),
+            RegisteredForm("any", "b.pdf", "b.json"),
+        ])
+        assert registry.select(values("2024-01-01", "2024-12-31")).name == "old"
+        assert registry.select(values("2025-01-01", "2025-12-31")).name == "any"
+
+    def test_no_match(self):
+        registry = FormRegistry([
+            RegisteredForm("old", "a.pdf", "a.json", ends_before="2025-04-01"),
+        ])
+        with pytest.raises(ValueError, match="2025-01-01 to 2025-12-31"):
+            registry.select(values("2025-01-01", "2025-12-31"))
+
+    def test_duplicate_names(self):
+        with pytest.raises(ValueError):
+            FormRegistry([
+                RegisteredForm("f", "a.pdf", "a.json"),
+                RegisteredForm("f", "b.pdf", "b.json"),
+            ])
+
+    def test_select_loads_nothing(self):
+        registry = load_registry(FORMS_YAML)
+        registry.select(values("2024-01-01", "2024-12-31"))
+        assert not any(form.is_loaded() for form in registry)
+
+
+class TestLoadRegistry:
+    def test_bundled_forms(self):
+        registry = load_registry(FORMS_YAML)
+        assert [form.name for form in registry] == ["ct600-2023-v3", "ct600-2025-v3"]
+        assert registry.select(values("2024-04-01", "2025-03-31")).name == "ct600-2023-v3"
+        assert registry.select(values("2024-04-02", "2025-04-01")).name == "ct600-2025-v3"
+
+    def test_rules_load_on_first_use(self):
+        form = load_registry(FORMS_YAML).get("ct600-2025-v3")
+        assert form.derive_path == os.path.join(PROJECT_DIR, "rules-ct600-2025-v3.yaml")
+        assert form.rules is None
+        assert form.get_rules() is form.get_rules()
+        assert not form.is_loaded()
+        assert pickle.loads(pickle.dumps(form)).rules is None
+
+    def test_bundled_fingerprints_match(self):
+        for form in load_registry(FORMS_YAML):
+            form.load()
+
+    def test_identify(self):
+        registry = load_registry(FORMS_YAML)
+        assert registry.identify(get_template(CT600_PDF)).name == "ct600-2025-v3"
+        assert registry.identify(get_template(CT600_2023_PDF)).name == "ct600-2023-v3"
+
+    def test_paths_relative_to_forms_file(self, tmp_path):
+        path = tmp_path / "forms.yaml"
+        path.write_text("forms:\n  - name: f\n    template: t.pdf\n    spec: s.json\n")
+        form = load_registry(str(path)).get("f")
+        assert form.template_path == str(tmp_path / "t.pdf")
+        assert form.spec_path == str(tmp_path / "s.json")
+
+    @pytest.mark.parametrize("text", [
+        "forms: {}\n",
+        "forms:\n  - name: f\n    template: t.pdf\n",
+        "forms:\n  - name: f\n    template: t.pdf\n    spec: s.json\n    ends: 2024-01-01\n",
+        "forms: [\n",
+    ])
+    def test_bad_forms_file(self, tmp_path, text):
+        path = tmp_path / "forms.yaml"
+        path.write_text(text)
+        with pytest.raises(ValueError):
+            load_registry(str(path))
@@ -0,0 +1,127 @@
+import json
+
+import pytest
+
+from ct600_fill.inputs import (
+    YamlLoader,
+    iter_bulk,
+    load_values,
+    read_values,
+    sniff,
+)
+
+
+class TestLoadValues:
+    def test_uses_libyaml_when_available(self):
+        import yaml
+        if hasattr(yaml, "CSafeLoader"):
+            assert YamlLoader is yaml.CSafeLoader
+
+    def test_yaml(self):
+        assert load_values(b"ct600:\n  1: Example Ltd\n") == {"ct600": {1: "Example Ltd"}}
+
+    def test_json_box_numbers_become_integers(self):
+        data = json.dumps({"ct600": {"1": "Example Ltd", "145": 100}}).encode()
+        assert load_values(data) == {"ct600": {1: "Example Ltd", 145: 100}}
+
+    def test_bad_yaml_raises_value_error(self):
+        with pytest.raises(ValueError):
+            load_values(b"ct600: [\n")
+
+    def test_bad_json_raises_value_error(self):
+        with pytest.raises(ValueError):
+            load_values(b"{\"ct600\": ")
+
+    def test_msgpack(self):
+        msgpack = pytest.importorskip("msgpack")
+        data = msgpack.packb({"ct600": {1: "Example Ltd"}})
+        assert load_values(data) == {"ct600": {1: "Example Ltd"}}
+
+
+class TestSniff:
+    @pytest.mark.parametrize("data,fmt", [
+        (b"ct600:\n  1: x\n", "yaml"),
+        (b"  {\"ct600\": {}}", "json"),
+        (b"\x81\xa5ct600\x80", "msgpack"),
+        (b"\xde\x00\x01", "msgpack"),
+        (b"", "yaml"),
+    ])
+    def test_sniff(self, data, fmt):
+        assert sniff(data) == fmt
+
+
+class TestReadValues:
+    def test_format_by_extension(self, tmp_path):
+        path = tmp_path / "values.json"
+        path.write_text('{"ct600": {"2": "12345678"}}')
+        assert read_values(str(path)) == {"ct600": {2: "12345678"}}
+
+    def test_sniffs_unknown_extension(self, tmp_path):
+        path = tmp_path / "values.txt"
+        path.write_text('{"ct600": {"2": "12345678"}}')
+        assert read_values(str(path)) == {"ct600": {2: "12345678"}}
+
+
+class TestIterBulk:
+    def test_csv(self, tmp_path):
+        path = tmp_path / "returns.csv"
+        path.write_text("id,1,70,145\nacme,Acme Ltd,true,100\n,Beta Ltd,false,\n")
+        rows = list(iter_bulk(str(path)))
+        assert [row.name for row in rows] == ["acme", "returns-2"]
+        assert rows[0].values == {"ct600": {1: "Acme Ltd", 70: True, 145: "100"}}
+        assert rows[1].values == {"ct600": {1: "Beta Ltd", 70: False}}
+        assert rows[1].label.endswith("returns.csv:2")
+
+    def test_jsonl(self, tmp_path):
+        path = tmp_path / "returns.jsonl"
+        path.write_text('{"id": "acme", "1": "Acme Ltd"}\n\n{"1": "Beta Ltd", "145": 100}\n')
+        rows = list(iter_bulk(str(path)))
+        assert [row.name for row in rows] == ["acme", "returns-2"]
+        assert rows[1].values == {"ct600": {1: "Beta Ltd", 145: 100}}
+
+    def test_sniffs_jsonl(self, tmp_path):
+        path = tmp_path / "returns"
+        path.write_text('{"1": "Acme Ltd"}\n')
+        assert list(iter_bulk(str(path)))[0].values == {"ct600": {1: "Acme Ltd"}}
+
+    def test_rows_read_lazily(self, tmp_path):
+        path = tmp_path / "returns.jsonl"
+        path.write_text('{"1": "Acme Ltd"}\nnot json\n')
+        rows = iter_bulk(str(path))
+        assert next(rows).name == "returns-1"
+        assert next(rows).error is not None
+
+    def test_bad_jsonl_rows(self, tmp_path):
+        path = tmp_path / "returns.jsonl"
+        path.write_text('{"1": "Acme Ltd"}\nnot json\n[1, 2]\n{"1": "Beta Ltd"}\n')
+        rows = list(iter_bulk(str(path)))
+        assert [row.error is None for row in rows] == [True, False, False, True]
+        assert rows[1].label.endswith("returns.jsonl:2")
+        assert "bad JSON" in str(rows[1].error)
+        assert "JSON object" in str(rows[2].error)
+        assert rows[3].values == {"ct600": {1: "Beta Ltd"}}
+
+    @pytest.mark.parametrize("name", [
+        "../escaped", "/tmp/abs", "sub/name", "..", "a..b",
+    ])
+    def test_rejects_ids_outside_output_dir(self, tmp_path, name):
+        path = tmp_path / "returns.jsonl"
+        path.write_text(json.dumps({"id": name, "1": "Acme Ltd"}) + "\n")
+        rows = list(iter_bulk(str(path)))
+        assert rows[0].label.endswith("returns.jsonl:1")
+        assert rows[0].name == "returns-1"
+        assert str(rows[0].error) == \
+            "id should be a plain file name: %r" % name
+
+    @pytest.mark.parametrize("line, message", [
+        ("acme,Acme Ltd\n", "2 cells, the header has 3"),
+        ("acme,Acme Ltd,true,100\n", "4 cells, the header has 3"),
+    ])
+    def test_bad_csv_rows(self, tmp_path, line, message):
+        path = tmp_path / "returns.csv"
+        path.write_text("id,1,70\n" + line + "beta,Beta Ltd,false\n")
+        rows = list(iter_bulk(str(path)))
+        assert rows[0].label.endswith("returns.csv:1")
+        assert str(rows[0].error) == message
+        assert rows[1].error is None
+        assert rows[1].values == {"ct600": {1: "Beta Ltd", 70: False}}
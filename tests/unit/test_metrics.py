@@ -0,0 +1,51 @@
+from ct600_fill.metrics import Counter, Histogram, Registry
+
+
+class TestHistogram:
+    def test_cumulative_buckets(self):
+        h = Histogram("latency", "Latency.", buckets=(0.1, 1.0))
+        h.observe(0.05, form="a")
+        h.observe(0.5, form="a")
+        h.observe(5.0, form="a")
+        cumulative, total, count = h.snapshot()[(("form", "a"),)]
+        assert cumulative == [1, 2, 3]
+        assert total == 5.55
+        assert count == 3
+
+    def test_value_on_bound_counts_in_bucket(self):
+        h = Histogram("latency", "Latency.", buckets=(0.1, 1.0))
+        h.observe(0.1)
+        assert h.snapshot()[()][0] == [1, 1, 1]
+
+    def test_expose_format(self):
+        h = Histogram("latency", "Latency.", buckets=(1.0,))
+        h.observe(0.5, form="a")
+        assert h.expose() == [
+            "# HELP latency Latency.",
+            "# TYPE latency histogram",
+            'latency_bucket{form="a",le="1.0"} 1',
+            'latency_bucket{form="a",le="+Inf"} 1',
+            'latency_sum{form="a"} 0.5',
+            'latency_count{form="a"} 1',
+        ]
+
+
+class TestCounter:
+    def test_series_per_label_set(self):
+        c = Counter("requests", "Requests.")
+        c.inc(status=200)
+        c.inc(status=200)
+        c.inc(status=400)
+        assert c.get(status=200) == 2
+        assert c.get(status=400) == 1
+        assert c.get(status=500) == 0
+
+
+class TestRegistry:
+    def test_exposes_all_metrics(self):
+        r = Registry()
+        r.add(Counter("a_total", "A.")).inc()
+        r.add(Counter("b_total", "B.")).inc(2)
+        text = r.expose()
+        assert "a_total 1\n" in text
+        assert "b_total 2\n" in text
@@ -0,0 +1,94 @@
+import io
+
+import pytest
+from PyPDF2 import PdfReader
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from ct600_fill.optimise import OptimisingWriter, compress_stream, dedupe
+from ct600_fill.render import create_pdf
+
+
+def fill(template, annotations, engine, optimise):
+    buffer = io.BytesIO()
+    create_pdf(buffer, template, annotations, engine=engine,
+               optimise=optimise)
+    return buffer.getvalue()
+
+
+class TestCompressStream:
+    def test_compresses_uncompressed(self):
+        stream = DecodedStreamObject()
+        stream.set_data(b"BT /F1 12 Tf (hello) Tj ET\n" * 100)
+        out = compress_stream(stream)
+        assert out["/Filter"] == "/FlateDecode"
+        assert out.get_data() == stream.get_data()
+        assert len(out._data) < len(stream._data)
+
+    def test_leaves_metadata_readable(self):
+        stream = DecodedStreamObject()
+        stream.set_data(b"<x:xmpmeta/>" * 100)
+        stream[NameObject("/Type")] = NameObject("/Metadata")
+        assert "/Filter" not in compress_stream(stream)
+
+
+class TestDedupe:
+    def test_identical_objects_merged(self):
+        font = DictionaryObject({
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/BaseFont"): NameObject("/Courier-Bold"),
+        })
+        other = DictionaryObject(font)
+        assert dedupe([font, other]) == [1, 1]
+
+    def test_kept_objects_not_merged(self):
+        page = DictionaryObject({NameObject("/Type"): NameObject("/Page")})
+        assert dedupe([page, DictionaryObject(page)], {1, 2}) == [1, 2]
+
+
+class TestOptimisingWriter:
+    @pytest.mark.parametrize("engine", ["reportlab", "direct"])
+    def test_smaller_with_same_text(self, template, annotations, engine):
+        plain = fill(template, annotations, engine, False)
+        optimised = fill(template, annotations, engine, True)
+        assert len(optimised) < len(plain)
+        a = PdfReader(io.BytesIO(plain))
+        b = PdfReader(io.BytesIO(optimised))
+        assert len(b.pages) == len(a.pages)
+        for x, y in zip(a.pages, b.pages):
+            assert y.extract_text() == x.extract_text()
+
+    def test_unused_resources_dropped(self, template):
+        output = OptimisingWriter()
+        page = output.add_page(template.pages[0])
+        resources = DictionaryObject(page["/Resources"])
+        fonts = DictionaryObject(resources["/Font"])
+        fonts[NameObject("/Unused")] = DictionaryObject({
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/BaseFont"): NameObject("/Helvetica"),
+        })
+        resources[NameObject("/Font")] = fonts
+        page[NameObject("/Resources")] = resources
+        buffer = io.BytesIO()
+        output.write(buffer)
+        fonts = PdfReader(buffer).pages[0]["/Resources"]["/Font"]
+        assert "/Unused" not in fonts
+        assert set(fonts) == set(template.pages[0]["/Resources"]["/Font"])
+
+    def test_content_streams_compressed(self, template, annotations):
+        pdf = PdfReader(io.BytesIO(fill(template, annotations, "direct",
+                                        True)))
+        for page in pdf.pages:
+            for stream in page["/Contents"]:
+                assert stream.get_object().get("/Filter") == "/FlateDecode" \
+                    or len(stream.get_object().get_data()) < 8
+
+    def test_template_pages_pass_through(self, template):
+        output = OptimisingWriter()
+        for page in template.pages:
+            output.add_page(page)
+        buffer = io.BytesIO()
+        output.write(buffer)
+        pdf = PdfReader(buffer)
+        assert len(pdf.pages) == len(template)
+        assert pdf.pages[0].extract_text() == \
+            template.pages[0].extract_text()
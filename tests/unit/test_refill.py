@@ -0,0 +1,76 @@
+import os
+
+import pytest
+from PyPDF2 import PdfReader
+
+from ct600_fill.annotations import create_annotations
+from ct600_fill.refill import (
+    get_page_keys,
+    get_state_path,
+    refill_pdf,
+)
+
+
+def values(name="Example Ltd", reason="Dog ate it", amount=100):
+    return {"ct600": {1: name, 90: reason, 145: amount}}
+
+
+class TestGetPageKeys:
+    def test_key_per_template_page(self, template, spec):
+        keys = get_page_keys(template, create_annotations(values(), spec), "direct")
+        assert sorted(keys) == list(range(len(template)))
+
+    def test_only_changed_page_key_changes(self, template, spec):
+        before = get_page_keys(template, create_annotations(values(), spec), "direct")
+        after = get_page_keys(template, create_annotations(values(reason="Cat"), spec), "direct")
+        assert [p for p in before if before[p] != after[p]] == [1]
+
+    def test_engine_is_part_of_key(self, template, spec):
+        annotations = create_annotations(values(), spec)
+        direct = get_page_keys(template, annotations, "direct")
+        reportlab = get_page_keys(template, annotations, "reportlab")
+        assert direct[0] != reportlab[0]
+
+
+class TestRefillPdf:
+    @pytest.mark.parametrize("engine", ["direct", "reportlab"])
+    def test_rerenders_only_changed_pages(self, tmp_path, template, spec, engine):
+        output = str(tmp_path / "out.pdf")
+
+        first = refill_pdf(output, template, create_annotations(values(), spec), engine)
+        assert first == list(range(len(template)))
+
+        second = refill_pdf(output, template, create_annotations(values(), spec), engine)
+        assert second == []
+
+        third = refill_pdf(output, template, create_annotations(values(amount=250), spec), engine)
+        assert third == [2]
+
+        reader = PdfReader(output)
+        assert len(reader.pages) == len(template)
+        assert "Example Ltd" in reader.pages[0].extract_text()
+        assert "250" in reader.pages[2].extract_text()
+
+    def test_removed_value_rerenders_page(self, tmp_path, template, spec):
+        output = str(tmp_path / "out.pdf")
+        refill_pdf(output, template, create_annotations(values(), spec), "direct")
+
+        doc = values()
+        del doc["ct600"][90]
+        assert refill_pdf(output, template, create_annotations(doc, spec), "direct") == [1]
+        assert "Dog ate it" not in PdfReader(output).pages[1].extract_text()
+
+    def test_modified_output_is_not_reused(self, tmp_path, template, spec):
+        output = str(tmp_path / "out.pdf")
+        refill_pdf(output, template, create_annotations(values(), spec), "direct")
+
+        with open(output, "ab") as f:
+            f.write(b"\n% edited\n")
+
+        pages = refill_pdf(output, template, create_annotations(values(), spec), "direct")
+        assert pages == list(range(len(template)))
+
+    def test_state_written_next_to_output(self, tmp_path, template, spec):
+        output = str(tmp_path / "out.pdf")
+        refill_pdf(output, template, create_annotations(values(), spec), "direct")
+        assert os.path.exists(get_state_path(output))
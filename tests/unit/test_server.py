@@ -0,0 +1,209 @@
+import http.client
+import os
+import socket
+import threading
+
+import pytest
+
+from ct600_fill.server import (
+    FillServer,
+    Form,
+    RequestError,
+    make_server,
+    parse_form,
+)
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CT600_PDF = os.path.join(PROJECT_DIR, "CT600.pdf")
+CT600_2023_PDF = os.path.join(PROJECT_DIR, "CT600-2023-v3.pdf")
+SPEC_JSON = os.path.join(PROJECT_DIR, "spec.json")
+SPEC_2023_JSON = os.path.join(PROJECT_DIR, "spec-ct600-2023-v3.json")
+
+VALUES = b"ct600:\n  1: Example Biz Ltd.\n  30: 2020-01-01\n"
+
+
+@pytest.fixture(scope="module")
+def fill_server():
+    return FillServer([
+        Form("2025", CT600_PDF, SPEC_JSON),
+        Form("2023", CT600_2023_PDF, SPEC_2023_JSON),
+    ], engine="direct")
+
+
+@pytest.fixture
+def server(fill_server):
+    httpd = make_server(fill_server, port=0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def streaming_server():
+    fill_server = FillServer([Form("2025", CT600_PDF, SPEC_JSON)],
+                             engine="direct", streaming=True)
+    httpd = make_server(fill_server, port=0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def request(address, method, path, body=None):
+    conn = http.client.HTTPConnection(*address, timeout=30)
+    conn.request(method, path, body=body)
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    return response.status, data
+
+
+def post_raw(address, headers):
+    with socket.create_connection(address, timeout=30) as sock:
+        sock.sendall(b"POST /fill HTTP/1.1\r\nHost: localhost\r\n" +
+                     headers + b"Connection: close\r\n\r\n")
+        data = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    return int(data.split(b" ", 2)[1])
+
+
+def get_response(address, path, body):
+    conn = http.client.HTTPConnection(*address, timeout=30)
+    conn.request("POST", path, body=body)
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    return response, data
+
+
+class TestParseForm:
+    def test_parses_name_template_spec(self):
+        assert parse_form("2023=a.pdf,b.json") == ("2023", "a.pdf", "b.json")
+
+    def test_rejects_bad_form(self):
+        with pytest.raises(ValueError):
+            parse_form("a.pdf")
+
+
+class TestFillServer:
+    def test_default_form_is_first(self, fill_server):
+        assert fill_server.get_form("/fill").name == "2025"
+
+    def test_named_form(self, fill_server):
+        assert fill_server.get_form("/fill/2023").name == "2023"
+
+    def test_unknown_form(self, fill_server):
+        with pytest.raises(RequestError) as e:
+            fill_server.get_form("/fill/1999")
+        assert e.value.status == 404
+
+    def test_bad_value_is_request_error(self, fill_server):
+        form = fill_server.get_form("/fill")
+        with pytest.raises(RequestError) as e:
+            fill_server.fill(form, b"ct600:\n  30: not-a-date\n")
+        assert e.value.status == 400
+
+
+class TestServerHTTP:
+    def test_fill_returns_pdf(self, server):
+        status, data = request(server, "POST", "/fill/2023", VALUES)
+        assert status == 200
+        assert data[:5] == b"%PDF-"
+
+    def test_buffered_by_default(self, server):
+        response, data = get_response(server, "/fill", VALUES)
+        assert response.getheader("Content-Length") == str(len(data))
+        with open(CT600_PDF, "rb") as f:
+            assert not data.startswith(f.read())
+
+    def test_streaming(self, streaming_server):
+        response, data = get_response(streaming_server, "/fill", VALUES)
+        assert response.status == 200
+        assert response.getheader("Content-Length") is None
+        with open(CT600_PDF, "rb") as f:
+            assert data.startswith(f.read())
+
+    def test_accepts_json_body(self, server):
+        status, data = request(server, "POST", "/fill", b'{"ct600": {"1": "Json Ltd"}}')
+        assert status == 200
+        assert data[:5] == b"%PDF-"
+
+    def test_missing_ct600_is_bad_request(self, server):
+        status, data = request(server, "POST", "/fill", b"other: 1\n")
+        assert status == 400
+
+    @pytest.mark.parametrize("headers, status", [
+        (b"", 411),
+        (b"Content-Length: lots\r\n", 400),
+        (b"Content-Length: -1\r\n", 400),
+    ])
+    def test_bad_content_length(self, server, headers, status):
+        assert post_raw(server, headers) == status
+
+    def test_concurrent_requests(self, server):
+        results = []
+
+        def worker(path):
+            results.append(request(server, "POST", path, VALUES))
+
+        threads = [
+            threading.Thread(target=worker, args=(path,))
+            for path in ["/fill", "/fill/2023"] * 4
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(results) == 8
+        for status, data in results:
+            assert status == 200
+            assert data[:5] == b"%PDF-"
+
+    def test_metrics_has_latency_histogram(self, server):
+        request(server, "POST", "/fill/2023", VALUES)
+        status, data = request(server, "GET", "/metrics")
+        assert status == 200
+        assert b'ct600_fill_request_duration_seconds_count{form="2023"}' in data
+        assert b'ct600_fill_requests_total{form="2023",status="200"}' in data
+
+    def test_metrics_has_stage_histogram(self, server):
+        request(server, "POST", "/fill/2023", VALUES)
+        status, data = request(server, "GET", "/metrics")
+        assert b'ct600_fill_stage_duration_seconds_count{form="2023",page="0",stage="add_overlay"}' in data
+        assert b'ct600_fill_stage_duration_seconds_count{form="2023",stage="write"}' in data
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        http.client.HTTPConnection.__init__(self, "localhost", timeout=30)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+class TestServerUnixSocket:
+    def test_fill_over_unix_socket(self, fill_server, tmp_path):
+        path = str(tmp_path / "fill.sock")
+        httpd = make_server(fill_server, socket=path)
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        try:
+            conn = UnixHTTPConnection(path)
+            conn.request("POST", "/fill", body=VALUES)
+            response = conn.getresponse()
+            assert response.status == 200
+            assert response.read()[:5] == b"%PDF-"
+            conn.close()
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
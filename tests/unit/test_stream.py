@@ -0,0 +1,74 @@
+import io
+
+import pytest
+from PyPDF2 import PdfReader
+
+from ct600_fill.annotations import WriteString, create_annotations
+from ct600_fill.render import create_pdf
+from ct600_fill.stream import StreamingWriter, get_size, get_startxref
+
+
+# Accepts writes only, like a pipe or socket.
+class WriteOnly:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+
+    def getvalue(self):
+        return b"".join(self.chunks)
+
+
+def fill(template, annotations, engine):
+    out = WriteOnly()
+    create_pdf(out, template, annotations, engine=engine, streaming=True)
+    return out.getvalue()
+
+
+class TestHelpers:
+    def test_get_startxref(self):
+        assert get_startxref(b"...\nstartxref\n1234\n%%EOF\n") == 1234
+
+    def test_get_startxref_cr_line_endings(self):
+        assert get_startxref(b"...\rstartxref\r116\r%%EOF\r") == 116
+
+    def test_get_size(self, template):
+        size = get_size(template.reader)
+        assert size > template.pages[-1].indirect_reference.idnum
+
+
+class TestStreamingWriter:
+    @pytest.mark.parametrize("engine", ["direct", "reportlab"])
+    def test_output_is_template_plus_update(self, template, annotations, engine):
+        data = fill(template, annotations, engine)
+        assert data.startswith(template.data)
+        assert data.endswith(b"%%EOF\n")
+
+    @pytest.mark.parametrize("engine", ["direct", "reportlab"])
+    def test_output_readable_with_values(self, template, annotations, engine):
+        reader = PdfReader(io.BytesIO(fill(template, annotations, engine)))
+        assert len(reader.pages) == len(template)
+        assert "Example Biz Ltd." in reader.pages[0].extract_text()
+
+    def test_unannotated_pages_not_rewritten(self, template):
+        data = fill(template, {}, "direct")
+        update = data[len(template.data):]
+        assert b" obj" not in update
+
+    def test_only_annotated_pages_rewritten(self, template):
+        annotations = create_annotations(
+            {"ct600": {1: "Only Page"}}, {1: [WriteString(2, 20, 20)]}
+        )
+        data = fill(template, annotations, "direct")
+        update = data[len(template.data):]
+        page_id = template.pages[2].indirect_reference.idnum
+        assert (b"\n%d 0 obj" % page_id) in update
+        other_id = template.pages[0].indirect_reference.idnum
+        assert (b"\n%d 0 obj" % other_id) not in update
+
+    def test_pages_must_be_in_template_order(self, template):
+        writer = StreamingWriter(template)
+        with pytest.raises(ValueError):
+            writer.add_page(template.pages[1])
+
@@ -0,0 +1,94 @@
+import io
+import mmap
+import os
+
+from PyPDF2 import PdfReader
+
+from ct600_fill.annotations import create_annotations, get_spec
+from ct600_fill.render import create_pdf
+from ct600_fill.template import TemplateCache
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CT600_PDF = os.path.join(PROJECT_DIR, "CT600.pdf")
+CT600_2023_PDF = os.path.join(PROJECT_DIR, "CT600-2023-v3.pdf")
+SPEC_JSON = os.path.join(PROJECT_DIR, "spec.json")
+
+
+def fill(template, annotations):
+    buffer = io.BytesIO()
+    create_pdf(buffer, template, annotations)
+    buffer.seek(0)
+    return buffer
+
+
+class TestTemplate:
+    def test_page_count(self, template):
+        assert len(template) == len(PdfReader(CT600_PDF).pages)
+
+    def test_masters_made_on_first_clone(self):
+        template = TemplateCache().get(CT600_PDF)
+        assert template.masters == {}
+        clone = template.clone_page(2)
+        assert list(template.masters) == [2]
+        assert clone["/Contents"] is template.masters[2]["/Contents"]
+
+    def test_unannotated_pages_not_decoded(self):
+        template = TemplateCache().get(CT600_PDF)
+        buffer = io.BytesIO()
+        create_pdf(buffer, template, create_annotations(
+            {"ct600": {1: "Example Biz Ltd."}}, get_spec(SPEC_JSON)
+        ), engine="direct")
+        assert template.masters == {}
+        for page in template.pages[1:]:
+            assert page["/Contents"].get_object().decoded_self is None
+
+    def test_clone_is_independent_of_master(self, template):
+        clone = template.clone_page(0)
+        clone.merge_page(template.clone_page(1))
+        assert clone["/Contents"] is not template.masters[0]["/Contents"]
+        assert template.clone_page(0)["/Contents"] is template.masters[0]["/Contents"]
+
+    def test_template_reusable_across_outputs(self, template, annotations):
+        first = PdfReader(fill(template, annotations))
+        second = PdfReader(fill(template, annotations))
+        assert len(first.pages) == len(second.pages) == len(template)
+        for a, b in zip(first.pages, second.pages):
+            assert a.extract_text() == b.extract_text()
+
+    def test_filled_values_appear(self, template, annotations):
+        output = PdfReader(fill(template, annotations))
+        assert "Example Biz Ltd." in output.pages[0].extract_text()
+
+    def test_unannotated_fill_matches_template_text(self, template):
+        output = PdfReader(fill(template, {}))
+        original = PdfReader(CT600_PDF)
+        assert output.pages[0].extract_text() == original.pages[0].extract_text()
+
+
+class TestTemplateCache:
+    def test_file_is_mapped(self):
+        template = TemplateCache().get(CT600_PDF)
+        assert isinstance(template.data, mmap.mmap)
+        buffer = io.BytesIO()
+        create_pdf(buffer, template, {}, streaming=True)
+        assert buffer.getvalue().startswith(template.data[:1024])
+
+    def test_mapped_and_read_templates_share_entry(self):
+        cache = TemplateCache()
+        with open(CT600_PDF, "rb") as f:
+            read = cache.get_data(f.read())
+        assert cache.get(CT600_PDF) is read
+        assert len(cache) == 1
+
+    def test_same_file_parsed_once(self):
+        cache = TemplateCache()
+        assert cache.get(CT600_PDF) is cache.get(CT600_PDF)
+        assert len(cache) == 1
+
+    def test_templates_cached_side_by_side(self):
+        cache = TemplateCache()
+        old = cache.get(CT600_2023_PDF)
+        new = cache.get(CT600_PDF)
+        assert old is not new
+        assert old.digest != new.digest
+        assert len(cache) == 2
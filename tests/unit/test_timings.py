@@ -0,0 +1,78 @@
+import io
+
+from ct600_fill.metrics import Histogram
+from ct600_fill.timings import (
+    Timings,
+    get_histogram_record,
+    get_stage_histogram,
+    report_histogram,
+    timed,
+)
+
+
+class TestTimings:
+    def test_stage_records_duration(self):
+        timings = Timings()
+        with timings.stage("load"):
+            pass
+        with timings.stage("get_page", 3):
+            pass
+        assert [(s, p) for s, p, _ in timings.records] == [("load", None), ("get_page", 3)]
+        assert all(seconds >= 0 for _, _, seconds in timings.records)
+
+    def test_feeds_histogram_with_labels(self):
+        histogram = get_stage_histogram()
+        timings = Timings(histogram, form="2025")
+        timings.add("merge_page", 0.002, page=1)
+        timings.add("write", 0.01)
+        snapshot = histogram.snapshot()
+        assert snapshot[(("form", "2025"), ("page", 1), ("stage", "merge_page"))][2] == 1
+        assert snapshot[(("form", "2025"), ("stage", "write"))][1] == 0.01
+
+    def test_timed_without_timings(self):
+        with timed(None, "load"):
+            pass
+
+    def test_timed_records(self):
+        timings = Timings()
+        with timed(timings, "write"):
+            pass
+        assert timings.records[0][0] == "write"
+
+    def test_get_record(self):
+        timings = Timings()
+        timings.add("load", 0.5)
+        timings.add("get_page", 0.25, page=0)
+        record = timings.get_record(input="x.yaml")
+        assert record["input"] == "x.yaml"
+        assert record["stages"][1] == {"stage": "get_page", "page": 0, "seconds": 0.25}
+        assert record["total"] == 0.75
+
+    def test_report(self):
+        timings = Timings()
+        timings.add("get_page", 0.001, page=2)
+        out = io.StringIO()
+        timings.report(out)
+        assert "get_page page 2" in out.getvalue()
+        assert "total" in out.getvalue()
+
+
+class TestHistogramReport:
+    def test_slowest_first(self):
+        histogram = get_stage_histogram()
+        histogram.observe(0.001, stage="load")
+        histogram.observe(0.5, stage="merge_page", page=7)
+        out = io.StringIO()
+        report_histogram(histogram, out)
+        lines = out.getvalue().splitlines()
+        assert "merge_page page 7" in lines[0]
+        assert "load" in lines[1]
+
+    def test_histogram_record(self):
+        histogram = Histogram("h", "help", (1.0,))
+        histogram.observe(0.5, stage="write")
+        record = get_histogram_record(histogram)
+        assert record["buckets"] == [1.0]
+        assert record["series"] == [
+            {"labels": {"stage": "write"}, "counts": [1, 1], "sum": 0.5, "count": 1}
+        ]
@@ -0,0 +1,96 @@
+import datetime
+import os
+
+import pytest
+
+from ct600_fill.inputs import read_values
+from ct600_fill.validate import ValidationError, Validator
+from ct600_fill.annotations import (
+    SpaceMoney,
+    SpacePounds,
+    SpaceZeroPadNumber,
+    WriteBool,
+    WritePounds,
+    WriteSpaceDate,
+    WriteSpaceSortCode,
+    WriteString,
+    get_spec,
+)
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def validator():
+    return Validator({
+        1: [WriteString(0, 1, 2)],
+        4: [SpaceZeroPadNumber(0, 1, 2, 3, 2)],
+        30: [WriteSpaceDate(0, 1, 2, 3, 4, 5, 6, 7)],
+        40: [WriteBool(0, 1, 2)],
+        145: [WritePounds(0, 1, 2)],
+        155: [SpacePounds(0, 1, 2, 3, 5), SpacePounds(1, 1, 2, 3, 5)],
+        160: [SpaceMoney(0, 1, 2, 3, 4, 5, 4)],
+        920: [WriteSpaceSortCode(0, 1, 2, 3, 4, 5, 6, 7)],
+    })
+
+
+def errors(validator, **boxes):
+    return validator.validate({"ct600": {int(k[1:]): v for k, v in boxes.items()}})
+
+
+class TestValidator:
+    def test_valid_values(self, validator):
+        assert errors(
+            validator, b1="Example Ltd", b4="06", b30=datetime.date(2020, 1, 1),
+            b40=True, b145="1234.5", b155=12345, b160=1234.56, b920="123456",
+        ) == []
+
+    def test_bad_date(self, validator):
+        assert errors(validator, b30="01/01/2020") == [
+            "box 30: not a YYYY-MM-DD date: '01/01/2020'"
+        ]
+
+    def test_non_numeric_pounds(self, validator):
+        assert errors(validator, b145="lots") == ["box 145: not a number: 'lots'"]
+
+    def test_too_many_digits(self, validator):
+        assert errors(validator, b155=123456, b160=12345) == [
+            "box 155: 123456 is longer than 5 digits",
+            "box 160: 12345 is longer than 4 digits",
+        ]
+
+    def test_zero_pad_needs_whole_number(self, validator):
+        assert errors(validator, b4="6.5") == ["box 4: not a whole number: '6.5'"]
+
+    def test_sort_code(self, validator):
+        assert errors(validator, b920="12-34-56") == [
+            "box 920: sort code should be 6 digits: '12-34-56'"
+        ]
+
+    def test_bool(self, validator):
+        assert errors(validator, b40="yes") == ["box 40: should be true or false: 'yes'"]
+
+    def test_reports_every_error(self, validator):
+        assert len(errors(validator, b30="x", b145="y", b920="z")) == 3
+
+    def test_empty_and_unknown_boxes_ignored(self, validator):
+        assert errors(validator, b30=None, b999="x") == []
+
+    def test_get_unknown(self, validator):
+        assert validator.get_unknown({"ct600": {1: "x", 999: "y"}}) == [999]
+
+    def test_not_a_values_document(self, validator):
+        assert validator.validate([1, 2]) == ["values document needs a ct600 object"]
+
+    def test_check_raises(self, validator):
+        with pytest.raises(ValidationError) as e:
+            validator.check({"ct600": {30: "x", 145: "y"}})
+        assert len(e.value.errors) == 2
+
+    @pytest.mark.parametrize("spec", [
+        "spec.json", "spec-ct600-2023-v3.json", "spec-ct600-2025-v3.json",
+    ])
+    def test_all_values_valid(self, spec):
+        validator = Validator(get_spec(os.path.join(PROJECT_DIR, spec)))
+        values = read_values(os.path.join(PROJECT_DIR, "all-values.yaml"))
+        assert validator.validate(values) == []